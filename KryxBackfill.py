@@ -0,0 +1,249 @@
+"""
+KryxBackfill - Post-processing of many archived versions at once
+
+Outputs are kept per version (KRYX_v<version>, KRYX_SPELLS_v<version>), and post-processing
+(cleaning the spell CSV, indexing spells, re-assembling the compiled PDF) used to be one
+sequential run per version. The backfill finds every version directory in the export
+directory and runs the selected tasks for each version in a process pool, one version per
+process. A task is skipped when its output is newer than all of its inputs, so running the
+backfill again only redoes what changed. The status of every task of every version is
+written to a single summary file:
+
+    python KryxBackfill.py --export-dir . --tasks spells spell_index pdf --workers 4
+"""
+import os
+import re
+import csv
+import json
+import time
+import argparse
+import traceback
+import concurrent.futures
+import KryxCache
+import KryxPages
+import KryxExtractor
+import KryxSpellExtractor
+
+DEFAULT_EXPORT_DIR = KryxExtractor.DEFAULT_EXPORT_DIR   # Directory holding the version directories
+DEFAULT_TASKS = ['spells', 'spell_index', 'pdf']        # Tasks to run for every version, in order
+DEFAULT_MAX_WORKERS = None                              # Number of versions processed at once (CPU count if None)
+DEFAULT_STATUS_FILE = 'KRYX_backfill.json'              # Summary of the status of every task of every version
+DEFAULT_SPELL_INDEX = 'KRYX_SPELLS_index.json'          # Filename of the spell index, in the spell CSV directory
+SITE_REPLACER = KryxExtractor.DEFAULT_URL_REPLACER
+SPELLS_REPLACER = KryxSpellExtractor.DEFAULT_URL_REPLACE
+VERSION_DIR_REGEX = re.compile(r'^(%s|%s)_v(.+)$' % (re.escape(SPELLS_REPLACER), re.escape(SITE_REPLACER)))
+STATUS_DONE = 'done'
+STATUS_CURRENT = 'current'
+STATUS_MISSING = 'missing'
+STATUS_FAILED = 'failed'
+
+
+def version_sort_key(version):
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part) for part in re.split(r'[.\-_]', version)]
+
+
+def discover_versions(export_dir):
+    """Find the version directories of an export directory.
+        Args: export_dir (str) - the export directory
+        Kwargs: None
+        Output: versions (dict[str:dict[str:str]]) - for each version, the path of its site and/or spell directory
+                                                     keyed by 'site' and 'spells', oldest version first
+        External State: No change
+    """
+    versions = dict()
+    for entry in os.listdir(export_dir):
+        match = VERSION_DIR_REGEX.match(entry)
+        if match is None or not os.path.isdir(os.path.join(export_dir, entry)):
+            continue
+        kind = 'spells' if match.group(1) == SPELLS_REPLACER else 'site'
+        versions.setdefault(match.group(2), dict())[kind] = os.path.join(export_dir, entry)
+    return {version: versions[version] for version in sorted(versions, key=version_sort_key)}
+
+
+def _newest(paths):
+    newest = 0.0
+    for path in paths:
+        if os.path.isdir(path):
+            newest = max([newest, os.path.getmtime(path)] +
+                         [os.path.getmtime(os.path.join(path, name)) for name in os.listdir(path)])
+        elif os.path.exists(path):
+            newest = max(newest, os.path.getmtime(path))
+    return newest
+
+
+def is_current(output, inputs):
+    """Whether an output is newer than all of its inputs.
+        Args: output (str) - the output file
+              inputs (list[str]) - input files and directories (the files in a directory count too)
+        Kwargs: None
+        Output: current (bool) - whether the output exists and is up to date
+        External State: No change
+    """
+    return os.path.exists(output) and os.path.getmtime(output) >= _newest(inputs)
+
+
+def _spell_extractor(version, export_dir):
+    return KryxSpellExtractor.KryxSpellExtractor(version=version, export_dir=export_dir, start_selenium=False,
+                                                 cache_pages=False)
+
+
+def backfill_spells(version, dirs, export_dir, force=False):
+    """Clean the extracted spell CSV of a version.
+        Args: version (str) - the version
+              dirs (dict[str:str]) - the version's directories
+              export_dir (str) - the export directory
+        Kwargs: force (bool) - run even if the cleaned CSV is current
+        Output: status (str) - status of the task
+        External State: cleaned spell CSV exists
+    """
+    if 'spells' not in dirs:
+        return STATUS_MISSING
+    extractor = _spell_extractor(version, export_dir)
+    csv_file = extractor.make_output_filename(extractor.start_url, 'csv')
+    if not os.path.exists(csv_file):
+        return STATUS_MISSING
+    if not force and is_current(extractor.clean_csv_filename(), [csv_file]):
+        return STATUS_CURRENT
+    extractor.clean_csv(csv_file)
+    return STATUS_DONE
+
+
+def backfill_spell_index(version, dirs, export_dir, force=False):
+    """Index the spells of a version by name, from the cleaned spell CSV if there is one.
+        Args: version (str) - the version
+              dirs (dict[str:str]) - the version's directories
+              export_dir (str) - the export directory
+        Kwargs: force (bool) - run even if the index is current
+        Output: status (str) - status of the task
+        External State: spell index exists in the spell CSV directory
+    """
+    if 'spells' not in dirs:
+        return STATUS_MISSING
+    csv_dir = os.path.join(dirs['spells'], KryxSpellExtractor.DEFAULT_CSV_SUBDIR)
+    csv_file = os.path.join(csv_dir, '%s%s.csv' % (SPELLS_REPLACER, KryxSpellExtractor.DEFAULT_CLEAN_SUFFIX))
+    if not os.path.exists(csv_file):
+        csv_file = os.path.join(csv_dir, '%s.csv' % SPELLS_REPLACER)
+    if not os.path.exists(csv_file):
+        return STATUS_MISSING
+    output = os.path.join(csv_dir, DEFAULT_SPELL_INDEX)
+    if not force and is_current(output, [csv_file]):
+        return STATUS_CURRENT
+    with open(csv_file, 'r', encoding='utf-8', newline='') as file:
+        index = {row['name'].strip().lower(): row for row in csv.DictReader(file) if row.get('name')}
+    KryxCache.write_atomic(output, json.dumps(dict(version=version, spells=index), indent=2).encode('utf-8'))
+    return STATUS_DONE
+
+
+def backfill_pdf(version, dirs, export_dir, force=False):
+    """Re-assemble the compiled PDF of a version from its page PDFs and page manifest.
+        Args: version (str) - the version
+              dirs (dict[str:str]) - the version's directories
+              export_dir (str) - the export directory
+        Kwargs: force (bool) - run even if the compiled PDF is current
+        Output: status (str) - status of the task
+        External State: compiled PDF exists
+    """
+    if 'site' not in dirs:
+        return STATUS_MISSING
+    manifest = os.path.join(dirs['site'], KryxExtractor.DEFAULT_PAGE_MANIFEST)
+    pdf_dir = os.path.join(dirs['site'], KryxExtractor.DEFAULT_PDF_SUBDIR)
+    if not os.path.exists(manifest) or not os.path.isdir(pdf_dir):
+        return STATUS_MISSING
+    output = os.path.join(dirs['site'], "%s_v%s_compiled.pdf" % (SITE_REPLACER, version))
+    if not force and is_current(output, [manifest, pdf_dir]):
+        return STATUS_CURRENT
+    extractor = KryxExtractor.KryxEtractor(version=version, export_dir=export_dir, path=dirs['site'],
+                                           start_selenium=False, cache_pages=False)
+    extractor.pages = KryxPages.PageRegistry.load(manifest)
+    extractor.history = extractor.pages.urls
+    for record in extractor.pages:
+        if record.pdf_path is not None and not os.path.exists(record.pdf_path):
+            record.pdf_path = None      # written from another working directory, use this version's path
+    extractor.export_final_pdf()
+    return STATUS_DONE
+
+
+TASKS = dict(spells=backfill_spells, spell_index=backfill_spell_index, pdf=backfill_pdf)
+
+
+def backfill_version(version, dirs, export_dir, tasks=DEFAULT_TASKS, force=False):
+    """Run the backfill tasks of one version. A failing task does not stop the next ones.
+        Args: version (str) - the version
+              dirs (dict[str:str]) - the version's directories
+              export_dir (str) - the export directory
+        Kwargs: tasks (list[str]) - names of the tasks to run, in order
+                force (bool) - run tasks even if their outputs are current
+        Output: status (dict) - status, error and seconds taken of each task
+        External State: outputs of the tasks exist
+    """
+    status = dict()
+    for task in tasks:
+        start = time.time()
+        try:
+            status[task] = dict(status=TASKS[task](version, dirs, export_dir, force=force))
+        except Exception as ex:
+            status[task] = dict(status=STATUS_FAILED, error="%s: %s" % (type(ex).__name__, ex),
+                                traceback=traceback.format_exc())
+        status[task]['seconds'] = round(time.time() - start, 3)
+    return status
+
+
+def backfill(export_dir=DEFAULT_EXPORT_DIR, tasks=DEFAULT_TASKS, versions=None, max_workers=DEFAULT_MAX_WORKERS,
+             force=False, status_file=DEFAULT_STATUS_FILE):
+    """Run the backfill tasks of every version directory of an export directory in a
+        process pool, and write the summary of their status.
+        Args: None
+        Kwargs: export_dir (str) - the export directory
+                tasks (list[str]) - names of the tasks to run for every version, in order
+                versions (list[str]) - versions to process, all discovered versions if None
+                max_workers (int) - number of versions processed at once, CPU count if None
+                force (bool) - run tasks even if their outputs are current
+                status_file (str) - filename of the summary, in the export directory
+        Output: summary (dict[str:dict]) - status of every task of every version
+        External State: outputs of the tasks exist, summary exists in the export directory
+    """
+    for task in tasks:
+        if task not in TASKS:
+            raise ValueError("Backfill task %s is not supported (one of %s)" % (task, ', '.join(TASKS)))
+    found = discover_versions(export_dir)
+    if versions is not None:
+        found = {version: dirs for version, dirs in found.items() if version in versions}
+    summary = dict()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {version: executor.submit(backfill_version, version, dirs, export_dir, tasks=tasks, force=force)
+                   for version, dirs in found.items()}
+        for version, future in futures.items():
+            try:
+                summary[version] = future.result()
+            except Exception as ex:        # the worker process itself died
+                summary[version] = {task: dict(status=STATUS_FAILED, error="%s: %s" % (type(ex).__name__, ex))
+                                    for task in tasks}
+    KryxCache.write_atomic(os.path.join(export_dir, status_file),
+                           json.dumps(summary, indent=2).encode('utf-8'))
+    return summary
+
+
+def format_summary(summary):
+    """One line per version with the status of each of its tasks.
+        Args: summary (dict[str:dict]) - status of every task of every version
+        Kwargs: None
+        Output: text (str) - the formatted summary
+        External State: No change
+    """
+    lines = []
+    for version, status in summary.items():
+        lines.append("%-24s %s" % (version, '  '.join("%s=%s" % (task, result['status']) for task, result in status.items())))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Post-process every archived version in parallel")
+    parser.add_argument('--export-dir', default=DEFAULT_EXPORT_DIR)
+    parser.add_argument('--tasks', nargs='+', default=DEFAULT_TASKS, choices=sorted(TASKS))
+    parser.add_argument('--versions', nargs='+', default=None)
+    parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS)
+    parser.add_argument('--force', action='store_true', help="run tasks even if their outputs are current")
+    parser.add_argument('--status-file', default=DEFAULT_STATUS_FILE)
+    args = parser.parse_args()
+    print(format_summary(backfill(export_dir=args.export_dir, tasks=args.tasks, versions=args.versions,
+                                  max_workers=args.workers, force=args.force, status_file=args.status_file)))
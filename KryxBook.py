@@ -0,0 +1,409 @@
+"""
+KryxBook - Single-file HTML and EPUB books built from the cleaned pages
+
+Rendering every page with wkhtmltopdf and merging the PDFs is by far the slowest part of an
+export, and many readers are just as happy with an HTML book or an EPUB. The book writers
+take each cleaned page as it is rendered and write it out straight away, so all formats are
+produced in the same pass over the site, and formats which are not PDF never render one:
+
+    HtmlBookWriter      - one self-contained HTML file, a contents list and one section per page
+    EpubWriter          - an EPUB 3 book, one XHTML document per page, images stored once
+
+Style rules of all pages are merged into a single stylesheet, each distinct rule written once.
+Links between pages of the site point inside the book: since a page may link to one which is
+not written yet, they are written as placeholders and resolved when the book is closed, to the
+page's section (HTML) or document (EPUB), or back to the site if the page is not in the book.
+Only the contents entries, the key of each page and the merged stylesheet are kept in memory
+until the book is closed.
+"""
+import os
+import re
+import html
+import uuid
+import base64
+import shutil
+import hashlib
+import zipfile
+import datetime
+import bs4
+import KryxUrls
+
+DEFAULT_LANGUAGE = 'en'                     # Language of the book
+STYLE_REGEX = re.compile(r'<style[^>]*>(.*?)</style>', re.DOTALL | re.IGNORECASE)
+BODY_REGEX = re.compile(r'<body[^>]*>(.*)</body>', re.DOTALL | re.IGNORECASE)
+DATA_URI_REGEX = re.compile(r'data:(image/[\w+.-]+);base64,\s*([A-Za-z0-9+/=]+)')
+LINK_PLACEHOLDER = 'kryx-link:%d'
+LINK_REGEX = re.compile(r'kryx-link:(\d+)')
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'}
+FOREIGN_NAMESPACES = {'svg': 'http://www.w3.org/2000/svg', 'math': 'http://www.w3.org/1998/Math/MathML'}
+XML_NAME_REGEX = re.compile(r'^(?:(?:xml|xlink|epub):)?[A-Za-z_][\w.-]*$')
+XML_INVALID_REGEX = re.compile('[^\t\n\r\x20-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]')
+IMAGE_EXTENSIONS = {'image/png': 'png', 'image/jpeg': 'jpg', 'image/gif': 'gif', 'image/svg+xml': 'svg', 'image/webp': 'webp'}
+EPUB_CONTAINER = ('<?xml version="1.0" encoding="utf-8"?>'
+                  '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+                  '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+                  '</rootfiles></container>')
+XHTML_PAGE = ('<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+              '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" '
+              'xmlns:xlink="http://www.w3.org/1999/xlink" xml:lang="%s" lang="%s">'
+              '<head><meta charset="utf-8"/><title>%s</title>'
+              '<link rel="stylesheet" type="text/css" href="style.css"/></head><body>%s</body></html>')
+
+
+def css_blocks(css):
+    """Split a stylesheet into its top level blocks (rules and at-rules), with nested
+        blocks kept inside their at-rule.
+        Args: css (str) - the stylesheet
+        Kwargs: None
+        Output: blocks (list[str]) - the blocks, stripped, in order
+        External State: No change
+    """
+    blocks = []
+    depth = 0
+    start = 0
+    for n, char in enumerate(css):
+        if char == '{':
+            depth += 1
+        elif char == '}' and depth > 0:
+            depth -= 1
+            if depth == 0:
+                block = css[start:n + 1].strip()
+                if len(block) > 0:
+                    blocks.append(block)
+                start = n + 1
+    return blocks
+
+
+def split_page(html_source):
+    """Split a cleaned page into its style rules and its body.
+        Args: html_source (str) - the cleaned page
+        Kwargs: None
+        Output: blocks (list[str]) - style blocks of all style tags of the page
+                body (str) - inner html of the body, without style tags
+        External State: No change
+    """
+    blocks = []
+    for css in STYLE_REGEX.findall(html_source):
+        blocks.extend(css_blocks(css))
+    match = BODY_REGEX.search(html_source)
+    body = match.group(1) if match is not None else html_source
+    return blocks, STYLE_REGEX.sub('', body)
+
+
+def xml_escape(text, quote=False):
+    """Escape text for an XML document, dropping characters XML does not allow."""
+    text = XML_INVALID_REGEX.sub('', text).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    return text.replace('"', '&quot;') if quote else text
+
+
+def _write_xhtml(node, parts):
+    for child in node.children:
+        if isinstance(child, bs4.element.Tag):
+            name = child.name.lower()
+            if XML_NAME_REGEX.match(name) is None:
+                _write_xhtml(child, parts)
+                continue
+            parts.append('<' + name)
+            if name in FOREIGN_NAMESPACES and 'xmlns' not in child.attrs:
+                parts.append(' xmlns="%s"' % FOREIGN_NAMESPACES[name])
+            for attribute, value in child.attrs.items():
+                if XML_NAME_REGEX.match(attribute) is None:
+                    continue
+                if isinstance(value, list):
+                    value = ' '.join(value)
+                parts.append(' %s="%s"' % (attribute, xml_escape(attribute if value is None else value, quote=True)))
+            if name in VOID_ELEMENTS:
+                parts.append('/>')
+                _write_xhtml(child, parts)
+            else:
+                parts.append('>')
+                _write_xhtml(child, parts)
+                parts.append('</%s>' % name)
+        elif isinstance(child, (bs4.element.Comment, bs4.element.Declaration, bs4.element.Doctype,
+                                bs4.element.ProcessingInstruction)):
+            continue
+        else:
+            parts.append(xml_escape(child))
+
+
+def xhtml_fragment(soup):
+    """Serialize parsed html as well-formed XHTML: lower case tags, void elements
+        self-closed, attributes quoted, entities resolved to characters (only &, < and >
+        and quotes are escaped) and comments dropped. Elements and attributes whose names
+        are not valid XML names are left out, keeping the contents of such elements.
+        Args: soup (BeautifulSoup) - the parsed html
+        Kwargs: None
+        Output: xhtml (str) - the serialized children of soup
+        External State: No change
+    """
+    parts = []
+    _write_xhtml(soup, parts)
+    return ''.join(parts)
+
+
+class BookWriter:
+    """BookWriter
+            Base of the book writers: merges style rules and keeps the contents entries.
+
+            Args:
+                filename (str)      -   Path of the book
+                title (str)         -   Title of the book
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | language            |   str                 |   Language of the book |
+                | site_url            |   str                 |   Any url of the site, links to its pages point inside the book (none if None) |
+    """
+    def __init__(self, filename, title, language=DEFAULT_LANGUAGE, site_url=None):
+        self.filename = filename
+        self.title = title
+        self.language = language
+        self.site_url = site_url
+        self.style_blocks = dict()          # insertion ordered, used as an ordered set
+        self.entries = []
+        self.page_keys = dict()
+        self.link_urls = []
+        self.link_numbers = dict()
+        self.pages = 0
+
+    def _add_style(self, blocks):
+        for block in blocks:
+            self.style_blocks.setdefault(block, None)
+
+    def stylesheet(self):
+        return '\n'.join(self.style_blocks)
+
+    def _link_pages(self, soup):
+        """Replace the links of a page to pages of the site with placeholders."""
+        if self.site_url is None:
+            return
+        for anchor in soup.find_all('a', href=True):
+            url = anchor['href'].split('#', 1)[0]
+            if not KryxUrls.same_site(url, self.site_url):
+                continue
+            number = self.link_numbers.get(url)
+            if number is None:
+                number = self.link_numbers[url] = len(self.link_urls)
+                self.link_urls.append(url)
+            anchor['href'] = LINK_PLACEHOLDER % number
+
+    def resolve_links(self, text, href):
+        """Resolve the link placeholders of written pages.
+            Args: text (str) - written pages
+                  href (function) - makes the link of a page from its key
+            Kwargs: None
+            Output: text (str) - the pages, linking to the pages in the book and to the site for the others
+            External State: No change
+        """
+        def resolve(match):
+            url = self.link_urls[int(match.group(1))]
+            key = self.page_keys.get(url)
+            return html.escape(url) if key is None else href(key)
+
+        return LINK_REGEX.sub(resolve, text)
+
+    def add_page(self, key, title, html_source, parent=None, url=None):
+        """Add a page to the book, and a contents entry pointing at it.
+            Args: key (str) - unique key of the page, used as its anchor
+                  title (str) - title of the page
+                  html_source (str) - the cleaned page
+            Kwargs: parent (str) - key of the page whose contents entry this one is nested under
+                    url (str) - canonical url of the page, so links to it point inside the book
+            Output: None
+            External State: page written to the book
+        """
+        blocks, body = split_page(html_source)
+        self._add_style(blocks)
+        soup = bs4.BeautifulSoup(body, 'html.parser')
+        self._link_pages(soup)
+        self._write_page(key, title, soup)
+        self.entries.append((key, title, key, parent))
+        if url is not None:
+            self.page_keys[url] = key
+        self.pages += 1
+
+    def add_alias(self, key, title, target, parent=None, url=None):
+        """Add a contents entry pointing at a page already in the book.
+            Args: key (str) - unique key of the entry
+                  title (str) - title of the entry
+                  target (str) - key of the page it points at
+            Kwargs: parent (str) - key of the entry this one is nested under
+                    url (str) - canonical url of the entry, so links to it point at the target page
+            Output: None
+            External State: No change
+        """
+        self.entries.append((key, title, target, parent))
+        if url is not None:
+            self.page_keys[url] = target
+
+    def contents(self, href):
+        """Nested list of the contents entries, children in the order they were added.
+            Args: href (function) - makes the link of a page from its key
+            Kwargs: None
+            Output: contents (str) - html ordered list
+            External State: No change
+        """
+        keys = set(key for key, title, target, parent in self.entries)
+        children = dict()
+        for entry in self.entries:
+            parent = entry[3] if entry[3] in keys else None
+            children.setdefault(parent, []).append(entry)
+
+        def render(parent):
+            items = []
+            for key, title, target, ignored in children.get(parent, []):
+                items.append('<li><a href="%s">%s</a>%s</li>' % (href(target), html.escape(title), render(key)))
+            return '<ol>%s</ol>' % ''.join(items) if len(items) > 0 else ''
+
+        return render(None)
+
+    def _write_page(self, key, title, soup):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+
+class HtmlBookWriter(BookWriter):
+    """HtmlBookWriter
+            Writes a single self-contained HTML file. Page bodies are written to a part file as
+            they come, and the head, merged stylesheet and contents are put in front on close.
+            Links between pages point at their sections.
+
+            Args:
+                filename (str)      -   Path of the book
+                title (str)         -   Title of the book
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | language            |   str                 |   Language of the book |
+                | site_url            |   str                 |   Any url of the site, links to its pages point inside the book (none if None) |
+    """
+    def __init__(self, filename, title, language=DEFAULT_LANGUAGE, site_url=None):
+        super().__init__(filename, title, language=language, site_url=site_url)
+        self.part_filename = filename + '.part'
+        self.part = open(self.part_filename, 'w', encoding='utf-8')
+
+    @staticmethod
+    def href(key):
+        return '#' + html.escape(key)
+
+    def _write_page(self, key, title, soup):
+        self.part.write('<section id="%s" class="kryx-page">%s</section>\n' % (html.escape(key), soup.decode()))
+
+    def close(self):
+        """Write the finished book and remove the part file.
+            Args: None
+            Kwargs: None
+            Output: None
+            External State: book exists at filename
+        """
+        if self.part is None:
+            return
+        self.part.close()
+        self.part = None
+        title = html.escape(self.title)
+        with open(self.filename, 'w', encoding='utf-8') as file:
+            file.write('<!DOCTYPE html>\n<html lang="%s"><head><meta charset="utf-8"><title>%s</title>'
+                       '<style type="text/css">\n%s\n.kryx-page { page-break-before: always; }\n</style></head><body>'
+                       '<h1>%s</h1><nav id="contents"><h2>Contents</h2>%s</nav>\n'
+                       % (self.language, title, self.stylesheet(), title,
+                          self.contents(self.href)))
+            with open(self.part_filename, 'r', encoding='utf-8') as part:
+                for line in part:
+                    file.write(self.resolve_links(line, self.href))
+            file.write('</body></html>\n')
+        os.remove(self.part_filename)
+
+
+class EpubWriter(BookWriter):
+    """EpubWriter
+            Writes an EPUB 3 book. Each page is serialized as an XHTML document as soon as it
+            comes, with inlined images moved to image files stored once per content. Documents
+            wait in a part directory until close, when links between pages are pointed at their
+            documents and they are added to the archive with the stylesheet, navigation document
+            and package document.
+
+            Args:
+                filename (str)      -   Path of the book
+                title (str)         -   Title of the book
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | language            |   str                 |   Language of the book |
+                | site_url            |   str                 |   Any url of the site, links to its pages point inside the book (none if None) |
+                | identifier          |   str                 |   Unique identifier of the book (random if None) |
+    """
+    def __init__(self, filename, title, language=DEFAULT_LANGUAGE, site_url=None, identifier=None):
+        super().__init__(filename, title, language=language, site_url=site_url)
+        self.identifier = identifier
+        if self.identifier is None:
+            self.identifier = 'urn:uuid:%s' % uuid.uuid4()
+        self.documents = []
+        self.images = dict()
+        self.part_dirname = filename + '.parts'
+        os.makedirs(self.part_dirname, exist_ok=True)
+        self.archive = zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED)
+        self.archive.writestr(zipfile.ZipInfo('mimetype'), 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+        self.archive.writestr('META-INF/container.xml', EPUB_CONTAINER)
+
+    @staticmethod
+    def document_name(key):
+        return '%s.xhtml' % re.sub(r'[^\w-]+', '_', key)
+
+    def _store_image(self, match):
+        data = base64.b64decode(match.group(2))
+        name = 'images/%s.%s' % (hashlib.sha1(data).hexdigest(), IMAGE_EXTENSIONS.get(match.group(1), 'bin'))
+        if name not in self.images:
+            self.archive.writestr('OEBPS/' + name, data)
+            self.images[name] = match.group(1)
+        return name
+
+    def _write_page(self, key, title, soup):
+        body = DATA_URI_REGEX.sub(self._store_image, xhtml_fragment(soup))
+        name = self.document_name(key)
+        with open(os.path.join(self.part_dirname, name), 'w', encoding='utf-8') as part:
+            part.write(XHTML_PAGE % (self.language, self.language, xml_escape(title, quote=True), body))
+        self.documents.append(name)
+
+    def close(self):
+        """Add the stylesheet, navigation and package documents and finish the archive.
+            Args: None
+            Kwargs: None
+            Output: None
+            External State: book exists at filename
+        """
+        if self.archive is None:
+            return
+        for name in self.documents:
+            with open(os.path.join(self.part_dirname, name), 'r', encoding='utf-8') as part:
+                self.archive.writestr('OEBPS/' + name, self.resolve_links(part.read(), self.document_name))
+        shutil.rmtree(self.part_dirname)
+        self.archive.writestr('OEBPS/style.css', self.stylesheet())
+        nav = self.contents(lambda key: self.document_name(key))
+        self.archive.writestr('OEBPS/nav.xhtml', XHTML_PAGE % (
+            self.language, self.language, html.escape(self.title),
+            '<nav epub:type="toc" id="toc"><h1>%s</h1>%s</nav>' % (html.escape(self.title), nav or '<ol><li><a href="nav.xhtml">%s</a></li></ol>' % html.escape(self.title))))
+        manifest = ['<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>',
+                    '<item id="style" href="style.css" media-type="text/css"/>']
+        spine = []
+        for n, name in enumerate(self.documents):
+            manifest.append('<item id="page%d" href="%s" media-type="application/xhtml+xml"/>' % (n, name))
+            spine.append('<itemref idref="page%d"/>' % n)
+        for n, (name, media_type) in enumerate(self.images.items()):
+            manifest.append('<item id="image%d" href="%s" media-type="%s"/>' % (n, name, media_type))
+        modified = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        self.archive.writestr('OEBPS/content.opf', (
+            '<?xml version="1.0" encoding="utf-8"?>'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id">'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+            '<dc:identifier id="book-id">%s</dc:identifier><dc:title>%s</dc:title><dc:language>%s</dc:language>'
+            '<meta property="dcterms:modified">%s</meta></metadata>'
+            '<manifest>%s</manifest><spine>%s</spine></package>'
+            % (html.escape(self.identifier), html.escape(self.title), self.language, modified,
+               ''.join(manifest), ''.join(spine))))
+        self.archive.close()
+        self.archive = None
+
+
+BOOK_WRITERS = {'html': HtmlBookWriter, 'epub': EpubWriter}
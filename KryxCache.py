@@ -0,0 +1,172 @@
+"""
+KryxCache - Compressed on-disk cache of raw page sources
+
+The crawler only keeps cleaned HTML, so changing how pages are cleaned, styled or rendered
+used to mean crawling the live site again. The cache keeps the raw page source of every
+crawled page (plus any extra states captured on the page, e.g. after expanding menus or
+tables) gzip-compressed on disk, one file per page, keyed by site version and URL:
+
+    <cache_dir>/<version>/<sha1 of url>.json.gz
+
+Small JSON side files (e.g. the computed CSS) are kept next to the pages, so replaying a
+version from the cache needs no browser at all.
+"""
+import os
+import json
+import gzip
+import hashlib
+import collections
+
+DEFAULT_CACHE_SUFFIX = '.json.gz'       # Suffix of cached page files
+DEFAULT_COMPRESS_LEVEL = 6              # gzip compression level of cached page files
+DEFAULT_MAX_ENTRIES = 1000              # Entries kept by a BoundedDict
+
+
+def url_key(url):
+    """Key a url for the cache.
+        Args: url (str) - the canonical url to key
+        Kwargs: None
+        Output: key (str) - hex digest of the url
+        External State: No change
+    """
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+
+def latest_version(cache_dir):
+    """Find the most recently written version in a cache directory.
+        Args: cache_dir (str) - the cache directory
+        Kwargs: None
+        Output: version (str or None) - the latest cached version, None if nothing is cached
+        External State: No change
+    """
+    if not os.path.isdir(cache_dir):
+        return None
+    versions = [entry for entry in os.listdir(cache_dir) if os.path.isdir(os.path.join(cache_dir, entry))]
+    if len(versions) == 0:
+        return None
+    return max(versions, key=lambda version: os.path.getmtime(os.path.join(cache_dir, version)))
+
+
+def write_atomic(filename, data):
+    """Write bytes to a file so readers never see a partially written file.
+        Args: filename (str) - the file to write
+              data (bytes) - the contents to write
+        Kwargs: None
+        Output: None
+        External State: filename contains data
+    """
+    tmp_filename = '%s.tmp' % filename
+    with open(tmp_filename, 'wb') as file:
+        file.write(data)
+    os.replace(tmp_filename, filename)
+
+
+class BoundedDict(collections.OrderedDict):
+    """BoundedDict
+            Dictionary which keeps only its most recently used entries, dropping the least
+            recently used one when a new entry would exceed max_entries.
+
+            Args:
+                None
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | max_entries         |   int                 |   Maximum number of entries kept |
+    """
+
+    def __init__(self, *args, max_entries=DEFAULT_MAX_ENTRIES, **kwargs):
+        self.max_entries = max_entries
+        super().__init__(*args, **kwargs)
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.max_entries:
+            self.popitem(last=False)
+
+
+class PageSourceCache:
+    """PageSourceCache
+            Raw page sources for one version of the site, compressed on disk.
+
+            Args:
+                cache_dir (str)     -   Base directory of the cache
+                version (str)       -   Site version the pages belong to
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | compress_level      |   int                 |   gzip compression level |
+    """
+
+    def __init__(self,
+                 cache_dir,
+                 version,
+                 compress_level=DEFAULT_COMPRESS_LEVEL,
+                 ):
+        self.cache_dir = cache_dir
+        self.version = version
+        self.compress_level = compress_level
+        self.path = os.path.join(self.cache_dir, self.version)     # created on first save
+
+    def filename(self, url):
+        return os.path.join(self.path, url_key(url) + DEFAULT_CACHE_SUFFIX)
+
+    def save(self, url, page_source, states=None):
+        """Cache the raw source of a page.
+            Args: url (str) - canonical url of the page
+                  page_source (str) - raw page source from the browser
+            Kwargs: states (dict[str:str]) - extra page sources, e.g. after expanding menus or tables
+            Output: None
+            External State: page is cached on disk, replacing any earlier entry
+        """
+        entry = dict(url=url, version=self.version, page_source=page_source, states=states or dict())
+        data = gzip.compress(json.dumps(entry).encode('utf-8'), compresslevel=self.compress_level)
+        os.makedirs(self.path, exist_ok=True)
+        write_atomic(self.filename(url), data)
+
+    def load(self, url):
+        """Load the cached source of a page.
+            Args: url (str) - canonical url of the page
+            Kwargs: None
+            Output: page_source (str or None) - raw page source, None if the page is not cached
+                    states (dict[str:str]) - extra page sources captured with it
+            External State: No change
+        """
+        filename = self.filename(url)
+        if not os.path.exists(filename):
+            return None, dict()
+        with gzip.open(filename, 'rt', encoding='utf-8') as file:
+            entry = json.load(file)
+        return entry['page_source'], entry.get('states', dict())
+
+    def __contains__(self, url):
+        return os.path.exists(self.filename(url))
+
+    def save_json(self, name, data):
+        """Save a JSON side file (e.g. computed CSS) for this version.
+            Args: name (str) - name of the side file
+                  data (json serializable) - the data to save
+            Kwargs: None
+            Output: None
+            External State: side file exists in the version's cache directory
+        """
+        os.makedirs(self.path, exist_ok=True)
+        write_atomic(os.path.join(self.path, '%s.json' % name), json.dumps(data, indent=2).encode('utf-8'))
+
+    def load_json(self, name, default=None):
+        """Load a JSON side file for this version.
+            Args: name (str) - name of the side file
+            Kwargs: default - value to return if the side file does not exist
+            Output: data - the loaded data
+            External State: No change
+        """
+        filename = os.path.join(self.path, '%s.json' % name)
+        if not os.path.exists(filename):
+            return default
+        with open(filename, 'r', encoding='utf-8') as file:
+            return json.load(file)
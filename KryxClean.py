@@ -0,0 +1,291 @@
+"""
+KryxClean - Cleaning of raw page sources away from the browser
+
+Cleaning a page (parsing it, removing the header, footer and scripts, canonicalizing its
+links, inlining its images, adding its styles and serializing it again) used to run on the
+thread driving the browser, so the browser sat idle while every page was parsed. Cleaning is
+split in two steps:
+
+    capture     - the only part needing the browser: the computed style of tags and classes which
+                  are not stored yet, and not in the stylesheets if there are (KryxEtractor.capture_css)
+    transform   - everything else, a pure function of the raw page source, the stored CSS the page
+                  uses and the image files, so it can run in another process
+
+The CleanPool runs transforms in a process pool and hands the results back in the order the
+pages were submitted. Each worker process gets the parsed stylesheet once, when it starts,
+and keeps the images it already encoded, so only the page source and its stored CSS are sent
+with each page.
+"""
+import os
+import re
+import base64
+import timeit
+import collections
+import urllib.request
+import concurrent.futures
+import KryxUrls
+import KryxCache
+
+DEFAULT_MAX_PENDING = None                  # Pages cleaned or waiting in the pool at once (twice the workers if None)
+DEFAULT_IMAGE_CACHE_SIZE = 256              # Number of encoded images kept in memory
+STORED_CSS_FORM = "%s { %s } "
+CLASS_ATTR_REGEX = re.compile(r'''<[^>]*?\sclass\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.IGNORECASE)
+
+
+def page_classes(html_source):
+    """Classes used in a raw page source, found without parsing it.
+        Args: html_source (str) - the page
+        Kwargs: None
+        Output: classes (list[str]) - the distinct classes, in order of first use
+        External State: No change
+    """
+    classes = dict()
+    for match in CLASS_ATTR_REGEX.finditer(html_source):
+        for name in (match.group(1) or match.group(2) or match.group(3) or '').split():
+            classes.setdefault(name, None)
+    return list(classes)
+
+
+class CleanOptions:
+    """CleanOptions
+            Settings of the transform, the same for every page of an export.
+
+            Args:
+                None
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | remove_tags         |   list[str]           |   Tags to remove from HTML |
+                | heading_tags        |   list[str]           |   Tags recorded as page headings |
+                | url_prefix          |   str                 |   URL prefix of the site, links to it are canonicalized |
+                | tracking_params     |   list[str]           |   Query parameters (globs) stripped from canonical URLs |
+                | static_dir          |   str                 |   Directory images are downloaded to (the html subdir) |
+                | tag_order           |   list[str]           |   Tags to style from the stored CSS, in the order their CSS is emitted |
+    """
+    __slots__ = ('remove_tags', 'heading_tags', 'url_prefix', 'tracking_params', 'static_dir', 'tag_order')
+
+    def __init__(self, remove_tags=(), heading_tags=(), url_prefix='', tracking_params=KryxUrls.DEFAULT_TRACKING_PARAMS,
+                 static_dir='.', tag_order=()):
+        self.remove_tags = list(remove_tags)
+        self.heading_tags = list(heading_tags)
+        self.url_prefix = url_prefix
+        self.tracking_params = list(tracking_params)
+        self.static_dir = static_dir
+        self.tag_order = list(tag_order)
+
+
+def remove_tags(soup, tags):
+    """Remove the first element of each tag (e.g. the header and footer) and all scripts."""
+    for tag in tags:
+        element = soup.find(tag)
+        if element is not None:
+            element.decompose()
+    for script in soup('script'):
+        script.extract()
+
+
+def canonicalize_links(soup, url, options):
+    """Make the links of a page to other pages of the site absolute and canonical, so
+        they can be matched to pages of the compiled PDF. In-page links ("#...") are left alone.
+        Args: soup (BeautifulSoup) - the page
+              url (str) - canonical url of the page
+              options (CleanOptions) - url_prefix and tracking_params are used
+        Kwargs: None
+        Output: targets (list[str]) - canonical urls of the links, in page order
+        External State: No change
+    """
+    targets = []
+    for anchor in soup.find_all('a', href=True):
+        if anchor['href'].startswith('#'):
+            continue
+        fullref = KryxUrls.canonicalize_url(anchor['href'], base_url=url, tracking_params=options.tracking_params)
+        if KryxUrls.same_site(fullref, options.url_prefix):
+            anchor['href'] = fullref
+            targets.append(fullref)
+    return targets
+
+
+def static_path(static_dir, src):
+    """Path of a static file of the site under the html subdir, its directory created."""
+    destination_path = os.path.normpath('/'.join([static_dir, src])).replace('\\', '/')
+    os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+    return destination_path
+
+
+def image_data(path, image_cache=None):
+    """Data uri of an image file, from the image cache if it was already encoded."""
+    if image_cache is not None and path in image_cache:
+        return image_cache[path]
+    with open(path, 'rb') as file:
+        data = "data:image/png;base64, %s" % base64.b64encode(file.read()).decode()
+    if image_cache is not None:
+        image_cache[path] = data
+    return data
+
+
+def inline_images(soup, options, image_cache=None):
+    """Replace the images of a page by data uris, downloading the images which are not
+        downloaded yet. Downloads go through a temporary file per process, so several
+        processes can fetch the same image at once.
+        Args: soup (BeautifulSoup) - the page
+              options (CleanOptions) - url_prefix and static_dir are used
+        Kwargs: image_cache (dict[str:str]) - data uri of each image file already encoded
+        Output: None
+        External State: images exist in the html subdir
+    """
+    for image in soup.find_all('img'):
+        src = image.get('src')
+        if src is None or 'data:' in src:
+            continue
+        if 'http' in src:
+            url = src
+            src = 'static/media/%s' % url.rsplit('/', 1)[-1]
+        else:
+            url = "%s%s" % (options.url_prefix, src)
+        destination_path = static_path(options.static_dir, src)
+        if not os.path.exists(destination_path):
+            tmp_path = '%s.%d.tmp' % (destination_path, os.getpid())
+            urllib.request.urlretrieve(url, tmp_path)
+            os.replace(tmp_path, destination_path)
+        image['src'] = image_data(destination_path, image_cache)
+
+
+def apply_styles(soup, options, stylesheet=None, stored_css=None):
+    """Kryx does a lot of CSS rendering inline, so styles have to be added to the page.
+        With the site's stylesheets, the rules which can match the page are emitted (see
+        KryxCss), followed by the stored CSS captured from the browser for the classes of the
+        page which no stylesheet mentions. Without them, the stored CSS of each tag of
+        tag_order, then of each class of the page, is used, where it was captured.
+        Args: soup (BeautifulSoup) - the page
+              options (CleanOptions) - tag_order is used
+        Kwargs: stylesheet (KryxCss.StyleSheet) - the site's stylesheets
+                stored_css (dict[str:str]) - CSS of tags and classes captured from the browser
+        Output: None
+        External State: No change
+    """
+    style_tag = soup.new_tag('style', type='text/css')
+    if stylesheet is not None:
+        style_tag.append(stylesheet.css_for(soup))
+    if stored_css:
+        classes = dict()
+        for element in soup.find_all(class_=True):
+            for name in element['class']:
+                classes.setdefault(name, None)
+        names = list(classes)
+        if stylesheet is None:
+            names = list(options.tag_order) + names
+        else:
+            names = stylesheet.unstyled_classes(names)
+        for name in names:
+            if name in stored_css:
+                style_tag.append(stored_css[name])
+    soup.head.append(style_tag)
+
+
+def transform(html_source, url, options, stylesheet=None, stored_css=None, image_cache=None):
+    """Clean a raw page source. Needs no browser, only the CSS it is given.
+        Args: html_source (str) - the raw page source
+              url (str) - canonical url of the page, None to skip recording its headings and links
+              options (CleanOptions) - settings of the transform
+        Kwargs: stylesheet (KryxCss.StyleSheet) - the site's stylesheets, stored_css is used if None
+                stored_css (dict[str:str]) - CSS of tags and classes captured from the browser
+                image_cache (dict[str:str]) - data uri of each image file already encoded
+        Output: cleaned (str) - the cleaned page
+                headings (list[[int, str]]) - level and text of the headings of the page (None if no url)
+                links (list[str]) - canonical urls of the page's links to the site (None if no url)
+        External State: images exist in the html subdir
+    """
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html_source, 'html.parser')
+    remove_tags(soup, options.remove_tags)
+    headings, links = None, None
+    if url is not None:
+        headings = [[int(heading.name[1]), heading.get_text(' ', strip=True)]
+                    for heading in soup.find_all(options.heading_tags)]
+        links = canonicalize_links(soup, url, options)
+    inline_images(soup, options, image_cache=image_cache)
+    apply_styles(soup, options, stylesheet=stylesheet, stored_css=stored_css)
+    return str(soup), headings, links
+
+
+_worker = dict()
+
+
+def _init_worker(options, stylesheet):
+    _worker['options'] = options
+    _worker['stylesheet'] = stylesheet
+    _worker['images'] = KryxCache.BoundedDict(max_entries=DEFAULT_IMAGE_CACHE_SIZE)
+
+
+def _transform_in_worker(html_source, url, stored_css):
+    start = timeit.default_timer()
+    cleaned, headings, links = transform(html_source, url, _worker['options'], stylesheet=_worker['stylesheet'],
+                                         stored_css=stored_css, image_cache=_worker['images'])
+    return cleaned, headings, links, timeit.default_timer()-start
+
+
+class CleanPool:
+    """CleanPool
+            Process pool transforming raw page sources, with results handed back in the order
+            the pages were submitted.
+
+            Args:
+                options (CleanOptions)  -   Settings of the transform
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | stylesheet          |   KryxCss.StyleSheet  |   The site's stylesheets, sent once to each worker |
+                | max_workers         |   int                 |   Number of worker processes |
+                | max_pending         |   int                 |   Pages cleaned or waiting in the pool at once (twice the workers if None) |
+    """
+    def __init__(self, options, stylesheet=None, max_workers=1, max_pending=DEFAULT_MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        if self.max_pending is None:
+            self.max_pending = 2 * self.max_workers
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers,
+                                                               initializer=_init_worker,
+                                                               initargs=(options, stylesheet))
+        self.pending = collections.deque()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def submit(self, key, html_source, url, stored_css=None):
+        """Queue a page to be transformed.
+            Args: key (?) - handed back with the result, e.g. the page record
+                  html_source (str) - the raw page source
+                  url (str) - canonical url of the page
+            Kwargs: stored_css (dict[str:str]) - stored CSS the page may use
+            Output: None
+            External State: page is being cleaned in a worker process
+        """
+        self.pending.append((key, self.executor.submit(_transform_in_worker, html_source, url, stored_css)))
+
+    def results(self, wait=False):
+        """Hand back the transformed pages, oldest first. Stops at the first page which is
+            not done, unless wait is set or more than max_pending pages are in the pool.
+            Args: None
+            Kwargs: wait (bool) - wait for every page in the pool
+            Output: results (generator[(?, str, list, list, float)]) - key, cleaned page, headings,
+                                                                       links and seconds taken of each page
+            External State: No change
+        """
+        while len(self.pending) > 0:
+            key, future = self.pending[0]
+            if not (wait or future.done() or len(self.pending) > self.max_pending):
+                return
+            self.pending.popleft()
+            yield (key,) + future.result()
+
+    def close(self):
+        """Shut the worker processes down, dropping the pages which were not handed back.
+            Args: None
+            Kwargs: None
+            Output: None
+            External State: worker processes stopped
+        """
+        for key, future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown(wait=True)
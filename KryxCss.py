@@ -0,0 +1,343 @@
+"""
+KryxCss - Static CSS resolution from the site's downloaded stylesheets
+
+Styles used to be resolved by asking the live browser for the computed style of one element
+per tag and per class, two WebDriver round trips per property, and only for single class
+selectors. The StyleSheet parses the downloaded chunk CSS once instead, keeps the declarations
+whose properties are listed in CSS_SELECTORS.txt (or are shorthands of them), and indexes its
+rules by the tag, id or class of their subject. For each page only the rules whose selectors
+can match the page are emitted, in stylesheet order:
+
+    * compound selectors (".spell.concentration", "td.name") need an element with all of their parts,
+    * every compound of a complex selector (".card > h1 span") needs a matching element in the page,
+    * selectors of interactive states (":hover", ":focus", ...) are dropped, they cannot show in print,
+    * @media and @supports blocks are kept around the rules they contain.
+
+No browser is needed, so styles resolve the same way while crawling and in replay. Classes
+which no selector of the stylesheets mentions (e.g. styled-components classes added at runtime)
+are listed by unstyled_classes, so their computed style can still be captured from the browser.
+"""
+import re
+
+DYNAMIC_PSEUDO_CLASSES = frozenset(['hover', 'focus', 'active', 'visited', 'focus-within', 'focus-visible', 'target'])
+NESTED_AT_RULES = ('@media', '@supports')
+COMMENT_REGEX = re.compile(r'/\*.*?\*/', re.DOTALL)
+PARENS_REGEX = re.compile(r'\([^()]*\)')
+BRACKETS_REGEX = re.compile(r'\[[^\]]*\]')
+COMBINATOR_REGEX = re.compile(r'\s*[>+~]\s*|\s+')
+TAG_REGEX = re.compile(r'^(\*|[A-Za-z][\w-]*)')
+CLASS_REGEX = re.compile(r'\.((?:[\w-]|\\.)+)')
+ID_REGEX = re.compile(r'#((?:[\w-]|\\.)+)')
+PSEUDO_CLASS_REGEX = re.compile(r'(?<!:):([\w-]+)')
+ESCAPE_REGEX = re.compile(r'\\(.)')
+
+
+def _split_top_level(text, separator):
+    """Split text on a separator, except inside parentheses, brackets or strings."""
+    parts = []
+    depth = 0
+    quote = None
+    start = 0
+    for n, char in enumerate(text):
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(text[start:n])
+            start = n + 1
+    parts.append(text[start:])
+    return parts
+
+
+def parse_blocks(css):
+    """Split a stylesheet (without comments) into its top level blocks. Statement at-rules
+        such as @charset and @import are skipped.
+        Args: css (str) - the stylesheet
+        Kwargs: None
+        Output: blocks (list[(str, str)]) - prelude and body of each block, in order
+        External State: No change
+    """
+    blocks = []
+    position = 0
+    while True:
+        brace = css.find('{', position)
+        if brace < 0:
+            break
+        prelude = css[position:brace].strip()
+        while prelude.startswith('@') and ';' in prelude:
+            prelude = prelude.split(';', 1)[1].strip()
+        depth = 0
+        end = brace
+        while end < len(css):
+            if css[end] == '{':
+                depth += 1
+            elif css[end] == '}':
+                depth -= 1
+                if depth == 0:
+                    break
+            end += 1
+        blocks.append((prelude, css[brace + 1:end]))
+        position = end + 1
+    return blocks
+
+
+def parse_compound(compound):
+    """Parse a compound selector (attribute selectors and pseudo-class arguments removed).
+        Args: compound (str) - e.g. "td.name.wide:first-child"
+        Kwargs: None
+        Output: tag (str or None) - the tag name, None for any tag
+                classes (frozenset[str]) - the classes
+                ids (frozenset[str]) - the ids
+                pseudo_classes (frozenset[str]) - the pseudo-class names (not pseudo-elements)
+        External State: No change
+    """
+    match = TAG_REGEX.match(compound)
+    tag = match.group(1).lower() if match is not None and match.group(1) != '*' else None
+    classes = frozenset(ESCAPE_REGEX.sub(r'\1', name) for name in CLASS_REGEX.findall(compound))
+    ids = frozenset(ESCAPE_REGEX.sub(r'\1', name) for name in ID_REGEX.findall(compound))
+    pseudo_classes = frozenset(name.lower() for name in PSEUDO_CLASS_REGEX.findall(CLASS_REGEX.sub('', compound)))
+    return tag, classes, ids, pseudo_classes
+
+
+def parse_selector(selector):
+    """Parse a complex selector into its compound selectors. Only the presence of each
+        compound matters here, so combinators are dropped, and so are the arguments of
+        functional pseudo-classes (the classes in ":not(.x)" must not be required).
+        Args: selector (str) - e.g. ".card > h1.title span"
+        Kwargs: None
+        Output: compounds (list[(str, frozenset, frozenset, frozenset)]) - parsed compounds, subject last,
+                                                                           None if the selector can never show in print
+        External State: No change
+    """
+    stripped = BRACKETS_REGEX.sub('', selector)
+    previous = None
+    while previous != stripped:
+        previous, stripped = stripped, PARENS_REGEX.sub('', stripped)
+    compounds = [parse_compound(part) for part in COMBINATOR_REGEX.split(stripped.strip()) if len(part) > 0]
+    for tag, classes, ids, pseudo_classes in compounds:
+        if len(pseudo_classes & DYNAMIC_PSEUDO_CLASSES) > 0:
+            return None
+    return compounds
+
+
+def accepted_properties(properties):
+    """The property names of declarations to keep: the listed properties and their
+        shorthands (e.g. "margin" for "margin-top", "font" for "font-size").
+        Args: properties (iterable[str]) - property names, None to accept all
+        Kwargs: None
+        Output: accepted (frozenset[str] or None) - the accepted names, None to accept all
+        External State: No change
+    """
+    if properties is None:
+        return None
+    accepted = set(properties)
+    for name in properties:
+        parts = name.split('-')
+        for n in range(1, len(parts)):
+            accepted.add('-'.join(parts[:n]))
+    return frozenset(accepted)
+
+
+class CssRule:
+    """CssRule
+            A style rule of the stylesheet, with its selectors parsed.
+
+            Args:
+                order (int)         -   Position of the rule in the stylesheet
+                media (str)         -   Prelude of the enclosing @media/@supports block, None if there is none
+                selectors (list)    -   Text and parsed compounds of each selector of the rule
+                declarations (str)  -   The kept declarations
+    """
+    __slots__ = ('order', 'media', 'selectors', 'declarations')
+
+    def __init__(self, order, media, selectors, declarations):
+        self.order = order
+        self.media = media
+        self.selectors = selectors
+        self.declarations = declarations
+
+    def __repr__(self):
+        return "CssRule(%d, %r)" % (self.order, ', '.join(text for text, compounds in self.selectors))
+
+
+class PageFeatures:
+    """PageFeatures
+            Tags, ids and class combinations present in a page.
+
+            Args:
+                soup (BeautifulSoup) -  The parsed page
+    """
+
+    def __init__(self, soup):
+        self.tags = set()
+        self.ids = set()
+        self.class_sets = dict()        # class -> set of class sets of elements having it
+        for element in soup.find_all(True):
+            self.tags.add(element.name)
+            element_id = element.get('id')
+            if element_id:
+                self.ids.add(element_id)
+            classes = element.get('class')
+            if classes:
+                class_set = frozenset(classes)
+                for name in class_set:
+                    self.class_sets.setdefault(name, set()).add(class_set)
+
+    def has_compound(self, tag, classes, ids):
+        """Whether a compound selector's tag, classes and ids can all be found in the page.
+            Tag and classes are only required on the same element when there are classes.
+        """
+        if tag is not None and tag not in self.tags:
+            return False
+        if not ids <= self.ids:
+            return False
+        if len(classes) == 0:
+            return True
+        first = next(iter(classes))
+        return any(classes <= class_set for class_set in self.class_sets.get(first, ()))
+
+
+class StyleSheet:
+    """StyleSheet
+            Rules of the site's stylesheets, indexed by the tag, id or class of their subject.
+
+            Args:
+                css_sources (list[str])  -  Text of each stylesheet, in cascade order
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | properties          |   iterable[str]       |   Properties to keep (and their shorthands), all if None |
+    """
+    def __init__(self, css_sources, properties=None):
+        self.accepted = accepted_properties(properties)     # a set, not a filter function, so the stylesheet pickles
+        self.rules = []
+        self.by_class = dict()
+        self.by_id = dict()
+        self.by_tag = dict()
+        self.universal = []
+        self.classes = set()                # every class mentioned by a selector, kept or not
+        for css in css_sources:
+            self._parse(COMMENT_REGEX.sub('', css), None)
+
+    def _parse(self, css, media):
+        for prelude, body in parse_blocks(css):
+            if prelude.startswith(NESTED_AT_RULES):
+                self._parse(body, prelude if media is None else media)
+            elif prelude.startswith('@') or len(prelude) == 0:
+                continue                        # @font-face, @keyframes, @page...
+            else:
+                self._add_rule(prelude, body, media)
+
+    def _add_rule(self, prelude, body, media):
+        self.classes.update(ESCAPE_REGEX.sub(r'\1', name) for name in CLASS_REGEX.findall(prelude))
+        declarations = []
+        for declaration in _split_top_level(body, ';'):
+            name, colon, value = declaration.partition(':')
+            name = name.strip().lower()
+            if len(colon) > 0 and len(value.strip()) > 0 and (self.accepted is None or name in self.accepted):
+                declarations.append("%s: %s; " % (name, value.strip()))
+        if len(declarations) == 0:
+            return
+        selectors = []
+        for text in _split_top_level(prelude, ','):
+            compounds = parse_selector(text)
+            if compounds:
+                selectors.append((' '.join(text.split()), compounds))
+        if len(selectors) == 0:
+            return
+        rule = CssRule(len(self.rules), media, selectors, ''.join(declarations))
+        self.rules.append(rule)
+        indexed = set()
+        for text, compounds in selectors:
+            tag, classes, ids, pseudo_classes = compounds[-1]
+            if len(classes) > 0:
+                index, key = self.by_class, min(classes)
+            elif len(ids) > 0:
+                index, key = self.by_id, min(ids)
+            elif tag is not None:
+                index, key = self.by_tag, tag
+            else:
+                index, key = None, None
+            if (id(index), key) in indexed:
+                continue
+            indexed.add((id(index), key))
+            if index is None:
+                self.universal.append(rule)
+            else:
+                index.setdefault(key, []).append(rule)
+
+    @classmethod
+    def from_files(cls, filenames, properties=None):
+        """Load a stylesheet from CSS files.
+            Args: filenames (list[str]) - the CSS files, in cascade order
+            Kwargs: properties (iterable[str]) - properties to keep, all if None
+            Output: stylesheet (StyleSheet) - the parsed stylesheet
+            External State: No change
+        """
+        sources = []
+        for filename in filenames:
+            with open(filename, 'r', encoding='utf-8', errors='replace') as file:
+                sources.append(file.read())
+        return cls(sources, properties=properties)
+
+    def unstyled_classes(self, classes):
+        """The classes no selector of the stylesheets mentions.
+            Args: classes (iterable[str]) - class names, e.g. of a page
+            Kwargs: None
+            Output: unstyled (list[str]) - the classes not in the stylesheets, in order
+            External State: No change
+        """
+        return [name for name in classes if name not in self.classes]
+
+    def match(self, soup):
+        """Find the rules whose selectors can match a page, keeping only matching selectors.
+            Args: soup (BeautifulSoup) - the parsed page
+            Kwargs: None
+            Output: rules (list[(CssRule, list[str])]) - each matching rule and its matching selectors,
+                                                        in stylesheet order
+            External State: No change
+        """
+        features = PageFeatures(soup)
+        candidates = {rule.order: rule for rule in self.universal}
+        for name in features.class_sets:
+            candidates.update((rule.order, rule) for rule in self.by_class.get(name, ()))
+        for name in features.ids:
+            candidates.update((rule.order, rule) for rule in self.by_id.get(name, ()))
+        for name in features.tags:
+            candidates.update((rule.order, rule) for rule in self.by_tag.get(name, ()))
+        matched = []
+        for order in sorted(candidates):
+            rule = candidates[order]
+            selectors = [text for text, compounds in rule.selectors
+                         if all(features.has_compound(tag, classes, ids) for tag, classes, ids, pseudo in compounds)]
+            if len(selectors) > 0:
+                matched.append((rule, selectors))
+        return matched
+
+    def css_for(self, soup):
+        """CSS text of the rules which can match a page, with consecutive rules of the same
+            @media block grouped back together.
+            Args: soup (BeautifulSoup) - the parsed page
+            Kwargs: None
+            Output: css (str) - the css
+            External State: No change
+        """
+        parts = []
+        media = None
+        for rule, selectors in self.match(soup):
+            if rule.media != media:
+                if media is not None:
+                    parts.append('} ')
+                if rule.media is not None:
+                    parts.append('%s { ' % rule.media)
+                media = rule.media
+            parts.append('%s { %s} ' % (', '.join(selectors), rule.declarations))
+        if media is not None:
+            parts.append('} ')
+        return ''.join(parts)
@@ -0,0 +1,250 @@
+"""
+KryxDriver - Lifecycle management of the crawler's webdriver
+
+Recovering from a webdriver error used to mean starting a brand new Firefox, which takes
+many seconds, lands on the start page and loses the site settings (e.g. the metric toggle).
+Long sessions also slowly grow the browser's memory. The DriverManager owns the webdriver
+and handles all of this in one place:
+
+    * a cheap health check (one trivial script round trip) before deciding how to recover,
+    * an in-place reset of a live session (stop loading, blank page) before a full restart,
+    * site settings re-applied automatically whenever a new browser is started,
+    * proactive recycling after a number of pages or when the browser uses too much memory.
+
+Browser memory is read with psutil if it is installed, and from /proc otherwise (Linux).
+"""
+import os
+import logging
+import KryxLogger      # registers the custom log levels
+
+DEFAULT_RECYCLE_PAGES = None                # Restart the browser after this many pages (never if None)
+DEFAULT_RECYCLE_MEMORY_MB = None            # Restart the browser when it uses more memory than this (never if None)
+DEFAULT_MEMORY_CHECK_INTERVAL = 25          # Pages between two checks of the browser's memory
+DEFAULT_WINDOW_SIZE = (850, 1100)           # Size of the browser window
+HEALTH_CHECK_SCRIPT = 'return 1;'
+RESET_SCRIPT = 'window.stop();'
+
+
+def _proc_children(pid):
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry, 'r') as file:
+                fields = file.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+def _proc_rss(pid):
+    try:
+        with open('/proc/%d/statm' % pid, 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def process_tree_memory(pid):
+    """Resident memory of a process and all of its descendants.
+        Args: pid (int) - id of the root process
+        Kwargs: None
+        Output: memory (int or None) - bytes, None if it cannot be measured on this system
+        External State: No change
+    """
+    try:
+        import psutil
+        process = psutil.Process(pid)
+        return sum(p.memory_info().rss for p in [process] + process.children(recursive=True))
+    except ImportError:
+        pass
+    if not os.path.isdir('/proc'):
+        return None
+    total = 0
+    pids = [pid]
+    while len(pids) > 0:
+        current = pids.pop()
+        total += _proc_rss(current)
+        pids += _proc_children(current)
+    return total
+
+
+class DriverManager:
+    """DriverManager
+            Starts, checks, resets and recycles the Firefox webdriver of an extractor.
+
+            Args:
+                start_url (str)     -   URL new browsers are pointed at before site settings are applied
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | driver              |   Firefox Webdriver   |   Existing webdriver to manage |
+                | on_start            |   function            |   Called with the driver to apply site settings to a new browser |
+                | recycle_pages       |   int                 |   Restart the browser after this many pages (never if None) |
+                | recycle_memory_mb   |   int,float           |   Restart the browser when it uses more memory than this (never if None) |
+                | memory_check_interval | int               |   Pages between two checks of the browser's memory |
+                | window_size         |   (int, int)          |   Size of the browser window |
+    """
+
+    def __init__(self,
+                 start_url,
+                 driver=None,
+                 on_start=None,
+                 recycle_pages=DEFAULT_RECYCLE_PAGES,
+                 recycle_memory_mb=DEFAULT_RECYCLE_MEMORY_MB,
+                 memory_check_interval=DEFAULT_MEMORY_CHECK_INTERVAL,
+                 window_size=DEFAULT_WINDOW_SIZE,
+                 ):
+        self.start_url = start_url
+        self.driver = driver
+        self.on_start = on_start
+        self.recycle_pages = recycle_pages
+        self.recycle_memory_mb = recycle_memory_mb
+        self.memory_check_interval = memory_check_interval
+        self.window_size = window_size
+        self.settings_applied = False
+        self.pages = 0
+        self.restarts = 0
+        self.resets = 0
+        self.logger = logging.getLogger("KryxExtractor")
+
+    def start(self):
+        """Start a new browser on the start url (closing the current one, if any).
+            Args: None
+            Kwargs: None
+            Output: driver (Firefox Webdriver) - the new webdriver
+            External State: new Firefox running on the start url
+        """
+        from selenium import webdriver
+        self.quit()
+        self.driver = webdriver.Firefox()
+        self.driver.set_window_position(0, 0)
+        self.driver.set_window_size(*self.window_size)
+        self.driver.get(self.start_url)
+        self.settings_applied = False
+        self.pages = 0
+        return self.driver
+
+    def healthy(self):
+        """Check that the browser session still answers, with a single script round trip.
+            Args: None
+            Kwargs: None
+            Output: healthy (bool) - whether the session is usable
+            External State: No change
+        """
+        if self.driver is None:
+            return False
+        try:
+            return self.driver.execute_script(HEALTH_CHECK_SCRIPT) == 1
+        except Exception:
+            return False
+
+    def reset(self):
+        """Reset a live session in place: stop whatever is loading and go to a blank page.
+            The browser, its cookies and its site settings are kept.
+            Args: None
+            Kwargs: None
+            Output: reset (bool) - whether the session is usable afterwards
+            External State: browser on a blank page
+        """
+        try:
+            self.driver.execute_script(RESET_SCRIPT)
+            self.driver.get('about:blank')
+        except Exception:
+            return False
+        self.resets += 1
+        return self.healthy()
+
+    def ensure(self, apply_settings=True):
+        """Return a working webdriver, starting one if there is none and recovering the
+            current one if it does not answer. Site settings are only marked as applied once
+            on_start succeeds, so a failure is retried on the next call.
+            Args: None
+            Kwargs: apply_settings (bool) - apply site settings to the browser if they are not yet
+            Output: driver (Firefox Webdriver) - a working webdriver
+            External State: Firefox running, with site settings applied if apply_settings
+        """
+        if self.driver is None:
+            self.start()
+        elif not self.healthy():
+            self.recover()
+        if apply_settings and not self.settings_applied and self.on_start is not None:
+            try:
+                self.on_start(self.driver)
+                self.settings_applied = True
+            except Exception as ex:
+                self.logger.basic("Could not apply site settings (%s)" % ex)
+        return self.driver
+
+    def recover(self):
+        """Recover from a webdriver error: reset the session in place if it still answers,
+            restart the browser (and re-apply site settings) otherwise.
+            Args: None
+            Kwargs: None
+            Output: driver (Firefox Webdriver) - a working webdriver
+            External State: Firefox running, with site settings applied
+        """
+        if self.healthy() and self.reset():
+            self.logger.verbose("Reset webdriver session in place")
+        else:
+            self.logger.basic("Webdriver is not responding, restarting it")
+            self.start()
+            self.restarts += 1
+        return self.ensure()
+
+    def _should_recycle(self):
+        if self.recycle_pages is not None and self.pages >= self.recycle_pages:
+            self.logger.verbose("Recycling webdriver after %d pages" % self.pages)
+            return True
+        if self.recycle_memory_mb is None or self.pages == 0 or self.pages % self.memory_check_interval != 0:
+            return False
+        try:
+            memory = process_tree_memory(self.driver.service.process.pid)
+        except AttributeError:
+            return False
+        if memory is not None and memory > self.recycle_memory_mb * 1024 * 1024:
+            self.logger.verbose("Recycling webdriver using %d MB" % (memory // (1024 * 1024)))
+            return True
+        return False
+
+    def get(self, url):
+        """Navigate to a url, recycling the browser first if it is due, and recovering
+            and retrying once if navigation fails.
+            Args: url (str) - the url to navigate to
+            Kwargs: None
+            Output: driver (Firefox Webdriver) - the webdriver, on url
+            External State: Firefox on url
+        """
+        if self.driver is None or not self.settings_applied:
+            self.ensure()
+        if self._should_recycle():
+            self.start()
+            self.restarts += 1
+            self.ensure()
+        try:
+            self.driver.get(url)
+        except Exception as ex:
+            self.logger.basic("Navigation to %s failed (%s), recovering webdriver" % (url, type(ex).__name__))
+            self.recover()
+            self.driver.get(url)
+        self.pages += 1
+        return self.driver
+
+    def quit(self):
+        """Shut down the browser, if there is one.
+            Args: None
+            Kwargs: None
+            Output: None
+            External State: Firefox shut down
+        """
+        if self.driver is None:
+            return
+        try:
+            self.driver.quit()
+        except Exception:
+            pass
+        self.driver = None
+        self.settings_applied = False
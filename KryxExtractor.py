@@ -13,28 +13,38 @@ KryxExtractor - Crawl and Export Kryx's DnD 5e website
 * Downloads CSS to attempt CSS formatting, but only some tags, and in a naive way
 
 ## TODO
-* Current version does not fix broken internal links from source HTML
 * Current version does not allow for other selenium webdrivers
-* Current version does not support partial crawling (e.g. just the bestiary)
-* CSS multiclasses etc, are currently not supported, so certain CSS tags do not work
-* Create Table of Contents and Title Page
 * More beautification to fit in an 8.5x11 page more evenly
 """
 import os
 import re
 import glob
+import shutil
 import time
 import timeit
-import base64
-import pdfkit
+import json
+import hashlib
+import html
 import logging
-import selenium
+import threading
+import urllib.error
 import urllib.request
-import urllib3
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from PyPDF2 import PdfFileWriter, PdfFileReader
 import KryxLogger
+import KryxUrls
+import KryxRoutes
+import KryxPages
+import KryxCache
+import KryxStore
+import KryxWatch
+import KryxProfile
+import KryxDriver
+import KryxSimilar
+import KryxBook
+import KryxCss
+import KryxClean
+import utils
+# selenium, pdfkit, PyPDF2 (and KryxPdf) and BeautifulSoup are slow to import, so they are
+# imported where they are used. Replay and CSV-only jobs then never pay for them.
 
 # Default Parameters
 # URL Formatting Parameters
@@ -67,6 +77,15 @@ DEFAULT_IGNORE_URLS = [                                     # URLS which should
     '/5e/converters/pathfinder-to-5e',
     '/5e/converters/we-be-goblins-to-5e'
 ]
+DEFAULT_INCLUDE_URLS = None                                 # Scope rules (prefixes, globs, "re:" regexes) URLs must match
+DEFAULT_EXCLUDE_URLS = None                                 # Scope rules for URLs which should not be crawled
+DEFAULT_MAX_DEPTH = None                                    # Maximum number of links to follow from the start URL
+DEFAULT_MAX_PAGES = None                                    # Maximum number of pages to export
+DEFAULT_TRACKING_PARAMS = KryxUrls.DEFAULT_TRACKING_PARAMS   # Query parameters (globs) stripped from canonical URLs
+DEFAULT_ROUTE_DISCOVERY = False                             # Seed the crawl with routes parsed from the site's JS bundle
+DEFAULT_ROUTE_MANIFEST = 'routes.json'                      # Filename the discovered routes are saved to
+DEFAULT_ROUTE_MENUS = True                                  # Still click menus when routes were discovered (menu-only pages and menu states)
+DEFAULT_PAGE_MANIFEST = 'pages.json'                        # Filename the page registry is saved to
 DEFAULT_HISTORY = None                                      # List of URLS already crawled
 DEFAULT_STACK = None                                        # Stack data structure of URLs to crawls
 DEFAULT_SELENIUM_DRIVER = None                              # Selenium Webdriver to use
@@ -84,16 +103,59 @@ DEFAULT_HTML_SUBDIR = 'html'
 DEFAULT_PDF_SUBDIR = 'pdf'
 DEFAULT_KEEP_PDFS = True
 DEFAULT_STORED_CSS = None
+DEFAULT_STATIC_CSS = True                                   # Resolve styles from the downloaded stylesheets instead of the browser
+DEFAULT_CACHE_PAGES = True                                  # Cache raw page sources for offline replay
+DEFAULT_CACHE_DIR = None                                    # Directory of the page source cache (defaults to <export_dir>/<url_replacer>_cache)
+DEFAULT_COMPRESS_HTML = False                               # Store intermediate HTML gzipped, with shared fragments deduplicated
+DEFAULT_OPTIMIZE_PDF = True                                 # Stream the compiled PDF, sharing identical fonts and images
+DEFAULT_BUILD_TOC = True                                    # Add bookmarks, a title page and a table of contents to the compiled PDF
+DEFAULT_FRONT_MATTER = 'front_matter.pdf'                   # Filename of the rendered title page and table of contents
+DEFAULT_HEADING_TAGS = ['h1', 'h2', 'h3']                   # Tags recorded as page headings
+DESTINATION_NAME = 'page-%05d'                              # Named destination of each page in the compiled PDF
+DEFAULT_DEFER_DRIVER = False                                # Start the webdriver on first use instead of on construction
+DEFAULT_REPLAY = False                                      # Re-export from the page source cache without a browser
+DEFAULT_REUSE_VERSION = None                                # Previous version whose PDFs are reused for unchanged pages
+DEFAULT_STREAMING = False                                   # Stream pages into the output volumes as they are exported, keeping memory flat
+DEFAULT_VOLUME_PAGES = None                                 # Maximum number of PDF pages per output volume (streaming only)
+DEFAULT_VOLUME_BYTES = None                                 # Maximum size in bytes of the pages of an output volume (streaming only)
+DEFAULT_CSS_CACHE_SIZE = 2000                               # Number of stored CSS entries kept in memory (streaming only)
+DEFAULT_PAGE_JOURNAL = 'pages.jsonl'                        # Filename full page records are flushed to (streaming only)
+DEFAULT_INDEX_CACHE_SIZE = 2000                             # Number of hit buttons and near-duplicate signatures kept in memory (streaming only)
+DEFAULT_RECYCLE_PAGES = KryxDriver.DEFAULT_RECYCLE_PAGES            # Restart the browser after this many pages (never if None)
+DEFAULT_RECYCLE_MEMORY_MB = KryxDriver.DEFAULT_RECYCLE_MEMORY_MB    # Restart the browser when it uses more memory than this (never if None)
+DEFAULT_NEAR_DUPLICATES = None                              # 'skip' or 'collapse' near-duplicate pages instead of rendering them (keep them if None)
+DEFAULT_DUPLICATE_THRESHOLD = KryxSimilar.DEFAULT_THRESHOLD # Estimated similarity above which pages are near-duplicates
+DEFAULT_DUPLICATE_REPORT = 'duplicates.json'                # Filename the near-duplicate report is saved to
+NEAR_DUPLICATE_MODES = (None, 'skip', 'collapse')
+DEFAULT_FORMATS = ['pdf']                                   # Output formats: 'pdf', 'html' (single file book) and/or 'epub'
+OUTPUT_FORMATS = ('pdf',) + tuple(KryxBook.BOOK_WRITERS)
+DEFAULT_CLEAN_WORKERS = 0                                   # Processes cleaning pages off the browser thread (cleaned inline if 0)
+DEFAULT_PROFILE = False                                     # Profile CPU, memory and browser timing of each export stage
+DEFAULT_PROFILE_REPORT = 'profile_report.txt'               # Filename the profiling report is written to
 
 
-HTML_TAGS = []
-with open("HTML_TAGS.txt", "r") as file:
-    for line in file:
-        HTML_TAGS.append(line.strip())
-CSS_SELECTORS = []
-with open("CSS_SELECTORS.txt", "r") as file:
-    for line in file:
-        CSS_SELECTORS.append(line.strip())
+CONFIG_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_config_list(filename):
+    """Load a list of names, one per line, from a config file next to this module.
+        Args: filename (str) - name of the config file
+        Kwargs: None
+        Output: names (tuple[str]) - the names in file order, without blank lines or duplicates
+        External State: No change
+    """
+    names = []
+    with open(os.path.join(CONFIG_DIR, filename), "r") as file:
+        for line in file:
+            name = line.strip()
+            if len(name) > 0 and name not in names:
+                names.append(name)
+    return tuple(names)
+
+
+HTML_TAG_ORDER = load_config_list("HTML_TAGS.txt")          # Tags to style, in the order their CSS is emitted
+HTML_TAGS = frozenset(HTML_TAG_ORDER)
+CSS_SELECTORS = frozenset(load_config_list("CSS_SELECTORS.txt"))
 
 
 class KryxEtractor:
@@ -119,6 +181,15 @@ class KryxEtractor:
                 | button_seek_params  |   list[args]          |   Parameters for finding clickable buttons |
                 | selenium_driver     |   Firefox Webdriver   |   Selenium Webdriver to use |
                 | ignore_urls         |   list[str]           |   URLS which should not be exported or crawled further |
+                | include_urls        |   list[str]           |   Scope rules (prefix, glob, "re:" regex) URLs must match to be crawled |
+                | exclude_urls        |   list[str]           |   Scope rules for URLs which should not be crawled |
+                | max_depth           |   int                 |   Maximum number of links to follow from the start URL |
+                | max_pages           |   int                 |   Maximum number of pages to export |
+                | tracking_params     |   list[str]           |   Query parameters (globs) stripped from canonical URLs |
+                | route_discovery     |   bool                |   Seed the crawl with routes parsed from the site's JS bundle |
+                | route_manifest      |   str                 |   Filename the discovered routes are saved to |
+                | route_menus         |   bool                |   Still click menus when routes were discovered (menu-only pages and menu states) |
+                | page_manifest       |   str                 |   Filename the page registry is saved to |
                 | stack               |   list[str]           |   Stack data structure of URLs to crawls |
                 | history             |   list[str]           |   List of URLS already crawled |
                 | html_remove_tags    |   list[str]           |   Tags to remove from HTML |
@@ -129,6 +200,29 @@ class KryxEtractor:
                 | verbose             |   int                 |   Verbose console output |
                 | css_file            |   str                 | static url of CSS file to download |
                 | stored_css          |   dict[str:str]       | stored CSS for tags and classes |
+                | static_css          |   bool                |   Resolve styles from the downloaded stylesheets instead of the browser |
+                | cache_pages         |   bool                |   Cache raw page sources for offline replay |
+                | cache_dir           |   str                 |   Directory of the page source cache |
+                | replay              |   bool                |   Re-export from the page source cache without a browser |
+                | compress_html       |   bool                |   Store intermediate HTML gzipped, with shared fragments deduplicated |
+                | optimize_pdf        |   bool                |   Stream the compiled PDF, sharing identical fonts and images |
+                | build_toc           |   bool                |   Add bookmarks, a title page and a table of contents to the compiled PDF |
+                | defer_driver        |   bool                |   Start the webdriver on first use instead of on construction |
+                | reuse_version       |   str                 |   Previous version whose PDFs are reused for unchanged pages |
+                | streaming           |   bool                |   Stream pages into the output volumes as they are exported, keeping memory flat |
+                | volume_pages        |   int                 |   Maximum number of PDF pages per output volume (streaming only) |
+                | volume_bytes        |   int                 |   Maximum size in bytes of the pages of an output volume (streaming only) |
+                | css_cache_size      |   int                 |   Number of stored CSS entries kept in memory (streaming only) |
+                | index_cache_size    |   int                 |   Number of hit buttons and near-duplicate signatures kept in memory (streaming only) |
+                | recycle_pages       |   int                 |   Restart the browser after this many pages (never if None) |
+                | recycle_memory_mb   |   int,float           |   Restart the browser when it uses more memory than this in MB (never if None) |
+                | near_duplicates     |   str                 |   'skip' or 'collapse' near-duplicate pages instead of rendering them (keep them if None) |
+                | duplicate_threshold |   float               |   Estimated similarity above which pages are near-duplicates |
+                | duplicate_report    |   str                 |   Filename the near-duplicate report is saved to |
+                | formats             |   list[str]           |   Output formats: 'pdf', 'html' (single file book) and/or 'epub' |
+                | clean_workers       |   int                 |   Processes cleaning pages off the browser thread (cleaned inline if 0) |
+                | profile             |   bool                |   Profile CPU, memory and browser timing of each export stage |
+                | profile_report      |   str                 |   Filename the profiling report is written to |
     """
 
     def __init__(self,
@@ -144,6 +238,15 @@ class KryxEtractor:
                  button_seek_params=DEFAULT_BUTTON_SEEK_PARAMS,
                  selenium_driver=DEFAULT_SELENIUM_DRIVER,
                  ignore_urls=DEFAULT_IGNORE_URLS,
+                 include_urls=DEFAULT_INCLUDE_URLS,
+                 exclude_urls=DEFAULT_EXCLUDE_URLS,
+                 max_depth=DEFAULT_MAX_DEPTH,
+                 max_pages=DEFAULT_MAX_PAGES,
+                 tracking_params=DEFAULT_TRACKING_PARAMS,
+                 route_discovery=DEFAULT_ROUTE_DISCOVERY,
+                 route_manifest=DEFAULT_ROUTE_MANIFEST,
+                 route_menus=DEFAULT_ROUTE_MENUS,
+                 page_manifest=DEFAULT_PAGE_MANIFEST,
                  keep_html=DEFAULT_KEEP_HTML,
                  keep_pdfs=DEFAULT_KEEP_PDFS,
                  html_subdir=DEFAULT_HTML_SUBDIR,
@@ -158,13 +261,62 @@ class KryxEtractor:
                  html_remove_tags=DEFAULT_HTML_REMOVE_TAGS,
                  css_file=DEFAULT_CSS_FILE,
                  stored_css=None,
+                 static_css=DEFAULT_STATIC_CSS,
                  start_selenium=True,
+                 cache_pages=DEFAULT_CACHE_PAGES,
+                 cache_dir=DEFAULT_CACHE_DIR,
+                 replay=DEFAULT_REPLAY,
+                 compress_html=DEFAULT_COMPRESS_HTML,
+                 optimize_pdf=DEFAULT_OPTIMIZE_PDF,
+                 build_toc=DEFAULT_BUILD_TOC,
+                 defer_driver=DEFAULT_DEFER_DRIVER,
+                 reuse_version=DEFAULT_REUSE_VERSION,
+                 streaming=DEFAULT_STREAMING,
+                 volume_pages=DEFAULT_VOLUME_PAGES,
+                 volume_bytes=DEFAULT_VOLUME_BYTES,
+                 css_cache_size=DEFAULT_CSS_CACHE_SIZE,
+                 index_cache_size=DEFAULT_INDEX_CACHE_SIZE,
+                 recycle_pages=DEFAULT_RECYCLE_PAGES,
+                 recycle_memory_mb=DEFAULT_RECYCLE_MEMORY_MB,
+                 near_duplicates=DEFAULT_NEAR_DUPLICATES,
+                 duplicate_threshold=DEFAULT_DUPLICATE_THRESHOLD,
+                 duplicate_report=DEFAULT_DUPLICATE_REPORT,
+                 formats=DEFAULT_FORMATS,
+                 clean_workers=DEFAULT_CLEAN_WORKERS,
+                 profile=DEFAULT_PROFILE,
+                 profile_report=DEFAULT_PROFILE_REPORT,
                  ):
-        self.start_url = start_url
+        self.tracking_params = tracking_params
+        self.start_url = KryxUrls.canonicalize_url(start_url, tracking_params=self.tracking_params)
         self.selenium_driver = selenium_driver
-        self.start_selenium = start_selenium
-        self._init_webdriver()
+        self.replay = replay
+        self.start_selenium = start_selenium and not self.replay
+        self.defer_driver = defer_driver
+        self.recycle_pages = recycle_pages
+        self.recycle_memory_mb = recycle_memory_mb
+        self.driver_manager = KryxDriver.DriverManager(self.start_url,
+                                                       driver=self.selenium_driver,
+                                                       on_start=self._on_driver_start,
+                                                       recycle_pages=self.recycle_pages,
+                                                       recycle_memory_mb=self.recycle_memory_mb)
         self.ignore_urls = ignore_urls
+        self.include_urls = include_urls
+        if self.include_urls is None:
+            self.include_urls = []
+        self.exclude_urls = exclude_urls
+        if self.exclude_urls is None:
+            self.exclude_urls = []
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.scope = KryxUrls.UrlScope(include_urls=self.include_urls,
+                                       exclude_urls=self.exclude_urls,
+                                       max_depth=self.max_depth,
+                                       max_pages=self.max_pages)
+        self.url_depths = dict()
+        self.route_discovery = route_discovery
+        self.route_manifest = route_manifest
+        self.route_menus = route_menus
+        self.routes = None
         self.js_wait_interval = js_wait_interval
         self.page_wait_interval = page_wait_interval
         self.url_replacer = url_replacer
@@ -176,53 +328,119 @@ class KryxEtractor:
         self.changelog_url = changelog_url
         self.url_sep_char = url_sep_char
         self.url_prefix = url_prefix
+        self.cache_pages = cache_pages
+        self.cache_dir = cache_dir
+        if self.cache_dir is None:
+            self.cache_dir = os.path.join(self.export_dir, '%s_cache' % self.url_replacer)
+        if self.version is None and self.replay:
+            self.version = KryxCache.latest_version(self.cache_dir)
+        elif self.version is None and not self.start_selenium:
+            self.version = self.latest_local_version()     # browserless jobs start without network access
+            if self.version is None:
+                raise ValueError("No version exported in %s yet, pass version to run without a browser" % self.export_dir)
         if self.version is None:
             self.version = self.get_latest_version()
+        self.page_cache = KryxCache.PageSourceCache(self.cache_dir, self.version)
+        self.page_states = dict()
         self.path = path
         self.html_subdir = html_subdir
         self.pdf_subdir = pdf_subdir
         self._init_paths()
+        self.compress_html = compress_html
+        self.html_store = KryxStore.HtmlStore(os.path.join(self.path, self.html_subdir), compress=self.compress_html)
         self.logfile = os.path.join(self.path, "KryxExtractor.log")
         self.logger = self._init_logger()
+        self.driver_manager.logger = self.logger
         self.hit_buttons = hit_buttons
         if self.hit_buttons is None:
             self.hit_buttons = []
-        self.history = history
-        if self.history is None:
-            self.history = []
+        self.page_manifest = page_manifest
+        self.pages = KryxPages.PageRegistry(urls=history)
+        self.state_lock = threading.RLock()     # held while changing state other extractors may share (KryxService)
+        self.reuse_version = reuse_version
+        self.reused_pages = self._load_reused_pages()
+        self.streaming = streaming
+        self.volume_pages = volume_pages
+        self.volume_bytes = volume_bytes
+        self.css_cache_size = css_cache_size
+        self.index_cache_size = index_cache_size
+        self.volumes = None
+        self.page_journal = None
+        self.page_journal_path = None
+        self.near_duplicates = near_duplicates
+        self.duplicate_threshold = duplicate_threshold
+        self.duplicate_report = duplicate_report
+        self.similarity = None
+        if self.near_duplicates is not None:
+            self.similarity = KryxSimilar.SimilarityIndex(threshold=self.duplicate_threshold,
+                                                          max_entries=self.index_cache_size if self.streaming else None)
+        self.duplicates = dict()
+        self.formats = formats
+        self.books = None
+        self.clean_workers = clean_workers
+        self.clean_pool = None
+        self.image_cache = KryxCache.BoundedDict(max_entries=KryxClean.DEFAULT_IMAGE_CACHE_SIZE)
+        self.profile = profile
+        self.profile_report = profile_report
+        self.profiler = KryxProfile.RunProfiler(enabled=self.profile)
+        self.history = self.pages.urls      # the registry owns the crawl history
         self.stack = stack
         if self.stack is None:
             self.stack = []
+        self.url_index = KryxUrls.CanonicalUrlIndex(urls=self.history + self.stack,
+                                                    base_url=self.url_prefix,
+                                                    tracking_params=self.tracking_params)
+        self.ignore_index = KryxUrls.CanonicalUrlIndex(urls=self.ignore_urls,
+                                                       base_url=self.url_prefix,
+                                                       tracking_params=self.tracking_params)
         self.keep_html = keep_html
         self.keep_pdfs = keep_pdfs
         self.html_remove_tags = html_remove_tags
         self.output_filename = output_filename
         if self.output_filename is None:
             self.output_filename = "%s_v%s_compiled.pdf" % (self.url_replacer, self.version)
+        self.optimize_pdf = optimize_pdf
+        self.build_toc = build_toc
         self.css_file = css_file
         self.stored_css = stored_css
         if self.stored_css is None or not type(self.stored_css) is dict:
             self.stored_css = dict()
+        self.static_css = static_css
+        self.stylesheet = None
+        if self.streaming:
+            self.stored_css = KryxCache.BoundedDict(self.stored_css, max_entries=self.css_cache_size)
         self._print_own_fields()
         self._init_check_types()
+        if not self.defer_driver:
+            self._init_webdriver()
 
     def _init_webdriver(self):
+        """Make sure there is a working webdriver with site settings applied. A new
+            browser is only started if there is none or the current one does not answer.
+            Args: None
+            Kwargs: None
+            Fields: start_selenium, driver_manager
+            Output: None
+            External State: Firefox running with site settings applied
+        """
         if not self.start_selenium:
             return
-        if self.selenium_driver is None:
-            self.selenium_driver = webdriver.Firefox()
-        try:
-            self.selenium_driver.get(self.start_url)
-        except selenium.common.exceptions.InvalidSessionIdException:
-            self.selenium_driver = webdriver.Firefox()
-        except urllib3.exceptions.MaxRetryError:
-            self.selenium_driver = webdriver.Firefox()
-        except selenium.common.exceptions.WebDriverException:
-            self.selenium_driver = webdriver.Firefox()
-
-        # self.selenium_driver.maximize_window()
-        self.selenium_driver.set_window_position(0, 0)
-        self.selenium_driver.set_window_size(850, 1100)
+        self.selenium_driver = self.driver_manager.ensure()
+
+    def _on_driver_start(self, driver):
+        self.selenium_driver = driver
+        self.init_site_settings()
+
+    def _navigate(self, url):
+        """Navigate the webdriver to a url, recovering from webdriver errors and
+            recycling the browser when it is due.
+            Args: url (str) - the url to navigate to
+            Kwargs: None
+            Fields: driver_manager
+            Output: None
+            External State: selenium driver on url
+        """
+        self.selenium_driver = self.driver_manager.get(url)
 
     def _init_check_types(self):
         """Check all field types upon intialization.
@@ -232,8 +450,47 @@ class KryxEtractor:
             Fields: All fields from the object
         """
         self._assert_type(self.start_url, str, 'self.start_url')
-        self._assert_type(self.selenium_driver, [webdriver.Firefox, type(None)], 'self.selenium_driver')
+        if self.selenium_driver is not None:
+            from selenium import webdriver
+            self._assert_type(self.selenium_driver, webdriver.Firefox, 'self.selenium_driver')
+        self._assert_type(self.defer_driver, bool, 'self.defer_driver')
         self._assert_type(self.ignore_urls, list, 'self.ignore_urls')
+        self._assert_type(self.include_urls, list, 'self.include_urls')
+        self._assert_type(self.exclude_urls, list, 'self.exclude_urls')
+        self._assert_type(self.max_depth, [int, type(None)], 'self.max_depth')
+        self._assert_type(self.max_pages, [int, type(None)], 'self.max_pages')
+        self._assert_type(self.tracking_params, list, 'self.tracking_params')
+        self._assert_type(self.route_discovery, bool, 'self.route_discovery')
+        self._assert_type(self.route_manifest, str, 'self.route_manifest')
+        self._assert_type(self.route_menus, bool, 'self.route_menus')
+        self._assert_type(self.page_manifest, str, 'self.page_manifest')
+        self._assert_type(self.cache_pages, bool, 'self.cache_pages')
+        self._assert_type(self.cache_dir, str, 'self.cache_dir')
+        self._assert_type(self.replay, bool, 'self.replay')
+        self._assert_type(self.compress_html, bool, 'self.compress_html')
+        self._assert_type(self.optimize_pdf, bool, 'self.optimize_pdf')
+        self._assert_type(self.static_css, bool, 'self.static_css')
+        self._assert_type(self.build_toc, bool, 'self.build_toc')
+        self._assert_type(self.reuse_version, [str, type(None)], 'self.reuse_version')
+        self._assert_type(self.streaming, bool, 'self.streaming')
+        self._assert_type(self.volume_pages, [int, type(None)], 'self.volume_pages')
+        self._assert_type(self.volume_bytes, [int, type(None)], 'self.volume_bytes')
+        self._assert_type(self.css_cache_size, int, 'self.css_cache_size')
+        self._assert_type(self.index_cache_size, int, 'self.index_cache_size')
+        self._assert_type(self.recycle_pages, [int, type(None)], 'self.recycle_pages')
+        self._assert_type(self.recycle_memory_mb, [int, float, type(None)], 'self.recycle_memory_mb')
+        assert self.near_duplicates in NEAR_DUPLICATE_MODES, \
+            "VALUE ERROR FOR self.near_duplicates VARIABLE. REQUIRED VALUE IS ONE OF %s" % (NEAR_DUPLICATE_MODES,)
+        self._assert_type(self.duplicate_threshold, [int, float], 'self.duplicate_threshold')
+        self._assert_type(self.duplicate_report, str, 'self.duplicate_report')
+        self._assert_type(self.formats, list, 'self.formats')
+        for output_format in self.formats:
+            assert output_format in OUTPUT_FORMATS, \
+                "VALUE ERROR FOR self.formats VARIABLE. REQUIRED VALUES ARE IN %s" % (OUTPUT_FORMATS,)
+        self._assert_type(self.clean_workers, int, 'self.clean_workers')
+        assert self.clean_workers >= 0, "VALUE ERROR FOR self.clean_workers VARIABLE. REQUIRED VALUE IS AT LEAST 0"
+        self._assert_type(self.profile, bool, 'self.profile')
+        self._assert_type(self.profile_report, str, 'self.profile_report')
         self._assert_type(self.js_wait_interval, [int, float], 'self.js_wait_interval')
         self._assert_type(self.page_wait_interval, [int, float], 'self.page_wait_interval')
         self._assert_type(self.url_replacer, str, 'self.url_replacer')
@@ -283,9 +540,26 @@ class KryxEtractor:
         os.makedirs(os.path.join(self.path, self.html_subdir, 'static', 'css'), exist_ok=True)
         os.makedirs(os.path.join(self.path, self.pdf_subdir), exist_ok=True)
 
+    def _load_reused_pages(self):
+        """Load the page manifest of the version whose PDFs are reused for unchanged pages.
+            Args: None
+            Kwargs: None
+            Fields: reuse_version, export_dir, url_replacer, page_manifest
+            Output: pages (PageRegistry or None) - the previous version's pages, None if there are none
+            External State: No change
+        """
+        if self.reuse_version is None or self.reuse_version == self.version:
+            return None
+        manifest = os.path.join(self.export_dir, '%s_v%s' % (self.url_replacer, self.reuse_version), self.page_manifest)
+        if not os.path.exists(manifest):
+            self.logger.basic("No page manifest found for version %s, rendering every page" % self.reuse_version)
+            return None
+        return KryxPages.PageRegistry.load(manifest)
+
     def _init_logger(self):
         """Initialize Logger with a file and stream handler.
-                If the logger exists, remove all its handlers.
+                If the logger exists, remove all its handlers. Extractors running side by side
+                must use loggers of different names (see logger_name).
 
             Args: None
             Kwargs: None
@@ -300,7 +574,8 @@ class KryxEtractor:
                     LOG_PARAMS = 5      -       parameter print logging
             External State: logfile named KryxExtractor exists in logfile path
         """
-        logger = logging.getLogger("KryxExtractor")
+        logger = logging.getLogger(self.logger_name())
+        logger.propagate = False
         logger.setLevel(self.verbose)
         fh = logging.FileHandler(self.logfile)
         fh.setLevel(self.verbose)
@@ -314,6 +589,9 @@ class KryxEtractor:
         logger.addHandler(ch)
         return logger
 
+    def logger_name(self):
+        return "KryxExtractor"
+
     def _print_own_fields(self):
         """Prints all of the KryxExtractor's fields, only at the highest log level.
             Args: None
@@ -328,115 +606,108 @@ class KryxEtractor:
 
     def clean_html(self,
                    html_source,
+                   record=None,
                    ):
-        """Clean input html by removing tags.
+        """Clean input html by removing tags. Links to other pages of the site are made
+            absolute and canonical, and recorded in the page registry's link graph.
+            The browser is only used to capture missing CSS, the rest is KryxClean.transform.
             Args: html_source  (str)    -   string of html source
-            Kwargs: None
-            Fields: html_remove_tags (contains tags which will be cleaned)
+            Kwargs: record (PageRecord) -   page record to store the page's headings and links in
+            Fields: html_remove_tags (contains tags which will be cleaned), stylesheet, image_cache, state_lock
             Output: cleaned, html output after desired tags have been removed
-            External State: No change
+            External State: headings stored in record, links in the page registry, if given
         """
         self.logger.vvverbose("Cleaning HTML...")
-        soup = BeautifulSoup(html_source, 'html.parser')
-        for tag in self.html_remove_tags:
-            if hasattr(soup, tag):
-                try:
-                    getattr(soup, tag).decompose()
-                except AttributeError:
-                    pass
-        self.logger.vvverbose("Downloading images...")
-        self._download_images(soup)
-        self.logger.vvverbose("Grabbing CSS...")
-        self._hack_css(soup)
-        raw = str(soup)
-        return raw
-
-    def _hack_css(self, soup):
-        """Kryx does a lot of CSS rendering inline, so we need to use selenium to
-            grab the CSS elements, and hack them into the HTML. To preserve runtime,
-            we only do this once per element or class, assuming they do not change
-            much between pages. Desired HTML tags are loaded from HTML_TAGS.txt
-            and CSS selectors are loaded from CSS_SELECTORS.txt.
+        stored_css = self.capture_css(html_source)
+        html_source, headings, links = KryxClean.transform(html_source, None if record is None else record.url,
+                                                           self.clean_options(), stylesheet=self.stylesheet,
+                                                           stored_css=stored_css, image_cache=self.image_cache)
+        if record is not None:
+            with self.state_lock:
+                record.headings = headings
+                self.pages.set_links(record.url, links)
+        return html_source
+
+    def clean_options(self):
+        """Settings of the transform step of cleaning, for every page of this export.
+            Args: None
+            Kwargs: None
+            Fields: html_remove_tags, url_prefix, tracking_params, path, html_subdir
+            Output: options (KryxClean.CleanOptions) - the settings
+            External State: No change
+        """
+        return KryxClean.CleanOptions(remove_tags=self.html_remove_tags,
+                                      heading_tags=DEFAULT_HEADING_TAGS,
+                                      url_prefix=self.url_prefix,
+                                      tracking_params=self.tracking_params,
+                                      static_dir='/'.join([os.path.abspath(self.path), self.html_subdir]),
+                                      tag_order=HTML_TAG_ORDER)
+
+    def capture_css(self, html_source):
+        """Kryx does a lot of CSS rendering inline, so we need to use selenium to grab the
+            CSS of elements, and hack it into the HTML. To preserve runtime, we only do this
+            once per element or class, assuming they do not change much between pages.
+            Desired HTML tags are loaded from HTML_TAGS.txt and CSS selectors are loaded
+            from CSS_SELECTORS.txt, next to this module.
 
             We use only some CSS selectors because the actual computed selectors
             may not translate well to a PDF. E.g. taking the fixed width and height
-            selectors is generally not a good idea. 
-        """
-        [s.extract() for s in soup('script')]
-        style_tag = soup.new_tag('style', type='text/css')
-        elemform = "%s { %s } "
-        internalform = "%s: %s; "
-        classes = []
-        for element in soup.find_all(class_=True):
-            classes.extend(element["class"])
-        for tag in HTML_TAGS:
-            if tag in self.stored_css.keys():
-                style_tag.append(self.stored_css[tag])
-                continue
-            try:
-                tagelem = self.selenium_driver.find_element_by_tag_name(tag)
-            except selenium.common.exceptions.NoSuchElementException:
-                continue
-            properties = self.selenium_driver.execute_script('return window.getComputedStyle(arguments[0], null);', tagelem)
-            internaltext = ""
-            for property in properties:
-                if property in CSS_SELECTORS:
-                    value = tagelem.value_of_css_property(property)
-                    if len(value) > 0:
-                        internaltext += internalform % (property, value)
-            style_tag.append(elemform % (tag, internaltext))
-            self.stored_css[tag] = elemform % ('.'+tag, internaltext)
-        # TODO - consolidate this code
-        for tag in classes:
-            if tag in self.stored_css.keys():
-                style_tag.append(self.stored_css[tag])
-                continue
-            try:
-                tagelem = self.selenium_driver.find_element_by_class_name(tag)
-            except selenium.common.exceptions.NoSuchElementException:
-                continue
-            properties = self.selenium_driver.execute_script('return window.getComputedStyle(arguments[0], null);', tagelem)
-            internaltext = ""
-            for property in properties:
-                if property in CSS_SELECTORS:
-                    value = tagelem.value_of_css_property(property)
-                    if len(value) > 0:
-                        internaltext += internalform % (property, value)
-            style_tag.append(elemform % ('.'+tag, internaltext))
-            self.stored_css[tag] = elemform % ('.'+tag, internaltext)
-        soup.head.append(style_tag)
+            selectors is generally not a good idea.
+
+            If static_css is set and the site's stylesheets were loaded, tags and the classes
+            of the stylesheets are styled from them, and only classes no stylesheet mentions
+            (e.g. styled-components classes added at runtime) are captured.
+
+            This is the only step of cleaning which needs the browser, which must still be on
+            the page. Without a browser (e.g. when replaying from the cache), only stored CSS is used.
+
+            Args: html_source (str) - the raw page source
+            Kwargs: None
+            Fields: stylesheet, stored_css, selenium_driver, state_lock
+            Output: stored_css (dict[str:str]) - stored CSS of the tags and classes the page may use
+            External State: CSS of new tags and classes added to stored_css
+        """
+        classes = KryxClean.page_classes(html_source)
+        tags = list(HTML_TAG_ORDER)
+        if self.stylesheet is not None:
+            tags = []
+            classes = self.stylesheet.unstyled_classes(classes)
+        with self.state_lock:
+            if self.selenium_driver is not None:
+                import selenium.common.exceptions
+                for name, is_tag in [(tag, True) for tag in tags] + [(name, False) for name in classes]:
+                    if name in self.stored_css:
+                        continue
+                    try:
+                        if is_tag:
+                            element = self.selenium_driver.find_element_by_tag_name(name)
+                        else:
+                            element = self.selenium_driver.find_element_by_class_name(name)
+                    except selenium.common.exceptions.NoSuchElementException:
+                        continue
+                    selector = name if is_tag else '.' + name
+                    self.stored_css[name] = KryxClean.STORED_CSS_FORM % (selector, self._computed_css(element))
+            return {name: self.stored_css[name] for name in tags + classes if name in self.stored_css}
+
+    def _computed_css(self, element):
+        properties = self.selenium_driver.execute_script('return window.getComputedStyle(arguments[0], null);', element)
+        internaltext = ""
+        for property in properties:
+            if property in CSS_SELECTORS:
+                value = element.value_of_css_property(property)
+                if len(value) > 0:
+                    internaltext += "%s: %s; " % (property, value)
+        return internaltext
 
     def _resolve_static_path(self, src):
-        destination_path = os.path.normpath('/'.join([os.path.abspath(self.path), self.html_subdir, src])).replace('\\', '/')
-        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
-        return destination_path
-
-    def _resolve_image_base64(self, path):
-        with open(path, 'rb') as file:
-            encoding = base64.b64encode(file.read())
-            url = "data:image/png;base64, %s" % (encoding.decode())
-        return url
-
-    def _download_images(self, soup):
-        images = soup.findAll('img')
-        for image in images:
-            src = image.get('src')
-            if 'data:' in src:
-                continue
-            if 'http' in src:
-                url = src
-                src = 'static/media/%s' % url.rsplit('/', 1)[-1]
-            else:
-                url = "%s%s" % (self.url_prefix, src)
-            destination_path = self._resolve_static_path(src)
-            urllib.request.urlretrieve(url, destination_path)
-            image_data = self._resolve_image_base64(destination_path)
-            self.logger.vvdebug("Retrieved file %s from url %s to path %s" % (src, url, destination_path))
-            image['src'] = image_data
+        return KryxClean.static_path('/'.join([os.path.abspath(self.path), self.html_subdir]), src)
 
     def get_menuitem_links(self,
                            html_source):
         """Click all menuitem buttons on a page, and update links that appear after clicking on them.
+            All buttons are resolved to webdriver elements up front, by xpath, in one script call.
+            Clicking a button re-renders the menus, so a button which went stale is looked up
+            again by its id.
 
             Args: html_source (str) - source html for a page
             Kwargs: None
@@ -448,157 +719,552 @@ class KryxEtractor:
                     logger
             Output:
                 valid_links (list[str]) - list of strings with valid link urls
-            External State: no change, all buttons uncliked on webpage, and still on original URL
+            External State: page source after each click stored in page_states,
+                            all buttons uncliked on webpage, and still on original URL
         """
+        from selenium.common.exceptions import StaleElementReferenceException
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(html_source, 'html.parser')
-        clickableButtons = soup.findAll('button', {"type": "button"})
+        clickableButtons = [button for button in soup.findAll('button', {"type": "button"})
+                            if button.get('id') is not None and button.get('id') not in self.hit_buttons]
+        try:
+            sel_buttons = utils.find_elements_by_soup(self.selenium_driver, clickableButtons)
+        except Exception:
+            self._init_webdriver()
+            sel_buttons = utils.find_elements_by_soup(self.selenium_driver, clickableButtons)
         valid_links = []
-        for button in clickableButtons:
-            if button.get('id') in self.hit_buttons:
+        for button, sel_button in zip(clickableButtons, sel_buttons):
+            if sel_button is None:
                 continue
+            button_id = button.get('id')
+            self.logger.vdebug("Found button called %s" % button_id)
             try:
-                sel_button = self.selenium_driver.find_element_by_id(button.get('id'))
-            except selenium.common.exceptions.NoSuchElementException:
-                continue
-            except Exception:
-                self._init_webdriver()
-                sel_button = self.selenium_driver.find_element_by_id(button.get('id'))
-            self.logger.vdebug("Found button called %s" % button.get('id'))
-            sel_button.click()
+                sel_button.click()
+            except StaleElementReferenceException:
+                sel_button = self._find_button(button_id)
+                if sel_button is None:
+                    continue
+                sel_button.click()
             time.sleep(self.js_wait_interval)
             new_source = self.selenium_driver.page_source
+            self.page_states['menu:%s' % button_id] = new_source
             new_soup = BeautifulSoup(new_source, 'html.parser')
             valid_links += list([a.get('href') for a in new_soup.find_all(*self.button_seek_params)
                                  if a.get('href') not in valid_links])
-            action = webdriver.common.action_chains.ActionChains(self.selenium_driver)
-            action.move_to_element_with_offset(sel_button, self.click_offset, self.click_offset)
-            action.click()
-            action.perform()
+            try:
+                self._dismiss_menu(sel_button)
+            except StaleElementReferenceException:
+                sel_button = self._find_button(button_id)
+                if sel_button is not None:
+                    self._dismiss_menu(sel_button)
             time.sleep(self.js_wait_interval)
-            self.hit_buttons.append(button.get('id'))
+            self.hit_buttons.append(button_id)
         return valid_links
 
+    def _find_button(self, button_id):
+        """Look a button up again by its id, e.g. after the menus were re-rendered.
+            Args: button_id (str) - id of the button
+            Kwargs: None
+            Fields: selenium_driver, logger
+            Output: element (WebElement or None) - the button, None if it is gone
+            External State: No change
+        """
+        from selenium.common.exceptions import NoSuchElementException
+        try:
+            return self.selenium_driver.find_element_by_id(button_id)
+        except NoSuchElementException:
+            self.logger.vdebug("Button %s is no longer on the page" % button_id)
+            return None
+
+    def _dismiss_menu(self, sel_button):
+        """Click next to a button to close the menu it opened.
+            Args: sel_button (WebElement) - the button
+            Kwargs: None
+            Fields: selenium_driver, click_offset
+            Output: None
+            External State: menu closed
+        """
+        from selenium import webdriver
+        action = webdriver.common.action_chains.ActionChains(self.selenium_driver)
+        action.move_to_element_with_offset(sel_button, self.click_offset, self.click_offset)
+        action.click()
+        action.perform()
+
     def is_valid_ref(self,
                      ref,
                      fullref=None
                      ):
         """Check if a reference URL is valid, i.e. we do not want to ignore it,
                 it has not been visited already, and we're not already planning to visit it.
-                Also the URL is not an in-page link, with a "#", or a reference to a different
-                    external webpage.
+                Also the URL is on the same site and within the include/exclude scope rules.
+                URLs are compared in canonical form, so in-page links with a "#" resolve to
+                the page they are on, and absolute links to the same site are followed.
+                Visited pages are found in the page registry, since streaming drops them from the url index.
 
             Args: ref (str)     - the reference url to check
-            Kwargs: fullref (str) - an additional reference to check
-            Fields: ignore_urls, history, stack
+            Kwargs: fullref (str) - the canonical url of the reference, resolved against url_prefix if not given
+            Fields: ignore_urls, ignore_index, url_index, pages, scope
             Output: valid (bool) - is the URL valid
             External State: No change
         """
-        valid = ref not in self.ignore_urls + self.history + self.stack
-        if fullref is not None:
-            valid = valid and fullref not in self.ignore_urls + self.history + self.stack
-        valid = valid and 'http' not in ref
-        valid = valid and '#' not in ref
+        if ref is None:
+            return False
+        if fullref is None:
+            fullref = self.url_index.canonical(ref)
+        valid = KryxUrls.same_site(fullref, self.url_prefix)
+        valid = valid and ref not in self.ignore_urls
+        valid = valid and fullref not in self.ignore_index
+        valid = valid and fullref not in self.url_index
+        valid = valid and fullref not in self.pages
+        valid = valid and self.scope.in_scope(KryxUrls.relative_url(fullref), fullref)
         return valid
 
-    def get_links(self, html_source):
+    def get_links(self, html_source, url=None):
         """Grab all unvisited links on an HTML source page.
+                Links are only followed while the page is within max_depth of the start URL,
+                and only until max_pages pages are exported or planned. When neither limit
+                leaves room for new links, the page is not searched (and no buttons clicked) at all.
+                When the routes were discovered from the JS bundle, menus are only clicked if
+                route_menus is set, to find pages no route names and capture the menu states.
+
             Args: html_source (str) - the source html
-            Kwargs: None
-            Fields: None
+            Kwargs: url (str) - the url of the page, used to resolve relative links and track link depth
+            Fields: scope, url_depths, url_index, history, stack, routes, route_menus
             Output: links (list[str]) - list of valid reference URLs to visit
-            External State: No change, selenium driver on URL, no buttons clicked
+            External State: url_depths updated with the depth of new links,
+                            selenium driver on URL, no buttons clicked
         """
+        depth = self.url_depths.get(url, 0) + 1
+        planned = len(self.history) + len(self.stack)
+        if not self.scope.depth_allowed(depth) or not self.scope.pages_allowed(planned):
+            self.logger.vdebug("Crawl limits reached, not following links on %s" % url)
+            return []
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(html_source, 'html.parser')
-        valid_links = self.get_menuitem_links(html_source)
+        valid_links = []
+        if self.routes is None or self.route_menus:
+            valid_links = self.get_menuitem_links(html_source)
         valid_links += list([a.get('href') for a in soup.find_all('a') if a.get('href') not in valid_links])
         links = []
         for ref in valid_links:
-            fullref = "%s%s" % (self.url_prefix, ref)
-            if self.is_valid_ref(ref, fullref=fullref):
+            if ref is None:
+                continue
+            fullref = self.url_index.canonical(ref, base_url=url)
+            if self.is_valid_ref(ref, fullref=fullref) and fullref not in links:
+                if not self.scope.pages_allowed(planned + len(links)):
+                    break
                 links.append(fullref)
+                self.url_depths[fullref] = depth
         return links
 
     def make_output_filename(self, url, filetype):
         """Create an output filename for a given filetype.
             Filetypes supported are PDF and HTML.
-            PDF files are output with a page number in front of them.
+            PDF files are output with a page number in front of them, taken from the page registry.
             HTML files are just output with the slugified URL.
 
             Args: url   (str)   - the url to convert to a filename
                   filetype (str)    - 'pdf' or 'html' the filetype to create for
             Kwargs: None
-            Fields: start_url, url_replace, url_sep_char, path, history, html_subdir, pdf_subdir
+            Fields: start_url, url_replace, url_sep_char, path, pages, html_subdir, pdf_subdir
             External State: No change
         """
         prefix = url.replace(self.start_url, self.url_replacer)
         filename_prefix = prefix.replace(self.url_sep_char, '_')
-        filenames = dict(
-            pdf=os.path.join(self.path, self.pdf_subdir, "page_%d_%s.pdf" % (self.history.index(url), filename_prefix)),
-            html=os.path.join(self.path, self.html_subdir, "%s.html" % filename_prefix)
-        )
-        if filetype.lower() not in filenames.keys():
-            raise ValueError("Export filetype %s is not supported" % filetype)
-        return filenames.get(filetype.lower())
+        filename_prefix = re.sub(r'[^\w.-]+', '_', filename_prefix)
+        filetype = filetype.lower()
+        if filetype == 'pdf':
+            if url not in self.pages:
+                raise ValueError("URL %s is not in the page registry" % url)
+            return os.path.join(self.path, self.pdf_subdir, "page_%d_%s.pdf" % (self.pages.number(url), filename_prefix))
+        if filetype == 'html':
+            return os.path.join(self.path, self.html_subdir, "%s.html" % filename_prefix)
+        raise ValueError("Export filetype %s is not supported" % filetype)
+
+    def save_page_manifest(self):
+        """Save the page registry as a JSON manifest in the export path. In streaming mode,
+            the records flushed to the page journal are merged back in.
+            Args: None
+            Kwargs: None
+            Fields: pages, path, page_manifest, page_journal_path
+            Output: None
+            External State: page manifest exists in path
+        """
+        self.pages.save(os.path.join(self.path, self.page_manifest), journal=self.page_journal_path)
 
-    def export_page_from_url(self, url):
-        """Exports HTML and PDF pages from a URL.
+    def export_page_from_url(self, url, follow_links=True):
+        """Exports HTML and PDF pages from a URL. The page is registered in the page
+            registry if it is not already, and its output paths, content hash and
+            stage timings are recorded there. If cache_pages is set, the raw page source
+            (and the page states captured while clicking menus) is cached for replay.
 
             Args: url (str) -   the url to export from
-            Kwargs: None
-            Fields: logger
-            Output: html_source, the final html source which is output
+            Kwargs: follow_links (bool) - find new links on the page (set False to just re-export it)
+            Fields: logger, pages, page_cache, page_states, state_lock
+            Output: html_source, the final html source which is output (None if it is cleaned in the clean pool)
                     new_links, links extracted prior to cleaning
             External State: exported PDF file exists and HTML exists, selenium driver on URL
         """
-        filename_pdf = self.make_output_filename(url, 'pdf')
-        filename_html = self.make_output_filename(url, 'html')
+        with self.state_lock:
+            record = self.pages.add(url)
+        self.page_states = dict()
         start = timeit.default_timer()
-        try:
-            self.selenium_driver.get(url)
-        except Exception:
-            self._init_webdriver()
-            self.selenium_driver.get(url)
-        html_source = self.selenium_driver.page_source
-        self.logger.vvdebug("Took %f seconds to navigate to page" % (timeit.default_timer()-start))
+        with self.profiler.stage(url, 'navigate'):
+            self._navigate(url)
+            html_source = self.selenium_driver.page_source
+        record.timings['navigate'] = timeit.default_timer()-start
+        self.logger.vvdebug("Took %f seconds to navigate to page" % record.timings['navigate'])
+        self.profiler.capture_browser_timing(url, self.selenium_driver)
         start = timeit.default_timer()
-        new_links = self.get_links(html_source)
-        self.logger.vvdebug("Took %f seconds to grab new links on page" % (timeit.default_timer()-start))
+        new_links = []
+        if follow_links:
+            with self.profiler.stage(url, 'links'):
+                new_links = self.get_links(html_source, url=url)
+        record.timings['links'] = timeit.default_timer()-start
+        self.logger.vvdebug("Took %f seconds to grab new links on page" % record.timings['links'])
+        if self.cache_pages:
+            with self.profiler.stage(url, 'cache'), self.state_lock:
+                self.page_cache.save(url, html_source, states=self.page_states)
+        html_source = self.render_page(url, html_source, states=self.page_states)
+        return html_source, new_links
+
+    def render_page(self, url, html_source, states=None):
+        """Clean a raw page source and render it to HTML and PDF files. Needs no browser
+            if all the CSS the page uses is already stored. The HTML is written through the
+            html store (compressed if compress_html is set), and the PDF is rendered from
+            the cleaned source in memory. If near_duplicates is set, no PDF is rendered for
+            pages which are near-duplicates of an earlier page. The cleaned source is also
+            added to the open books, and no PDF is rendered at all if 'pdf' is not in formats.
+
+            If clean_workers is set, only the CSS capture runs here: the page is cleaned in the
+            clean pool while the browser moves on, and written out by finish_pages, in page order.
+
+            Args: url (str) -   the url of the page
+                  html_source (str) - the raw page source
+            Kwargs: states (dict[str:str]) - extra page sources captured on the page (unused here)
+            Fields: logger, pages, html_store, books, formats, clean_workers, state_lock
+            Output: html_source, the final html source which is output (None if it is cleaned in the pool)
+            External State: exported PDF file exists and HTML exists, page added to the open books
+        """
+        with self.state_lock:
+            record = self.pages.add(url)
+            if record.pdf_path is None:
+                record.pdf_path = self.make_output_filename(url, 'pdf')
+            if record.html_path is None:
+                record.html_path = self.make_output_filename(url, 'html')
+        if self.clean_workers > 0:
+            with self.profiler.stage(url, 'capture'):
+                stored_css = self.capture_css(html_source)
+            self._clean_pool().submit(record, html_source, url, stored_css=stored_css)
+            self.finish_pages()
+            return None
         start = timeit.default_timer()
-        html_source = self.clean_html(html_source)
-        self.logger.vvdebug("Took %f seconds clean HTML" % (timeit.default_timer()-start))
+        with self.profiler.stage(url, 'clean'):
+            html_source = self.clean_html(html_source, record=record)
+        record.timings['clean'] = timeit.default_timer()-start
+        self.logger.vvdebug("Took %f seconds clean HTML" % record.timings['clean'])
+        self._write_page(record, html_source)
+        return html_source
+
+    def _clean_pool(self):
+        """The pool cleaning pages off the browser thread, started on first use.
+            Args: None
+            Kwargs: None
+            Fields: clean_pool, clean_workers, stylesheet
+            Output: pool (KryxClean.CleanPool) - the clean pool
+            External State: clean_workers processes running
+        """
+        if self.clean_pool is None:
+            self.logger.vverbose("Starting %d cleaning processes..." % self.clean_workers)
+            self.clean_pool = KryxClean.CleanPool(self.clean_options(), stylesheet=self.stylesheet,
+                                                  max_workers=self.clean_workers)
+        return self.clean_pool
+
+    def finish_pages(self, wait=False):
+        """Write out the pages cleaned in the clean pool, in the order they were submitted.
+            Without wait, only pages which are done are written, unless too many are pending.
+            Args: None
+            Kwargs: wait (bool) - wait for every page in the pool, and stop the pool afterwards
+            Fields: clean_pool, pages, logger
+            Output: None
+            External State: HTML and PDF files of the finished pages exist
+        """
+        if self.clean_pool is None:
+            return
+        for record, html_source, headings, links, seconds in self.clean_pool.results(wait=wait):
+            with self.state_lock:
+                record.headings = headings
+                self.pages.set_links(record.url, links)
+            record.timings['clean'] = seconds
+            self.logger.vvdebug("Took %f seconds clean HTML of page %d" % (seconds, record.page_number))
+            self._write_page(record, html_source)
+        if wait:
+            self.clean_pool.close()
+            self.clean_pool = None
+
+    def _write_page(self, record, html_source):
+        """Write a cleaned page to its HTML and PDF files and to the open books, and to
+            the current output volume in streaming mode.
+            Args: record (PageRecord) - the page
+                  html_source (str) - the cleaned page
+            Kwargs: None
+            Fields: logger, html_store, formats, streaming, state_lock
+            Output: None
+            External State: exported PDF file exists and HTML exists, page added to the open books
+        """
+        url = record.url
+        filename_pdf = record.pdf_path
+        filename_html = record.html_path
+        record.content_hash = hashlib.sha1(html_source.encode('utf-8')).hexdigest()
         self.logger.vvverbose("Creating HTML file %s" % filename_html)
         start = timeit.default_timer()
-        with open(filename_html, 'w', encoding='utf-8') as file:
-            file.write(html_source)
-        self.logger.vvdebug("Took %f seconds write HTML" % (timeit.default_timer()-start))
-        self.logger.vvverbose("Creating PDF file %s" % filename_pdf)
+        with self.profiler.stage(url, 'write_html'), self.state_lock:
+            self.html_store.write(filename_html, html_source)
+        record.timings['write_html'] = timeit.default_timer()-start
+        self.logger.vvdebug("Took %f seconds write HTML" % record.timings['write_html'])
+        duplicate = self._check_duplicate(record, html_source)
+        self._add_to_books(record, html_source)
+        if not duplicate and 'pdf' in self.formats:
+            start = timeit.default_timer()
+            with self.profiler.stage(url, 'write_pdf'):
+                reused = self._reuse_pdf(record)
+                if not reused:
+                    import pdfkit
+                    self.logger.vvverbose("Creating PDF file %s" % filename_pdf)
+                    try:
+                        pdfkit.from_string(html_source, filename_pdf)
+                    except OSError as ex:
+                        pass
+                    record.page_count = self._count_pdf_pages(filename_pdf)
+            record.timings['write_pdf'] = timeit.default_timer()-start
+            self.logger.vvdebug("Took %f seconds write PDF" % record.timings['write_pdf'])
+        if self.streaming:
+            self.stream_page(record)
+
+    def _check_duplicate(self, record, html_source):
+        """Check whether a page is a near-duplicate of an earlier page, and record it if so.
+            Args: record (PageRecord) - the page
+                  html_source (str) - the cleaned page
+            Kwargs: None
+            Fields: similarity, duplicates, logger
+            Output: duplicate (bool) - whether the page is a near-duplicate
+            External State: stale PDF of a near-duplicate page removed
+        """
+        record.duplicate_of = None
+        self.duplicates.pop(record.url, None)
+        if self.similarity is None:
+            return False
+        start = timeit.default_timer()
+        with self.profiler.stage(record.url, 'similarity'):
+            match, similarity = self.similarity.check(record.url, html_source)
+        record.timings['similarity'] = timeit.default_timer()-start
+        if match is None:
+            return False
+        record.duplicate_of = match
+        record.page_count = 0
+        self.duplicates[record.url] = (match, similarity)
+        if record.pdf_path is not None and os.path.exists(record.pdf_path):
+            os.remove(record.pdf_path)
+        self.logger.verbose("Page %s is a near-duplicate of %s (%.2f), not rendering it" % (record.url, match, similarity))
+        return True
+
+    def _add_to_books(self, record, html_source):
+        """Add a cleaned page to the open books. A near-duplicate page is left out, or gets
+            a contents entry pointing at its original in collapse mode.
+            Args: record (PageRecord) - the page
+                  html_source (str) - the cleaned page
+            Kwargs: None
+            Fields: books, pages, near_duplicates, profiler
+            Output: None
+            External State: page written to the open books
+        """
+        if self.books is None:
+            return
         start = timeit.default_timer()
+        key = 'page-%d' % record.page_number
+        parent = self.page_parent(record.url)
+        parent = None if parent is None else 'page-%d' % parent
+        title = self.page_title(record)
+        with self.profiler.stage(record.url, 'write_books'):
+            for book in self.books.values():
+                if record.duplicate_of is None:
+                    book.add_page(key, title, html_source, parent=parent, url=record.url)
+                elif self.near_duplicates == 'collapse' and record.duplicate_of in self.pages:
+                    book.add_alias(key, title, 'page-%d' % self.pages.number(record.duplicate_of), parent=parent,
+                                   url=record.url)
+        record.timings['write_books'] = timeit.default_timer()-start
+
+    def book_filename(self, output_format):
+        """Path of the compiled book in a format, named after the compiled PDF.
+            Args: output_format (str) - 'html' or 'epub'
+            Kwargs: None
+            Fields: path, output_filename
+            Output: filename (str) - path of the book
+            External State: No change
+        """
+        return os.path.join(self.path, "%s.%s" % (os.path.splitext(self.output_filename)[0], output_format))
+
+    def _open_books(self):
+        """Open a book writer for every selected format other than PDF, so pages are
+            written to them as they are rendered. Links to pages of the site point inside the books.
+            Args: None
+            Kwargs: None
+            Fields: formats, books, url_replacer, version, url_prefix
+            Output: None
+            External State: book files are being written in path
+        """
+        self.export_books()
+        writers = {output_format: KryxBook.BOOK_WRITERS[output_format]
+                   for output_format in self.formats if output_format in KryxBook.BOOK_WRITERS}
+        if len(writers) == 0:
+            return
+        title = "%s v%s" % (self.url_replacer, self.version)
+        self.books = {output_format: writer(self.book_filename(output_format), title, site_url=self.url_prefix)
+                      for output_format, writer in writers.items()}
+
+    def export_books(self):
+        """Finish the open books.
+            Args: None
+            Kwargs: None
+            Fields: books, logger
+            Output: None
+            External State: compiled books exist in path
+        """
+        if self.books is None:
+            return
+        for book in self.books.values():
+            book.close()
+            self.logger.basic("Wrote %d pages to %s" % (book.pages, book.filename))
+        self.books = None
+
+    def save_duplicate_report(self):
+        """Save the report of near-duplicate pages found so far in the export path.
+            Args: None
+            Kwargs: None
+            Fields: duplicates, near_duplicates, duplicate_threshold, path, duplicate_report, logger
+            Output: None
+            External State: duplicate report exists in path
+        """
+        if self.similarity is None:
+            return
+        report = dict(mode=self.near_duplicates, threshold=self.duplicate_threshold,
+                      pages=len(self.pages), duplicates=[dict(url=url, duplicate_of=match, similarity=round(similarity, 3))
+                                                         for url, (match, similarity) in self.duplicates.items()])
+        with open(os.path.join(self.path, self.duplicate_report), 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+        self.logger.basic("Found %d near-duplicate pages of %d" % (len(self.duplicates), len(self.pages)))
+
+    def _reuse_pdf(self, record):
+        """Copy the PDF of a page from the reused version if its cleaned HTML is unchanged.
+            Args: record (PageRecord) - the page, with its content hash set
+            Kwargs: None
+            Fields: reused_pages, logger
+            Output: reused (bool) - whether the PDF was copied
+            External State: PDF file of the page exists if it was copied
+        """
+        if self.reused_pages is None:
+            return False
+        previous = self.reused_pages.get(record.url)
+        if previous is None or previous.content_hash != record.content_hash:
+            return False
+        if previous.pdf_path is None or not os.path.exists(previous.pdf_path):
+            return False
+        shutil.copyfile(previous.pdf_path, record.pdf_path)
+        record.page_count = previous.page_count
+        self.logger.vvverbose("Reused PDF file %s for unchanged page" % previous.pdf_path)
+        return True
+
+    def _count_pdf_pages(self, filename):
+        """Count the pages of a PDF file.
+            Args: filename (str) - the PDF file
+            Kwargs: None
+            Output: count (int or None) - number of pages, None if the file is missing or unreadable
+            External State: No change
+        """
+        from PyPDF2 import PdfFileReader
+        from PyPDF2.utils import PdfReadError
         try:
-            pdfkit.from_file(filename_html, filename_pdf)
-        except OSError as ex:
-            pass
-        self.logger.vvdebug("Took %f seconds write PDF" % (timeit.default_timer()-start))
-        return html_source, new_links
+            with open(filename, 'rb') as file:
+                return PdfFileReader(file, strict=False).getNumPages()
+        except (OSError, PdfReadError):
+            return None
+
+    def replay_from_cache(self):
+        """Re-export every page of a previous crawl from the page source cache, without
+            starting a browser. Pages are replayed in the order of the saved page manifest,
+            and the stylesheets (or CSS computed during the crawl) are reused from the cache.
+
+            Args: None
+            Kwargs: None
+            Fields: pages, page_cache, page_manifest, stored_css, logger
+            Output: None
+            External State: HTML and PDF files exist for every cached page
+        """
+        manifest = os.path.join(self.path, self.page_manifest)
+        if len(self.pages) == 0 and os.path.exists(manifest):
+            self.pages = KryxPages.PageRegistry.load(manifest)
+            self.history = self.pages.urls
+        if len(self.pages) == 0:
+            self.logger.basic("No page manifest found at %s, nothing to replay" % manifest)
+            return
+        self.stored_css.update(self.page_cache.load_json('stored_css', dict()))
+        if self.static_css:
+            self._load_stylesheet()
+        self._open_books()
+        starttime = timeit.default_timer()
+        self.logger.basic("Replaying %d pages from cache %s" % (len(self.pages), self.page_cache.path))
+        for record in list(self.pages):
+            html_source, states = self.page_cache.load(record.url)
+            if html_source is None:
+                self.logger.basic("URL %s is not cached, skipping it" % record.url)
+                continue
+            self.logger.verbose("Replaying URL %s at page %d" % (record.url, record.page_number))
+            self.render_page(record.url, html_source, states=states)
+        self.finish_pages(wait=True)
+        self.logger.basic("Finished replaying. Took %f seconds" % (timeit.default_timer()-starttime))
+        self.save_page_manifest()
+        self.save_duplicate_report()
+
+    def latest_local_version(self):
+        """Find the most recently written version exported or cached in the export directory,
+            without any network access.
+            Args: None
+            Kwargs: None
+            Fields: export_dir, url_replacer, cache_dir
+            Output: version (str or None) - the latest local version, None if there is none
+            External State: No change
+        """
+        prefix = '%s_v' % self.url_replacer
+        versions = []
+        if os.path.isdir(self.export_dir):
+            versions = [entry for entry in os.listdir(self.export_dir)
+                        if entry.startswith(prefix) and os.path.isdir(os.path.join(self.export_dir, entry))]
+        if len(versions) == 0:
+            return KryxCache.latest_version(self.cache_dir)
+        latest = max(versions, key=lambda entry: os.path.getmtime(os.path.join(self.export_dir, entry)))
+        return latest[len(prefix):]
 
     def get_latest_version(self):
-        """Get the latest version from the changelog. Assumes that the version
-            is the only string on the page which uses the h1 tag. This is based
-            on how Kryx designed the site as of 6/29/2019.
+        """Get the latest version from the changelog. The changelog is fetched over
+            plain HTTP and the version is the first version number in its headings (or the
+            highest one in its JS bundle). Only if that fails is the changelog rendered in
+            selenium.
 
             Args: None
             Kwargs: None
             Fields: changelog_url, selenium_driver, version
-            Output: version, the latest version which is found
-            External State: selenium driver on changelog page
+            Output: version, the latest version which is found ("0" if none is found)
+            External State: selenium driver on changelog page if HTTP lookup failed
         """
-        if not self.start_selenium:
-            return "0"
+        try:
+            version = KryxWatch.fetch_version(self.changelog_url)
+        except (urllib.error.URLError, OSError, ValueError):
+            version = None
+        if version is not None or not self.start_selenium:
+            return version or "0"
+        self.selenium_driver = self.driver_manager.ensure(apply_settings=False)
         self.selenium_driver.get(self.changelog_url)
-        html_source = self.selenium_driver.page_source
-        soup = BeautifulSoup(html_source, 'html.parser')
-        versions = soup.findAll("h1", {"class": "sc-gzVnrw feaeiA"})
-        version = versions[0].getText()
-        return version
+        return KryxWatch.extract_version(self.selenium_driver.page_source) or "0"
 
     def init_site_settings(self):
         """Initialize settings on the site. Since selenium spawns a new window
@@ -611,6 +1277,7 @@ class KryxEtractor:
             Output: None
             External State: Metric System off on selenium-driven webpage
         """
+        from selenium import webdriver
         sel_button = self.selenium_driver.find_element_by_id('settings')
         self.logger.vvverbose("Clicking on settings button...")
         sel_button.click()
@@ -625,12 +1292,100 @@ class KryxEtractor:
         time.sleep(self.js_wait_interval)
 
     def _retrieve_css(self):
+        """Download the site's stylesheets next to the intermediate HTML, and load them for
+            static style resolution if static_css is set.
+            Args: None
+            Kwargs: None
+            Fields: css_file, url_prefix, static_css, logger
+            Output: None
+            External State: CSS files exist in the html subdir
+        """
+        filepaths = []
         for src in self.css_file:
             #filename = url.rsplit('/', 1)[-1]
             url = "%s%s" % (self.url_prefix, src)
             filepath = self._resolve_static_path(src)
-            urllib.request.urlretrieve(url, filepath)
+            try:
+                urllib.request.urlretrieve(url, filepath)
+            except (urllib.error.URLError, OSError) as ex:
+                self.logger.basic("Could not retrieve CSS file %s (%s)" % (url, ex))
+                continue
+            filepaths.append(filepath)
             self.logger.vvverbose("Retrieved file %s from url %s to path %s" % (src, url, filepath))
+        if self.static_css:
+            self._load_stylesheet(filepaths)
+
+    def _load_stylesheet(self, filenames=None):
+        """Parse the site's stylesheets for static style resolution. Stylesheets are read
+            from the given files and saved to the page source cache, or loaded from the cache
+            (downloading them if they are not cached) when no files are given.
+            Args: None
+            Kwargs: filenames (list[str]) - downloaded CSS files, None to use the cache
+            Fields: page_cache, cache_pages, stylesheet, logger
+            Output: None
+            External State: stylesheets cached, if cache_pages
+        """
+        if filenames is None:
+            sources = self.page_cache.load_json('stylesheets')
+            if sources is None:
+                self._retrieve_css()
+                return
+        else:
+            sources = []
+            for filename in filenames:
+                with open(filename, 'r', encoding='utf-8', errors='replace') as file:
+                    sources.append(file.read())
+            if self.cache_pages and len(sources) > 0:
+                self.page_cache.save_json('stylesheets', sources)
+        if len(sources) == 0:
+            self.logger.basic("No stylesheets loaded, resolving styles with the browser")
+            return
+        start = timeit.default_timer()
+        self.stylesheet = KryxCss.StyleSheet(sources, properties=CSS_SELECTORS)
+        self.logger.vvdebug("Took %f seconds to parse %d CSS rules" % (timeit.default_timer()-start, len(self.stylesheet.rules)))
+
+    def discover_routes(self):
+        """Discover the site's routes statically from its JavaScript bundle, and save
+            them as a route manifest. Falls back to click-based discovery (returning None)
+            if the bundle cannot be fetched or no routes are found in it.
+
+            Args: None
+            Kwargs: None
+            Fields: start_url, path, route_manifest, logger
+            Output: routes (list[str] or None) - canonical urls of all discovered routes
+            External State: route manifest exists in path if routes were found
+        """
+        self.logger.verbose("Discovering routes from the JS bundle at %s..." % self.start_url)
+        start = timeit.default_timer()
+        try:
+            routes = KryxRoutes.discover_routes(self.start_url)
+        except (urllib.error.URLError, OSError, ValueError) as ex:
+            self.logger.basic("Route discovery failed (%s), falling back to clicking through menus" % ex)
+            return None
+        if len(routes) == 0:
+            self.logger.basic("No routes found in the JS bundle, falling back to clicking through menus")
+            return None
+        routes = [self.url_index.canonical(route) for route in routes]
+        KryxRoutes.save_route_manifest(routes, os.path.join(self.path, self.route_manifest))
+        self.logger.vvdebug("Took %f seconds to discover %d routes" % (timeit.default_timer()-start, len(routes)))
+        return routes
+
+    def _seed_routes(self, routes):
+        """Push discovered routes onto the stack, in bundle order, behind the start URL.
+            Args: routes (list[str]) - canonical urls of the discovered routes
+            Kwargs: None
+            Fields: stack, url_index, url_depths, scope
+            Output: None
+            External State: valid routes are in the stack
+        """
+        for route in routes:
+            if not self.scope.pages_allowed(len(self.history) + len(self.stack)):
+                break
+            if self.is_valid_ref(KryxUrls.relative_url(route), fullref=route):
+                self.stack.append(route)
+                self.url_index.add(route)
+                self.url_depths[route] = 1
+        self.logger.verbose("Seeded %d routes from the route manifest" % (len(self.stack) - 1))
 
     def crawl(self):
         """This function controls all of the actual crawling which is done. Start from the
@@ -639,9 +1394,12 @@ class KryxEtractor:
             history of the search. This means that the output PDF is organized by following the links
             in the order they are found on the site, and in the order they appear on each subsequent page.
 
+            If route_discovery is set, the stack is seeded with every route found in the site's
+            JS bundle. Menus are still clicked to find links unless route_menus is off.
+
             Order of crawling operations:
                 1. Initialize Site settings (turn metric system off)
-                2. Append the start URL to the stack and history
+                2. Append the start URL (and any discovered routes) to the stack and history
                 3. Begin the crawling loop
                 4. While there are URLs in the stack to visit, visit top URL on stack, append it to history
                 5. Export the page after cleaning to HTML and PDF format
@@ -658,84 +1416,417 @@ class KryxEtractor:
                             pdf pages exist in html_subdir
         """
         self._init_paths()  # init paths again, just in case they've been cleaned up
+        self._init_webdriver()
         self._retrieve_css()
-        try:
-            self.init_site_settings()
-        except Exception:
-            self._init_webdriver()
-            self.init_site_settings()
+        self._open_books()
         self.stack.append(self.start_url)
+        self.url_index.add(self.start_url)
+        self.url_depths[self.start_url] = 0
+        if self.route_discovery:
+            self.routes = self.discover_routes()
+            if self.routes is not None:
+                self._seed_routes(self.routes)
         starttime = timeit.default_timer()
         self.logger.basic("Starting to crawl at %s" % self.start_url)
         while len(self.stack) > 0:
+            if not self.scope.pages_allowed(len(self.history)):
+                self.logger.basic("Reached max_pages (%d), stopping crawl" % self.max_pages)
+                break
             crawlstart = timeit.default_timer()
             url = self.stack[0]
-            self.history.append(url)
-            self.logger.verbose(("Exporting URL %s at page %s" % (url, self.history.index(url))))
+            record = self.pages.add(url)
+            self.logger.verbose(("Exporting URL %s at page %s" % (url, record.page_number)))
             source, new_links = self.export_page_from_url(url)
 
             self.logger.vvdebug("Found links: %s" % (str(new_links)))
             self.stack.remove(url)
             self.stack = new_links + self.stack
+            self.url_index.update(new_links)
             self.logger.vdebug(("%d pages now left in stack..." % len(self.stack)))
             crawlend = timeit.default_timer()
             self.logger.verbose("Exported URL %s in %f seconds" % (url, crawlend-crawlstart))
+            done = len(self.history)
+            self.logger.verbose("Progress: %d of %d known pages, ETA %f seconds"
+                                % (done, done + len(self.stack), (crawlend-starttime) / done * len(self.stack)))
             self.logger.vverbose("sleeping for %f seconds..." % (self.page_wait_interval))
             time.sleep(self.page_wait_interval)
+        self.finish_pages(wait=True)
         endtime = timeit.default_timer()
         self.logger.basic("Finished crawling. Took %f seconds" % (endtime-starttime))
+        self.save_page_manifest()
+        self.save_duplicate_report()
+        if self.cache_pages:
+            self.page_cache.save_json('stored_css', self.stored_css)
         self._crawl_cleanup()
 
     def _crawl_cleanup(self):
         if not self.keep_html:
             os.rmdir(os.path.join(self.path, self.html_subdir))
-        try:
-            self.selenium_driver.close()
-        except selenium.common.exceptions.WebDriverException:
-            pass
+        self._webdriver_cleanup()
 
-    def pdf_cat(self, input_files, output_stream):
+    def pdf_cat(self, input_files, output_stream, outline=None, aliases=None, names=None, links=None):
         """
             Concatenate a list of PDF files to a file output stream.
+            If optimize_pdf is set, pages are streamed to the output one input file at a time,
+            identical fonts and images are written only once, and uncompressed content streams
+            are compressed. Otherwise all pages are collected in a PyPDF2 writer first.
 
             Args: input_files (list[str]) - list of pdf input files
                    output_stream (python file stream) - python file stream
-            Kwargs: None
-            Fields: None
+            Kwargs: outline (list[(str, int)]) - bookmark title and index of the parent bookmark (or None)
+                                                 for each input file, pointing at its first page
+                    aliases (dict[int, int]) - index of another input file whose first page the bookmark
+                                               of an input file points at instead (for inputs without pages)
+                    names (list[str]) - named destination of the first page of each input file (or None)
+                    links (list[dict[str:str]]) - destination name of each canonical url linked from each
+                                                  input file (or None); those links are rewritten to the destinations
+            Fields: optimize_pdf, url_index, logger
             Output: None
             External State: output stream has created compiled pdf
         """
+        from PyPDF2 import PdfFileWriter, PdfFileReader
+        from PyPDF2.generic import createStringObject
+        import KryxPdf
+        if self.optimize_pdf:
+            writer = KryxPdf.StreamingPdfWriter(output_stream)
+            destinations = []
+            for n, input_file in enumerate(input_files):
+                refs = writer.add_file(input_file, links=self._link_resolver(links, n)) if input_file is not None else []
+                destinations.append(refs[0] if len(refs) > 0 else None)
+            for name, destination in zip(names or [], destinations):
+                if name is not None and destination is not None:
+                    writer.add_named_destination(name, destination)
+            if outline is not None:
+                self._alias_destinations(destinations, aliases)
+                self._add_outline(writer.add_bookmark, destinations, outline)
+            writer.close()
+            self.logger.verbose("Shared %d duplicate fonts, images and streams" % writer.deduplicated)
+            self.logger.verbose("Linked %d internal links to pages of the PDF" % writer.links)
+            return
         input_streams = []
         try:
             for input_file in input_files:
-                input_streams.append(open(input_file, 'rb'))
+                input_streams.append(open(input_file, 'rb') if input_file is not None else None)
             writer = PdfFileWriter()
-            for reader in map(PdfFileReader, input_streams):
+            destinations = []
+            for index, stream in enumerate(input_streams):
+                reader = PdfFileReader(stream) if stream is not None else None
+                if reader is None or reader.getNumPages() == 0:
+                    destinations.append(None)
+                    continue
+                destinations.append(writer.getNumPages())
+                resolve = self._link_resolver(links, index)
                 for n in range(reader.getNumPages()):
-                    writer.addPage(reader.getPage(n))
+                    page = reader.getPage(n)
+                    if resolve is not None:
+                        KryxPdf.rewrite_links(page, resolve)
+                    writer.addPage(page)
+            for name, destination in sorted((name, destination) for name, destination in zip(names or [], destinations)
+                                            if name is not None and destination is not None):
+                writer.addNamedDestination(createStringObject(name), destination)
+            if outline is not None:
+                self._alias_destinations(destinations, aliases)
+                self._add_outline(writer.addBookmark, destinations, outline)
             writer.write(output_stream)
         finally:
             for f in input_streams:
-                f.close()
+                if f is not None:
+                    f.close()
+
+    def _link_resolver(self, links, index):
+        """Make the function resolving link URIs of an input file to destination names.
+            Args: links (list[dict[str:str]]) - destination name of each canonical url linked from each input
+                  index (int) - index of the input file
+            Kwargs: None
+            Fields: url_index
+            Output: resolve (function or None) - takes a URI, returns a destination name or None
+            External State: No change
+        """
+        if links is None or links[index] is None or len(links[index]) == 0:
+            return None
+        targets = links[index]
+        return lambda uri: targets.get(self.url_index.canonical(uri))
+
+    def link_destinations(self):
+        """Named destinations of the pages, and the destination of every page each page
+            links to, built in one pass over the link graph of the page registry. Links to a
+            near-duplicate page go to the page it duplicates.
+            Args: None
+            Kwargs: None
+            Fields: pages
+            Output: names (list[str]) - named destination of each page
+                    links (list[dict[str:str]]) - destination name of each canonical url each page links to
+            External State: No change
+        """
+        self.pages.resolve_links()
+        records = list(self.pages)
+        positions = {record.url: index for index, record in enumerate(records)}
+        targets = [positions.get(record.duplicate_of, index) for index, record in enumerate(records)]
+        names = [DESTINATION_NAME % index for index in range(len(records))]
+        links = [{records[target].url: names[targets[target]] for target in record.links if target < len(records)}
+                 for record in records]
+        return names, links
+
+    @staticmethod
+    def _alias_destinations(destinations, aliases):
+        for index, original in (aliases or dict()).items():
+            if destinations[index] is None:
+                destinations[index] = destinations[original]
+
+    def _add_outline(self, add_bookmark, destinations, outline):
+        """Add bookmarks for input files to a PDF writer. Parents are added before their
+            children, and bookmarks of inputs without pages are skipped (their children move up).
+
+            Args: add_bookmark (function) - the writer's add bookmark function, taking (title, destination, parent)
+                  destinations (list) - the writer's destination for the first page of each input, None if it has no pages
+                  outline (list[(str, int)]) - bookmark title and parent index for each input
+            Kwargs: None
+            Output: None
+            External State: bookmarks added to the writer
+        """
+        items = dict()
+
+        def add(index):
+            if index is None:
+                return None
+            if index not in items:
+                title, parent = outline[index]
+                parent_item = add(parent)
+                items[index] = parent_item
+                if destinations[index] is not None:
+                    items[index] = add_bookmark(title, destinations[index], parent_item)
+            return items[index]
+
+        for index in range(len(outline)):
+            add(index)
+
+    def page_title(self, record):
+        """Title of a page, i.e. its first h1 heading, or its path if it has none.
+            Args: record (PageRecord) - the page
+            Kwargs: None
+            Output: title (str) - the title
+            External State: No change
+        """
+        for level, text in record.headings:
+            if level == 1 and len(text) > 0:
+                return text
+        return KryxUrls.relative_url(record.url)
+
+    def build_outline(self):
+        """Build the outline of the compiled PDF from the page registry. Each page is
+            nested under the closest page whose URL is a parent path of its own.
+
+            Args: None
+            Kwargs: None
+            Fields: pages
+            Output: outline (list[(str, int)]) - title and parent index for each page, in page order
+            External State: No change
+        """
+        return [(self.page_title(record), self.page_parent(record.url)) for record in self.pages]
+
+    def page_parent(self, url):
+        """Page number of the closest registered page whose URL is a parent path of a url.
+            Args: url (str) - the url
+            Kwargs: None
+            Fields: pages
+            Output: page_number (int or None) - the parent page, None if there is none
+            External State: No change
+        """
+        while url.count('/') > 2:
+            url = url.rsplit('/', 1)[0]
+            if url in self.pages:
+                return self.pages.number(url)
+        return None
+
+    def _front_matter_html(self, outline, page_counts, offset):
+        """Make the HTML of the title page and table of contents.
+            Args: outline (list[(str, int)]) - title and parent index for each page
+                  page_counts (list[int]) - number of PDF pages of each page
+                  offset (int) - number of pages of the front matter itself
+            Kwargs: None
+            Fields: url_replacer, version
+            Output: html_source (str) - the front matter html
+            External State: No change
+        """
+        depths = self._outline_depths(outline)
+        rows = []
+        page = offset + 1
+        for (title, parent), depth, count in zip(outline, depths, page_counts):
+            if count > 0:
+                rows.append('<tr><td style="padding-left: %dem">%s</td><td style="text-align: right">%d</td></tr>'
+                            % (depth * 2, html.escape(title), page))
+            page += count
+        title = html.escape("%s v%s" % (self.url_replacer, self.version))
+        return ('<html><head><meta charset="utf-8"><title>%s</title></head><body>'
+                '<h1 style="text-align: center; margin-top: 40%%; page-break-after: always">%s</h1>'
+                '<h2>Contents</h2><table style="width: 100%%">%s</table></body></html>'
+                % (title, title, ''.join(rows)))
+
+    @staticmethod
+    def _outline_depths(outline):
+        """Nesting depth of each outline entry. A parent page may come after its children
+            (it is often crawled later), so depths are memoized recursively, like _add_outline.
+            Args: outline (list[(str, int)]) - title and parent index for each page
+            Kwargs: None
+            Output: depths (list[int]) - depth of each entry, 0 for entries without a parent
+            External State: No change
+        """
+        depths = dict()
+
+        def depth(index):
+            if index not in depths:
+                parent = outline[index][1]
+                depths[index] = 0 if parent is None else depth(parent) + 1
+            return depths[index]
+
+        return [depth(index) for index in range(len(outline))]
+
+    def render_front_matter(self, outline):
+        """Render the title page and table of contents to PDF. Page numbers come from the
+            page counts recorded at render time; pages without one are counted now.
+            The front matter is rendered again if its own length changes the page numbers.
+
+            Args: outline (list[(str, int)]) - title and parent index for each page
+            Kwargs: None
+            Fields: pages, path, pdf_subdir, logger
+            Output: filename (str or None) - the rendered front matter, None if it could not be rendered
+            External State: front matter PDF exists in the pdf subdir
+        """
+        for record in self.pages:
+            if record.page_count is None:
+                record.page_count = self._count_pdf_pages(record.pdf_path or self.make_output_filename(record.url, 'pdf'))
+        import pdfkit
+        page_counts = [record.page_count or 0 for record in self.pages]
+        filename = os.path.join(self.path, self.pdf_subdir, DEFAULT_FRONT_MATTER)
+        offset = 2
+        for attempt in range(3):
+            try:
+                pdfkit.from_string(self._front_matter_html(outline, page_counts, offset), filename)
+            except OSError:
+                pass
+            front_pages = self._count_pdf_pages(filename)
+            if front_pages is None:
+                self.logger.basic("Could not render the table of contents")
+                return None
+            if front_pages == offset:
+                break
+            offset = front_pages
+        return filename
+
+    def stream_page(self, record):
+        """Append an exported page to the current output volume straight away, then flush
+            its record to the page journal, so memory does not grow with the number of
+            pages. The per-page PDF is deleted afterwards unless keep_pdfs is set.
+            The page is dropped from the url index and link depths (the page registry still
+            knows it was visited), and only the last index_cache_size hit buttons are kept.
+
+            Args: record (PageRecord) - the exported page
+            Kwargs: None
+            Fields: volumes, page_journal, pages, url_index, url_depths, hit_buttons, build_toc, keep_pdfs
+            Output: None
+            External State: page appended to the current volume, record in the page journal
+        """
+        import KryxPdf
+        if self.volumes is None:
+            self.volumes = KryxPdf.VolumeWriter(os.path.join(self.path, self.output_filename),
+                                                max_pages=self.volume_pages,
+                                                max_bytes=self.volume_bytes,
+                                                dedupe=self.optimize_pdf,
+                                                compress=self.optimize_pdf)
+            self.page_journal_path = os.path.join(self.path, DEFAULT_PAGE_JOURNAL)
+            self.page_journal = open(self.page_journal_path, 'w', encoding='utf-8')
+        if record.pdf_path is not None and os.path.exists(record.pdf_path):
+            title = self.page_title(record) if self.build_toc else None
+            volume = self.volumes.add_file(record.pdf_path, title=title)
+            self.logger.vvdebug("Appended page %d to volume %s" % (record.page_number, volume))
+            if not self.keep_pdfs:
+                os.remove(record.pdf_path)
+        self.pages.flush(record, self.page_journal)
+        self.url_index.discard(record.url)
+        self.url_depths.pop(record.url, None)
+        if len(self.hit_buttons) > self.index_cache_size:
+            del self.hit_buttons[:len(self.hit_buttons) - self.index_cache_size]
+
+    def _close_stream(self):
+        """Finish the last output volume and the page journal of a streaming export.
+            Args: None
+            Kwargs: None
+            Fields: volumes, page_journal, logger
+            Output: None
+            External State: all volumes are complete PDFs
+        """
+        if self.volumes is None:
+            self.logger.basic("No pages were streamed, no volumes written")
+            return
+        self.volumes.close()
+        self.page_journal.close()
+        self.logger.basic("Wrote %d volume(s): %s" % (len(self.volumes.volumes), ', '.join(self.volumes.volumes)))
+        self.volumes = None
+        self.page_journal = None
 
     def export_final_pdf(self):
-        """Export the final compiled PDF.
+        """Export the final compiled PDF. If build_toc is set, a title page and table of
+            contents are put in front of the pages, and every page gets a bookmark, all
+            built from the page registry without opening the per-page PDFs again.
+            Links between pages of the site are rewritten to point inside the PDF, using the
+            link graph of the page registry.
+            In streaming mode the pages are already in the output volumes, which are just finished.
+
             Args: None
             Kwargs: None
-            Fields: logger, output_filename
+            Fields: logger, output_filename, pages, build_toc, streaming
             Output: None
             External State: logger exists, pdf subdir is removed, final pdf is created
         """
         self.logger.basic("Exporting pdf...")
-        pdfs = [self.make_output_filename(url, 'pdf') for url in self.history]
+        if self.streaming:
+            self._close_stream()
+            self.save_page_manifest()
+            self._export_cleanup()
+            return
+        if 'pdf' not in self.formats:
+            self.save_page_manifest()
+            return
+        pdfs = [None if page.duplicate_of is not None else page.pdf_path or self.make_output_filename(page.url, 'pdf')
+                for page in self.pages]
         self.logger.verbose(("Found %d pages..." % len(pdfs)))
+        aliases = self._duplicate_aliases()
+        names, links = self.link_destinations()
+        outline = None
+        if self.build_toc:
+            outline = self.build_outline()
+            front_matter = self.render_front_matter(outline)
+            if front_matter is not None:
+                pdfs = [front_matter] + pdfs
+                outline = [("Contents", None)] + [(title, None if parent is None else parent + 1)
+                                                  for title, parent in outline]
+                aliases = {index + 1: original + 1 for index, original in aliases.items()}
+                names = [None] + names
+                links = [None] + links
+            self.save_page_manifest()
         output_path = os.path.join(self.path, self.output_filename)
         self.logger.verbose("Outputting to path %s..." % output_path)
         start = timeit.default_timer()
-        self.pdf_cat(pdfs, open(output_path, 'wb'))
+        with open(output_path, 'wb') as output_stream:
+            self.pdf_cat(pdfs, output_stream, outline=outline, aliases=aliases, names=names, links=links)
         self.logger.vvdebug("Took %f seconds to compiled PDF" % (timeit.default_timer()-start))
         self._export_cleanup()
 
+    def _duplicate_aliases(self):
+        """Map each near-duplicate page to the page it duplicates, in collapse mode, so its
+            bookmark points at the original.
+            Args: None
+            Kwargs: None
+            Fields: pages, near_duplicates
+            Output: aliases (dict[int, int]) - index of the original page for each duplicate page index
+            External State: No change
+        """
+        if self.near_duplicates != 'collapse':
+            return dict()
+        positions = {record.url: index for index, record in enumerate(self.pages)}
+        return {index: positions[record.duplicate_of] for index, record in enumerate(self.pages)
+                if record.duplicate_of in positions}
+
     def _export_cleanup(self):
         """cleanup function for exporting
             Args: None
@@ -756,14 +1847,8 @@ class KryxEtractor:
             Output: None
             External State: Webdriver shutdown
         """
-        try:
-            self.selenium_driver.close()
-        except selenium.common.exceptions.WebDriverException:
-            pass
-        try:
-            self.selenium_driver.quit()
-        except selenium.common.exceptions.WebDriverException:
-            pass
+        self.driver_manager.quit()
+        self.selenium_driver = None
 
     def cleanup(self):
         """Do all cleanup operations
@@ -771,17 +1856,41 @@ class KryxEtractor:
             Kwargs: None
             Fields: None
             Output: None
-            External State: html and pdf subdir are removed, webdriver is shut down
+            External State: html and pdf subdir are removed, webdriver and clean pool are shut down,
+                            memory tracing of the profiler stopped
         """
+        self.finish_pages(wait=True)
         self._crawl_cleanup()
         self._export_cleanup()
         self._webdriver_cleanup()
+        self.profiler.stop()
 
     def run(self):
-        self.crawl()
-        self.export_final_pdf()
+        if self.replay:
+            self.replay_from_cache()
+        else:
+            self.crawl()
+        with self.profiler.stage(None, 'final_pdf'):
+            self.export_final_pdf()
+        with self.profiler.stage(None, 'books'):
+            self.export_books()
+        self.write_profile_report()
         self.cleanup()
 
+    def write_profile_report(self):
+        """Write the profiling report of the run to the export path, if profiling is on.
+            Args: None
+            Kwargs: None
+            Fields: profiler, profile_report, path, logger
+            Output: None
+            External State: profiling report exists in path
+        """
+        if not self.profile:
+            return
+        filename = os.path.join(self.path, self.profile_report)
+        self.profiler.write_report(filename)
+        self.logger.basic("Wrote profiling report to %s" % filename)
+
 
 if __name__ == '__main__':
     extractor = KryxEtractor()
@@ -0,0 +1,276 @@
+"""
+KryxPages - Registry of exported pages for the KryxExtractor crawler
+
+Every page the crawler visits gets one PageRecord, numbered in crawl order. The registry
+indexes records by canonical URL, so looking up a page's number or output files is a
+dict lookup rather than a search through the crawl history, and it is saved as a JSON
+manifest next to the exported pages so later stages (and later runs) can reuse it.
+
+The registry also keeps the link graph of the site: each record lists the page numbers of
+the pages it links to. Links are recorded by url while crawling, since their targets may not
+be registered yet, and resolved to page numbers whenever the registry is saved.
+"""
+import sys
+import json
+import heapq
+
+PAGE_FIELDS = ('page_number', 'url', 'html_path', 'pdf_path', 'content_hash', 'page_count', 'headings', 'timings', 'duplicate_of', 'links')
+
+
+class PageRecord:
+    """PageRecord
+            Everything known about a single exported page.
+
+            Args:
+                page_number (int)   -   position of the page in crawl order
+                url (str)           -   canonical url of the page
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | html_path           |   str                 |   Path of the exported HTML file |
+                | pdf_path            |   str                 |   Path of the exported PDF file |
+                | content_hash        |   str                 |   SHA-1 hex digest of the cleaned HTML |
+                | page_count          |   int                 |   Number of pages in the exported PDF |
+                | headings            |   list[[int, str]]    |   Level and text of the page's h1-h3 headings |
+                | timings             |   dict[str:float]     |   Seconds spent in each export stage |
+                | duplicate_of        |   str                 |   Url of the page this page is a near-duplicate of |
+                | links               |   list[int]           |   Page numbers of the pages this page links to |
+    """
+    __slots__ = PAGE_FIELDS
+
+    def __init__(self,
+                 page_number,
+                 url,
+                 html_path=None,
+                 pdf_path=None,
+                 content_hash=None,
+                 page_count=None,
+                 headings=None,
+                 timings=None,
+                 duplicate_of=None,
+                 links=None,
+                 ):
+        self.page_number = page_number
+        self.url = url
+        self.html_path = html_path
+        self.pdf_path = pdf_path
+        self.content_hash = content_hash
+        self.page_count = page_count
+        self.headings = headings
+        if self.headings is None:
+            self.headings = []
+        self.timings = timings
+        if self.timings is None:
+            self.timings = dict()
+        self.duplicate_of = duplicate_of
+        self.links = links
+        if self.links is None:
+            self.links = []
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in PAGE_FIELDS}
+
+    @classmethod
+    def from_dict(cls, record):
+        return cls(**{field: record.get(field) for field in PAGE_FIELDS})
+
+    def __repr__(self):
+        return "PageRecord(%d, %r)" % (self.page_number, self.url)
+
+
+class PageRegistry:
+    """PageRegistry
+            Ordered collection of PageRecords, indexed by canonical url.
+            The urls list is the crawl history, in page order.
+
+            Records flushed to a page journal (streaming mode) are dropped from memory with
+            their links, so only the url and page number of a flushed page are kept. Saving
+            the registry with its journal merges the flushed records back into the manifest.
+
+            Args:
+                None
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | urls                |   list[str]           |   Urls to register, in page order |
+    """
+
+    def __init__(self, urls=None):
+        self.urls = []
+        self._numbers = dict()
+        self._records = dict()
+        self._link_urls = dict()
+        for url in urls or []:
+            self.add(url)
+
+    @property
+    def records(self):
+        """Records held in memory, in page order."""
+        return [self._records[number] for number in sorted(self._records)]
+
+    def add(self, url):
+        """Register a page, or return its record if it is already registered. A page which
+            was flushed gets a new, empty record under its page number.
+            Args: url (str) - canonical url of the page
+            Kwargs: None
+            Output: record (PageRecord) - the record of the page
+            External State: page is registered with the next page number
+        """
+        number = self._numbers.get(url)
+        if number is None:
+            url = sys.intern(url)
+            number = len(self.urls)
+            self.urls.append(url)
+            self._numbers[url] = number
+        record = self._records.get(number)
+        if record is None:
+            record = self._records[number] = PageRecord(number, url)
+        return record
+
+    def get(self, url, default=None):
+        number = self._numbers.get(url)
+        if number is None:
+            return default
+        return self._records.get(number, default)
+
+    def number(self, url, default=None):
+        """Page number of a registered page, flushed or not."""
+        return self._numbers.get(url, default)
+
+    def __getitem__(self, url):
+        record = self.get(url)
+        if record is None:
+            raise KeyError(url)
+        return record
+
+    def __contains__(self, url):
+        return url in self._numbers
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.urls)
+
+    def set_links(self, url, targets):
+        """Record the pages a page links to. Targets are resolved to page numbers when the
+            registry is saved, since they may not be registered yet.
+            Args: url (str) - canonical url of the page
+                  targets (list[str]) - canonical urls of the pages it links to
+            Kwargs: None
+            Output: None
+            External State: No change
+        """
+        self._link_urls[url] = [sys.intern(target) for target in targets]
+
+    def _resolve(self, number, targets):
+        links = []
+        for target in targets:
+            target_number = self._numbers.get(target)
+            if target_number is not None and target_number != number and target_number not in links:
+                links.append(target_number)
+        return links
+
+    def resolve_links(self):
+        """Resolve the recorded links of every page held in memory to the page numbers of
+            registered pages. Links to pages which were not exported, and to the page itself, are dropped.
+            Args: None
+            Kwargs: None
+            Output: None
+            External State: No change
+        """
+        for url, targets in self._link_urls.items():
+            record = self.get(url)
+            if record is not None:
+                record.links = self._resolve(record.page_number, targets)
+
+    def reachable(self, page_numbers, max_depth=None):
+        """Pages reachable from some pages by following links, e.g. to rebuild one section.
+            Only links of pages held in memory are followed.
+            Args: page_numbers (list[int]) - the pages to start from
+            Kwargs: max_depth (int) - maximum number of links to follow, no limit if None
+            Output: page_numbers (list[int]) - the starting and reachable pages, in page order
+            External State: No change
+        """
+        self.resolve_links()
+        seen = set(page_numbers)
+        frontier = list(seen)
+        depth = 0
+        while len(frontier) > 0 and (max_depth is None or depth < max_depth):
+            frontier = [target for number in frontier if number in self._records
+                        for target in self._records[number].links if target not in seen]
+            seen.update(frontier)
+            depth += 1
+        return sorted(seen)
+
+    def flush(self, record, journal):
+        """Write a record, with the urls it links to, out to a JSON lines journal and drop
+            both from memory, so a long crawl only keeps the url and page number of each page.
+            Args: record (PageRecord) - the record to flush
+                  journal (python file stream) - text stream of the journal
+            Kwargs: None
+            Output: None
+            External State: record appended to the journal
+        """
+        entry = record.to_dict()
+        entry['link_urls'] = self._link_urls.pop(record.url, [])
+        journal.write(json.dumps(entry) + '\n')
+        journal.flush()
+        if self._records.get(record.page_number) is record:
+            del self._records[record.page_number]
+
+    def _journal_entries(self, journal):
+        """Flushed records of a journal, in journal order, with their links resolved.
+            Pages which got a new record after they were flushed are skipped.
+            Args: journal (str) - path of the journal
+            Kwargs: None
+            Output: entries (generator[dict]) - the records, as saved in the manifest
+            External State: No change
+        """
+        with open(journal, 'r', encoding='utf-8') as file:
+            for line in file:
+                entry = json.loads(line)
+                if entry['page_number'] in self._records:
+                    continue
+                entry['links'] = self._resolve(entry['page_number'], entry.pop('link_urls', []))
+                yield entry
+
+    def save(self, filename, journal=None):
+        """Save the registry, with its resolved link graph, as a JSON manifest.
+            Args: filename (str) - the file to save to
+            Kwargs: journal (str) - path of the journal records were flushed to, whose records
+                                    are streamed into the manifest (in page order) with the ones in memory
+            Output: None
+            External State: manifest file exists at filename
+        """
+        self.resolve_links()
+        if journal is None:
+            with open(filename, 'w', encoding='utf-8') as file:
+                json.dump([record.to_dict() for record in self.records], file, indent=2)
+            return
+        entries = heapq.merge(self._journal_entries(journal), (record.to_dict() for record in self.records),
+                              key=lambda entry: entry['page_number'])
+        with open(filename, 'w', encoding='utf-8') as file:
+            file.write('[')
+            for n, entry in enumerate(entries):
+                file.write(',\n  ' if n > 0 else '\n  ')
+                file.write(json.dumps(entry))
+            file.write('\n]')
+
+    @classmethod
+    def load(cls, filename):
+        """Load a registry from a JSON manifest.
+            Args: filename (str) - the manifest to load
+            Kwargs: None
+            Output: registry (PageRegistry) - the loaded registry
+            External State: No change
+        """
+        registry = cls()
+        with open(filename, 'r', encoding='utf-8') as file:
+            for entry in json.load(file):
+                record = PageRecord.from_dict(entry)
+                record.page_number = len(registry.urls)
+                registry.urls.append(record.url)
+                registry._numbers[record.url] = record.page_number
+                registry._records[record.page_number] = record
+        return registry
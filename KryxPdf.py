@@ -0,0 +1,481 @@
+"""
+KryxPdf - Streaming, deduplicating PDF merge for the compiled output
+
+PyPDF2's PdfFileWriter keeps every page of every input open until the whole book is
+written, and copies the fonts and images of each per-page PDF separately even when they
+are byte-for-byte identical. StreamingPdfWriter instead copies each input's pages straight
+to the output stream as they are added, so only the object offsets and a digest of every
+shared resource stay in memory. Identical streams (images, font files) and font
+dictionaries are written once and shared by every page which uses them, and uncompressed
+content streams are Flate-compressed on the way through. Bookmarks only need the output
+reference of the page they point to, so the outline is written in the same pass.
+
+Links between pages of the site are rewritten as pages are copied: a link annotation whose
+URI is a page in the book becomes a GoTo action to that page's named destination. Named
+destinations are only resolved by the viewer, so a link can be written before the page it
+points at, and the name tree is written when the output is closed.
+"""
+import os
+import hashlib
+from PyPDF2 import PdfFileReader
+from PyPDF2.filters import FlateDecode
+from PyPDF2.generic import (ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject,
+                            StreamObject, DecodedStreamObject, EncodedStreamObject, createStringObject)
+
+PDF_HEADER = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+SHARED_DICT_TYPES = ('/Font', '/FontDescriptor', '/ExtGState')     # Dictionaries deduplicated across inputs
+SKIPPED_PAGE_KEYS = ('/Parent',)                                    # Page entries which are replaced, not copied
+
+
+def rewrite_links(page, resolve):
+    """Turn the URI links of a page which point into the book into links to named destinations.
+        Args: page (PageObject) - the page, whose annotations are changed in place
+              resolve (function) - takes a URI, returns the name of its destination or None
+        Kwargs: None
+        Output: count (int) - number of rewritten links
+        External State: No change
+    """
+    count = 0
+    annotations = page.get('/Annots')
+    if annotations is None:
+        return count
+    for annotation in annotations.getObject():
+        annotation = annotation.getObject()
+        action = annotation.get('/A')
+        if annotation.get('/Subtype') != '/Link' or action is None:
+            continue
+        action = action.getObject()
+        if action.get('/S') != '/URI':
+            continue
+        name = resolve(str(action.get('/URI')))
+        if name is None:
+            continue
+        goto = DictionaryObject()
+        goto[NameObject('/S')] = NameObject('/GoTo')
+        goto[NameObject('/D')] = createStringObject(name)
+        annotation[NameObject('/A')] = goto
+        count += 1
+    return count
+
+
+class OutlineItem:
+    """A bookmark of the output PDF, pointing at the top of one page."""
+    __slots__ = ('title', 'page_ref', 'children')
+
+    def __init__(self, title, page_ref):
+        self.title = title
+        self.page_ref = page_ref
+        self.children = []
+
+
+class StreamingPdfWriter:
+    """StreamingPdfWriter
+            Writes a PDF incrementally, page by page, to an output stream.
+
+            Args:
+                output_stream (python file stream)  -   binary stream to write the PDF to
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | dedupe              |   bool                |   Share identical streams and font dictionaries between inputs |
+                | compress            |   bool                |   Flate-compress uncompressed streams |
+    """
+
+    def __init__(self,
+                 output_stream,
+                 dedupe=True,
+                 compress=True,
+                 ):
+        self.output_stream = output_stream
+        self.dedupe = dedupe
+        self.compress = compress
+        self.offsets = []
+        self.page_refs = []
+        self.shared = dict()
+        self.catalog = DictionaryObject()
+        self.outline = []
+        self.destinations = dict()
+        self.deduplicated = 0
+        self.links = 0
+        self.output_stream.write(PDF_HEADER)
+        self.pages_ref = self._reserve()
+
+    def _reserve(self):
+        """Reserve an object number in the output.
+            Args: None
+            Kwargs: None
+            Output: ref (IndirectObject) - reference to the reserved object
+            External State: No change
+        """
+        self.offsets.append(None)
+        return IndirectObject(len(self.offsets), 0, self)
+
+    def write_object(self, ref, obj):
+        """Write an object to the output under a reserved object number.
+            Args: ref (IndirectObject) - the reserved reference
+                  obj (PdfObject) - the object, which may only reference output object numbers
+            Kwargs: None
+            Output: None
+            External State: object written to the output stream
+        """
+        self.offsets[ref.idnum - 1] = self.output_stream.tell()
+        self.output_stream.write(b'%d 0 obj\n' % ref.idnum)
+        obj.writeToStream(self.output_stream, None)
+        self.output_stream.write(b'\nendobj\n')
+
+    def add_object(self, obj):
+        """Write a new object to the output.
+            Args: obj (PdfObject) - the object, which may only reference output object numbers
+            Kwargs: None
+            Output: ref (IndirectObject) - reference to the written object
+            External State: object written to the output stream
+        """
+        ref = self._reserve()
+        self.write_object(ref, obj)
+        return ref
+
+    def _digest(self, obj, reader, memo, depth=0):
+        """Digest an object and everything it references, so that identical resources
+            in different input files compare equal.
+
+            Args: obj (PdfObject) - the object to digest
+                  reader (PdfFileReader) - the reader the object belongs to
+                  memo (dict) - digests of the reader's indirect objects computed so far
+            Kwargs: depth (int) - recursion depth, used to stop on reference cycles
+            Output: digest (bytes) - sha1 digest of the object
+            External State: No change
+        """
+        if isinstance(obj, IndirectObject):
+            key = (obj.idnum, obj.generation)
+            if key not in memo:
+                memo[key] = b'cycle'
+                memo[key] = self._digest(obj.getObject(), reader, memo, depth + 1)
+            return memo[key]
+        digest = hashlib.sha1(type(obj).__name__.encode('utf-8'))
+        if depth > 32:
+            digest.update(repr(obj).encode('utf-8'))
+        elif isinstance(obj, DictionaryObject):
+            for key in sorted(obj.keys()):
+                if key == '/Length':
+                    continue
+                digest.update(key.encode('utf-8'))
+                digest.update(self._digest(obj.raw_get(key), reader, memo, depth + 1))
+            if isinstance(obj, StreamObject):
+                digest.update(obj._data)
+        elif isinstance(obj, ArrayObject):
+            for item in obj:
+                digest.update(self._digest(item, reader, memo, depth + 1))
+        else:
+            digest.update(repr(obj).encode('utf-8'))
+        return digest.digest()
+
+    def _is_shared(self, obj):
+        if isinstance(obj, StreamObject):
+            return True
+        return isinstance(obj, DictionaryObject) and obj.get('/Type') in SHARED_DICT_TYPES
+
+    def _copy(self, obj, reader, mapping, memo):
+        """Copy an object from a reader, writing every indirect object it references to the
+            output (once), and returning the object with references renumbered.
+
+            Args: obj (PdfObject) - the object to copy
+                  reader (PdfFileReader) - the reader the object belongs to
+                  mapping (dict) - output references of the reader's indirect objects
+                  memo (dict) - digests of the reader's indirect objects
+            Kwargs: None
+            Output: obj (PdfObject) - the copied object
+            External State: referenced objects written to the output stream
+        """
+        if isinstance(obj, IndirectObject):
+            key = (obj.idnum, obj.generation)
+            if key in mapping:
+                return mapping[key]
+            target = obj.getObject()
+            digest = None
+            if self.dedupe and self._is_shared(target):
+                digest = self._digest(obj, reader, memo)
+                if digest in self.shared:
+                    self.deduplicated += 1
+                    mapping[key] = self.shared[digest]
+                    return mapping[key]
+            ref = self._reserve()
+            mapping[key] = ref
+            if digest is not None:
+                self.shared[digest] = ref
+            self.write_object(ref, self._copy(target, reader, mapping, memo))
+            return ref
+        if isinstance(obj, StreamObject):
+            copy = obj.__class__()
+            copy._data = obj._data
+            if self.compress and isinstance(obj, DecodedStreamObject) and '/Filter' not in obj:
+                copy = EncodedStreamObject()
+                copy._data = FlateDecode.encode(obj._data)
+                copy[NameObject('/Filter')] = NameObject('/FlateDecode')
+            for key in obj.keys():
+                if key != '/Length':
+                    copy[key] = self._copy(obj.raw_get(key), reader, mapping, memo)
+            return copy
+        if isinstance(obj, DictionaryObject):
+            copy = DictionaryObject()
+            for key in obj.keys():
+                copy[key] = self._copy(obj.raw_get(key), reader, mapping, memo)
+            return copy
+        if isinstance(obj, ArrayObject):
+            return ArrayObject([self._copy(item, reader, mapping, memo) for item in obj])
+        return obj
+
+    def add_reader(self, reader, links=None):
+        """Copy every page of a reader to the output.
+            Args: reader (PdfFileReader) - the reader to copy pages from
+            Kwargs: links (function) - takes a link URI, returns the name of its destination in the book or None
+            Output: refs (list[IndirectObject]) - output references of the copied pages
+            External State: pages and their resources written to the output stream
+        """
+        mapping = dict()
+        memo = dict()
+        pages = [reader.getPage(n) for n in range(reader.getNumPages())]
+        if links is not None:
+            for page in pages:
+                self.links += rewrite_links(page, links)
+        refs = []
+        for page in pages:
+            ref = self._reserve()
+            mapping[(page.indirectRef.idnum, page.indirectRef.generation)] = ref
+            refs.append(ref)
+        for page, ref in zip(pages, refs):
+            copy = DictionaryObject()
+            for key in page.keys():
+                if key not in SKIPPED_PAGE_KEYS:
+                    copy[key] = self._copy(page.raw_get(key), reader, mapping, memo)
+            copy[NameObject('/Parent')] = self.pages_ref
+            self.write_object(ref, copy)
+        self.page_refs += refs
+        return refs
+
+    def add_file(self, input_file, links=None):
+        """Copy every page of a PDF file to the output, closing the file afterwards.
+            Args: input_file (str) - path of the PDF to copy
+            Kwargs: links (function) - takes a link URI, returns the name of its destination in the book or None
+            Output: refs (list[IndirectObject]) - output references of the copied pages
+            External State: pages and their resources written to the output stream
+        """
+        with open(input_file, 'rb') as stream:
+            return self.add_reader(PdfFileReader(stream, strict=False), links=links)
+
+    def add_named_destination(self, name, page_ref):
+        """Name the top of a page, so links can point at it.
+            Args: name (str) - name of the destination
+                  page_ref (IndirectObject) - output reference of the page
+            Kwargs: None
+            Output: None
+            External State: No change until the writer is closed
+        """
+        self.destinations[name] = page_ref
+
+    def _write_names(self):
+        """Write the name tree of the named destinations, and link it from the catalog.
+            Args: None
+            Kwargs: None
+            Output: None
+            External State: name tree written to the output stream if there are named destinations
+        """
+        if len(self.destinations) == 0:
+            return
+        names = ArrayObject()
+        for name in sorted(self.destinations):
+            names.append(createStringObject(name))
+            names.append(ArrayObject([self.destinations[name], NameObject('/Fit')]))
+        tree = DictionaryObject()
+        tree[NameObject('/Names')] = names
+        dests = DictionaryObject()
+        dests[NameObject('/Dests')] = self.add_object(tree)
+        self.catalog[NameObject('/Names')] = dests
+
+    def add_bookmark(self, title, page_ref, parent=None):
+        """Add a bookmark to the outline.
+            Args: title (str) - title of the bookmark
+                  page_ref (IndirectObject) - output reference of the page to point at
+            Kwargs: parent (OutlineItem) - bookmark to nest this one under, top level if None
+            Output: item (OutlineItem) - the new bookmark
+            External State: No change until the writer is closed
+        """
+        item = OutlineItem(title, page_ref)
+        if parent is None:
+            self.outline.append(item)
+        else:
+            parent.children.append(item)
+        return item
+
+    def _write_outline_items(self, items, parent_ref):
+        """Write one level of the outline, and all levels below it.
+            Args: items (list[OutlineItem]) - the bookmarks of this level
+                  parent_ref (IndirectObject) - output reference of the parent bookmark or outline root
+            Kwargs: None
+            Output: refs (list[IndirectObject]) - output references of the bookmarks
+                    count (int) - number of bookmarks at and below this level
+            External State: bookmarks written to the output stream
+        """
+        refs = [self._reserve() for item in items]
+        count = len(items)
+        for i, (item, ref) in enumerate(zip(items, refs)):
+            entry = DictionaryObject()
+            entry[NameObject('/Title')] = createStringObject(item.title)
+            entry[NameObject('/Parent')] = parent_ref
+            entry[NameObject('/Dest')] = ArrayObject([item.page_ref, NameObject('/Fit')])
+            if i > 0:
+                entry[NameObject('/Prev')] = refs[i - 1]
+            if i < len(items) - 1:
+                entry[NameObject('/Next')] = refs[i + 1]
+            if len(item.children) > 0:
+                child_refs, child_count = self._write_outline_items(item.children, ref)
+                entry[NameObject('/First')] = child_refs[0]
+                entry[NameObject('/Last')] = child_refs[-1]
+                entry[NameObject('/Count')] = NumberObject(child_count)
+                count += child_count
+            self.write_object(ref, entry)
+        return refs, count
+
+    def _write_outline(self):
+        """Write the outline root and all bookmarks, and link them from the catalog.
+            Args: None
+            Kwargs: None
+            Output: None
+            External State: outline written to the output stream if there are bookmarks
+        """
+        if len(self.outline) == 0:
+            return
+        root_ref = self._reserve()
+        refs, count = self._write_outline_items(self.outline, root_ref)
+        root = DictionaryObject()
+        root[NameObject('/Type')] = NameObject('/Outlines')
+        root[NameObject('/First')] = refs[0]
+        root[NameObject('/Last')] = refs[-1]
+        root[NameObject('/Count')] = NumberObject(count)
+        self.write_object(root_ref, root)
+        self.catalog[NameObject('/Outlines')] = root_ref
+        self.catalog[NameObject('/PageMode')] = NameObject('/UseOutlines')
+
+    def close(self):
+        """Write the page tree, outline, named destinations, catalog, cross reference table and trailer.
+            Args: None
+            Kwargs: None
+            Output: None
+            External State: output stream holds a complete PDF
+        """
+        pages = DictionaryObject()
+        pages[NameObject('/Type')] = NameObject('/Pages')
+        pages[NameObject('/Kids')] = ArrayObject(self.page_refs)
+        pages[NameObject('/Count')] = NumberObject(len(self.page_refs))
+        self.write_object(self.pages_ref, pages)
+        self._write_outline()
+        self._write_names()
+        self.catalog[NameObject('/Type')] = NameObject('/Catalog')
+        self.catalog[NameObject('/Pages')] = self.pages_ref
+        root_ref = self.add_object(self.catalog)
+        xref_offset = self.output_stream.tell()
+        self.output_stream.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(self.offsets) + 1))
+        for offset in self.offsets:
+            self.output_stream.write(b'%010d 00000 n \n' % offset)
+        trailer = DictionaryObject()
+        trailer[NameObject('/Size')] = NumberObject(len(self.offsets) + 1)
+        trailer[NameObject('/Root')] = root_ref
+        self.output_stream.write(b'trailer\n')
+        trailer.writeToStream(self.output_stream, None)
+        self.output_stream.write(b'\nstartxref\n%d\n%%%%EOF\n' % xref_offset)
+
+
+class VolumeWriter:
+    """VolumeWriter
+            Streams pages into a series of PDF volumes, starting a new volume whenever the
+            current one would exceed its page or byte budget. The byte budget is checked
+            against the size of the input files, an upper bound of what they add to the
+            volume once shared resources are deduplicated. Each input gets a bookmark.
+            Without budgets everything goes into a single file named filename.
+
+            Args:
+                filename (str)      -   path of the output, "_vol<n>" is added before the extension of each volume
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | max_pages           |   int                 |   Maximum number of PDF pages per volume |
+                | max_bytes           |   int                 |   Maximum size in bytes of the inputs of a volume |
+                | dedupe              |   bool                |   Share identical streams and font dictionaries between inputs |
+                | compress            |   bool                |   Flate-compress uncompressed streams |
+    """
+
+    def __init__(self,
+                 filename,
+                 max_pages=None,
+                 max_bytes=None,
+                 dedupe=True,
+                 compress=True,
+                 ):
+        self.filename = filename
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.dedupe = dedupe
+        self.compress = compress
+        self.volumes = []
+        self.writer = None
+        self.output_stream = None
+        self.volume_pages = 0
+        self.volume_bytes = 0
+
+    def volume_filename(self, index):
+        if self.max_pages is None and self.max_bytes is None:
+            return self.filename
+        root, ext = os.path.splitext(self.filename)
+        return "%s_vol%d%s" % (root, index, ext)
+
+    def _full(self, page_count, size):
+        if self.writer is None:
+            return True
+        if self.volume_pages == 0:
+            return False
+        if self.max_pages is not None and self.volume_pages + page_count > self.max_pages:
+            return True
+        return self.max_bytes is not None and self.volume_bytes + size > self.max_bytes
+
+    def _start_volume(self):
+        self.close()
+        filename = self.volume_filename(len(self.volumes) + 1)
+        self.output_stream = open(filename, 'wb')
+        self.writer = StreamingPdfWriter(self.output_stream, dedupe=self.dedupe, compress=self.compress)
+        self.volumes.append(filename)
+        self.volume_pages = 0
+        self.volume_bytes = 0
+
+    def add_file(self, input_file, title=None):
+        """Append every page of a PDF file to the current volume, starting a new volume
+            first if the file does not fit in the current one.
+            Args: input_file (str) - path of the PDF to append
+            Kwargs: title (str) - title of the bookmark pointing at the file's first page, none if None
+            Output: volume (str) - path of the volume the file was added to
+            External State: pages written to the volume
+        """
+        size = os.path.getsize(input_file)
+        with open(input_file, 'rb') as stream:
+            reader = PdfFileReader(stream, strict=False)
+            page_count = reader.getNumPages()
+            if self._full(page_count, size):
+                self._start_volume()
+            refs = self.writer.add_reader(reader)
+        if title is not None and len(refs) > 0:
+            self.writer.add_bookmark(title, refs[0])
+        self.volume_pages += page_count
+        self.volume_bytes += size
+        return self.volumes[-1]
+
+    def close(self):
+        """Finish the current volume.
+            Args: None
+            Kwargs: None
+            Output: None
+            External State: current volume is a complete PDF
+        """
+        if self.writer is None:
+            return
+        self.writer.close()
+        self.output_stream.close()
+        self.writer = None
+        self.output_stream = None
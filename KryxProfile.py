@@ -0,0 +1,224 @@
+"""
+KryxProfile - Opt-in profiling of crawl stages, memory and browser timing
+
+A slow run can spend its time in Python (parsing and styling HTML), in geckodriver round
+trips, or waiting on the site itself. The profiler splits that up: each export stage
+(navigate, links, clean, write_html, write_pdf, ...) runs under its own cProfile profile
+and tracemalloc peak measurement, and after each navigation the browser's Navigation and
+Resource Timing entries are read back with execute_script. At the end of the run a
+report ranks the hottest functions (overall and per stage), the slowest pages and the
+slowest resources, and the raw per-page data is saved as JSON next to it.
+"""
+import io
+import json
+import time
+import pstats
+import cProfile
+import tracemalloc
+import contextlib
+
+DEFAULT_TOP = 25                            # Number of functions, pages and resources listed in the report
+BROWSER_TIMING_SCRIPT = """
+var navigation = performance.getEntriesByType('navigation');
+var resources = performance.getEntriesByType('resource');
+return JSON.stringify({
+    navigation: navigation.length > 0 ? navigation[0].toJSON() : performance.timing.toJSON(),
+    resources: resources.map(function (entry) {
+        return {name: entry.name, type: entry.initiatorType, duration: entry.duration,
+                size: entry.transferSize || 0};
+    })
+});
+"""
+NULL_STAGE = contextlib.nullcontext()
+
+
+def reset_peak():
+    """Restart the peak of traced memory at the current size. tracemalloc.reset_peak is new in
+        Python 3.9; before that, forgetting the traced blocks is the only way to restart the peak."""
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.clear_traces()
+
+
+class RunProfiler:
+    """RunProfiler
+            Collects CPU profiles, memory peaks and browser timings for one run.
+            When disabled, every hook is a no-op.
+
+            Args:
+                None
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | enabled             |   bool                |   Collect profiling data |
+                | trace_memory        |   bool                |   Measure the peak memory of each stage with tracemalloc |
+                | top                 |   int                 |   Number of functions, pages and resources listed in the report |
+    """
+
+    def __init__(self,
+                 enabled=False,
+                 trace_memory=True,
+                 top=DEFAULT_TOP,
+                 ):
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self.top = top
+        self.stage_profiles = dict()
+        self.pages = dict()
+        self.started = time.time()
+        self.tracing = False
+
+    def _page(self, url):
+        if url not in self.pages:
+            self.pages[url] = dict(stages=dict(), memory=dict(), browser=None)
+        return self.pages[url]
+
+    def stage(self, url, name):
+        """Profile one stage of the export of a page.
+            Args: url (str) - the page the stage works on (None for run-wide stages)
+                  name (str) - name of the stage
+            Kwargs: None
+            Output: context manager which profiles the code it wraps
+            External State: No change
+        """
+        if not self.enabled:
+            return NULL_STAGE
+        return self._profile_stage(url, name)
+
+    @contextlib.contextmanager
+    def _profile_stage(self, url, name):
+        profile = self.stage_profiles.get(name)
+        if profile is None:
+            profile = self.stage_profiles[name] = cProfile.Profile()
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.tracing = True
+            reset_peak()
+            memory_start = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            page = self._page(url)
+            page['stages'][name] = page['stages'].get(name, 0) + time.perf_counter() - start
+            if self.trace_memory:
+                page['memory'][name] = max(page['memory'].get(name, 0), tracemalloc.get_traced_memory()[1] - memory_start)
+
+    def stop(self):
+        """Stop tracing memory allocations, if the profiler started it. The data collected
+            so far is kept, so the report can still be written.
+            Args: None
+            Kwargs: None
+            Output: None
+            External State: tracemalloc stopped
+        """
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+
+    def capture_browser_timing(self, url, selenium_driver):
+        """Read the Navigation and Resource Timing entries of the page the browser is on.
+            Args: url (str) - the page the browser is on
+                  selenium_driver (Webdriver) - the browser
+            Kwargs: None
+            Output: None
+            External State: No change
+        """
+        if not self.enabled or selenium_driver is None:
+            return
+        try:
+            self._page(url)['browser'] = json.loads(selenium_driver.execute_script(BROWSER_TIMING_SCRIPT))
+        except Exception:
+            pass
+
+    def _stats(self, names=None):
+        profiles = [profile for name, profile in self.stage_profiles.items() if names is None or name in names]
+        profiles = [profile for profile in profiles if profile.getstats()]
+        if len(profiles) == 0:
+            return None
+        stream = io.StringIO()
+        stats = pstats.Stats(profiles[0], stream=stream)
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats, stream
+
+    def _format_functions(self, names=None):
+        result = self._stats(names)
+        if result is None:
+            return "  (no samples)\n"
+        stats, stream = result
+        stats.sort_stats('tottime').print_stats(self.top)
+        return stream.getvalue()
+
+    @staticmethod
+    def _browser_summary(browser):
+        navigation = browser['navigation']
+        origin = navigation.get('startTime', navigation.get('navigationStart', 0))
+        return dict(ttfb=navigation.get('responseStart', 0) - navigation.get('requestStart', 0),
+                    dom_ready=navigation.get('domContentLoadedEventEnd', 0) - origin,
+                    load=navigation.get('loadEventEnd', 0) - origin,
+                    resources=len(browser['resources']),
+                    bytes=sum(resource['size'] for resource in browser['resources']))
+
+    def report(self):
+        """Build the text report of the run.
+            Args: None
+            Kwargs: None
+            Output: report (str) - the report
+            External State: No change
+        """
+        lines = ["Profile of run started %s" % time.ctime(self.started), ""]
+        totals = dict()
+        for page in self.pages.values():
+            for name, seconds in page['stages'].items():
+                totals[name] = totals.get(name, 0) + seconds
+        lines.append("Time per stage (seconds)")
+        for name, seconds in sorted(totals.items(), key=lambda item: -item[1]):
+            peak = max((page['memory'].get(name, 0) for page in self.pages.values()), default=0)
+            lines.append("  %-16s %10.3f   peak memory %10.1f KiB" % (name, seconds, peak / 1024))
+        lines.append("")
+        lines.append("Slowest pages (seconds; browser ttfb/dom ready/load in ms)")
+        pages = sorted(((url, page) for url, page in self.pages.items() if url is not None),
+                       key=lambda item: -sum(item[1]['stages'].values()))
+        for url, page in pages[:self.top]:
+            stages = ' '.join("%s=%.2f" % item for item in sorted(page['stages'].items()))
+            line = "  %8.3f  %s  %s" % (sum(page['stages'].values()), url, stages)
+            if page['browser'] is not None:
+                line += "  [ttfb=%(ttfb).0f dom=%(dom_ready).0f load=%(load).0f resources=%(resources)d bytes=%(bytes)d]" \
+                        % self._browser_summary(page['browser'])
+            lines.append(line)
+        lines.append("")
+        resources = dict()
+        for page in self.pages.values():
+            for resource in (page['browser'] or dict(resources=[]))['resources']:
+                entry = resources.setdefault(resource['name'], [0, 0.0])
+                entry[0] += 1
+                entry[1] += resource['duration']
+        lines.append("Slowest resources (total ms, loads)")
+        for name, (count, duration) in sorted(resources.items(), key=lambda item: -item[1][1])[:self.top]:
+            lines.append("  %10.0f  %4d  %s" % (duration, count, name))
+        lines.append("")
+        lines.append("Hottest functions, all stages")
+        lines.append(self._format_functions())
+        for name in sorted(self.stage_profiles):
+            lines.append("Hottest functions, stage %s" % name)
+            lines.append(self._format_functions([name]))
+        return '\n'.join(lines)
+
+    def write_report(self, filename):
+        """Write the text report, and the raw per-page data as JSON next to it.
+            Args: filename (str) - the file to write the report to
+            Kwargs: None
+            Output: None
+            External State: report and "<filename>.json" exist
+        """
+        if not self.enabled:
+            return
+        with open(filename, 'w', encoding='utf-8') as file:
+            file.write(self.report())
+        with open(filename + '.json', 'w', encoding='utf-8') as file:
+            json.dump({str(url): page for url, page in self.pages.items()}, file, indent=2)
@@ -0,0 +1,129 @@
+"""
+KryxRoutes - Static route discovery from the site's client-side JavaScript bundle
+
+Kryx's site is a client-side React app, so every route it can render is written into
+its JavaScript chunks as a string literal. Rather than clicking through every menu to find
+pages, we fetch the app shell over plain HTTP, follow its script tags (and the lazily
+loaded chunks named in the webpack runtime), and pull out every literal that looks like
+a route under the start URL. Parameterized routes (e.g. "/5e/spells/:id") are skipped since
+they cannot be enumerated statically.
+"""
+import re
+import json
+import urllib.parse
+import urllib.request
+
+DEFAULT_TIMEOUT = 30                                        # Seconds to wait for each HTTP request
+DEFAULT_USER_AGENT = 'Mozilla/5.0 (KryxExtractor)'          # User agent for HTTP requests
+SCRIPT_SRC_REGEX = re.compile(r'<script[^>]+src=["\']([^"\']+\.js)["\']', re.IGNORECASE)
+CHUNK_MAP_REGEX = re.compile(r'"static/js/"\s*\+\s*(?:\([^)]*\)|\w+)\s*\+\s*"\."\s*\+\s*\{([^}]*)\}\s*\[\w+\]\s*\+\s*"\.chunk\.js"')
+CHUNK_ENTRY_REGEX = re.compile(r'(\w+)\s*:\s*"([0-9a-f]+)"')
+STRING_LITERAL_REGEX = re.compile(r'"(/[^"\s]*)"|\'(/[^\'\s]*)\'|`(/[^`\s$]*)`')
+ROUTE_SEGMENT_REGEX = re.compile(r'^[A-Za-z0-9_\-]+$')
+
+
+def fetch_text(url, timeout=DEFAULT_TIMEOUT):
+    """Fetch a url over plain HTTP and decode it as text.
+        Args: url (str) - the url to fetch
+        Kwargs: timeout (int,float) - seconds to wait for the response
+        Output: text (str) - the decoded response body
+        External State: No change
+    """
+    request = urllib.request.Request(url, headers={'User-Agent': DEFAULT_USER_AGENT})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        charset = response.headers.get_content_charset() or 'utf-8'
+        return response.read().decode(charset, errors='replace')
+
+
+def find_script_urls(html_source, base_url):
+    """Find the JavaScript files referenced by script tags in an HTML page.
+        Args: html_source (str) - the html of the app shell
+              base_url (str) - the url the html was fetched from
+        Kwargs: None
+        Output: urls (list[str]) - absolute urls of the scripts, in page order
+        External State: No change
+    """
+    urls = []
+    for src in SCRIPT_SRC_REGEX.findall(html_source):
+        url = urllib.parse.urljoin(base_url, src)
+        if url not in urls:
+            urls.append(url)
+    return urls
+
+
+def find_chunk_urls(js_source, base_url):
+    """Find lazily loaded chunks named in a webpack runtime, i.e. code of the form
+            "static/js/" + (names[id] || id) + "." + {0: "hash", ...}[id] + ".chunk.js"
+
+        Args: js_source (str) - javascript source which may contain the webpack runtime
+              base_url (str) - the url of the site root
+        Kwargs: None
+        Output: urls (list[str]) - absolute urls of the chunks
+        External State: No change
+    """
+    urls = []
+    for chunk_map in CHUNK_MAP_REGEX.findall(js_source):
+        for chunk_id, chunk_hash in CHUNK_ENTRY_REGEX.findall(chunk_map):
+            urls.append(urllib.parse.urljoin(base_url, '/static/js/%s.%s.chunk.js' % (chunk_id, chunk_hash)))
+    return urls
+
+
+def extract_routes(js_source, route_prefix):
+    """Extract route paths under a prefix from javascript string literals.
+        Args: js_source (str) - the javascript source
+              route_prefix (str) - path every route must start with, e.g. "/5e"
+        Kwargs: None
+        Output: routes (list[str]) - route paths, in order of first appearance
+        External State: No change
+    """
+    route_prefix = route_prefix.rstrip('/')
+    routes = []
+    for match in STRING_LITERAL_REGEX.finditer(js_source):
+        path = next(group for group in match.groups() if group is not None).rstrip('/')
+        if len(path) == 0:
+            continue
+        if path != route_prefix and not path.startswith(route_prefix + '/'):
+            continue
+        segments = path.split('/')[1:]
+        if not all(ROUTE_SEGMENT_REGEX.match(segment) for segment in segments):
+            continue
+        if path not in routes:
+            routes.append(path)
+    return routes
+
+
+def discover_routes(start_url, route_prefix=None, timeout=DEFAULT_TIMEOUT):
+    """Discover every static route of the app below the start url.
+        Args: start_url (str) - url of a page in the app, also used as the route prefix
+        Kwargs: route_prefix (str) - path every route must start with, defaults to the start url's path
+                timeout (int,float) - seconds to wait for each HTTP request
+        Output: routes (list[str]) - absolute urls of the routes, in bundle order
+        External State: No change
+    """
+    if route_prefix is None:
+        route_prefix = urllib.parse.urlsplit(start_url).path or '/'
+    html_source = fetch_text(start_url, timeout=timeout)
+    pending = find_script_urls(html_source, start_url)
+    fetched = []
+    routes = []
+    while len(pending) > 0:
+        script_url = pending.pop(0)
+        if script_url in fetched:
+            continue
+        fetched.append(script_url)
+        js_source = fetch_text(script_url, timeout=timeout)
+        pending += [url for url in find_chunk_urls(js_source, start_url) if url not in fetched]
+        routes += [route for route in extract_routes(js_source, route_prefix) if route not in routes]
+    return [urllib.parse.urljoin(start_url, route) for route in routes]
+
+
+def save_route_manifest(routes, filename):
+    """Save a list of routes as a JSON manifest.
+        Args: routes (list[str]) - the routes to save
+              filename (str) - the file to save to
+        Kwargs: None
+        Output: None
+        External State: manifest file exists at filename
+    """
+    with open(filename, 'w', encoding='utf-8') as file:
+        json.dump(routes, file, indent=2)
@@ -0,0 +1,377 @@
+"""
+KryxService - Long-running extractor service with a pool of warm browsers
+
+Every run of KryxExtractor pays for starting Firefox, turning off the metric system,
+downloading the CSS and probing styles before it exports a single page. The service does
+all of that once, keeps a pool of ready extractors (each with its own webdriver) sharing
+one page registry, CSS store and page cache, and answers requests over a local HTTP or
+Unix socket API. Workers browse in parallel, and take the service's lock whenever they
+change the shared state:
+
+    GET  /status            - version, pool size and number of registered pages
+    POST /export            - {"urls": [...]} re-export these URLs (in parallel across the pool)
+    POST /rebuild           - rebuild the compiled PDF from the exported pages
+    POST /spells            - refresh the spell table CSV
+    POST /shutdown          - stop the service and its browsers
+
+All responses are JSON. Point start_url, url_prefix and changelog_url at a local fixture
+site (and pass version) to run the service against it; with pool_size=0 no browser is
+started, and /export re-renders pages from the page source cache instead.
+
+    python KryxService.py --port 8050 --pool-size 2
+"""
+import os
+import sys
+import json
+import queue
+import socket
+import timeit
+import argparse
+import threading
+import traceback
+import socketserver
+import http.server
+import concurrent.futures
+import KryxExtractor
+
+DEFAULT_HOST = '127.0.0.1'                  # Interface to serve the API on
+DEFAULT_PORT = 8050                         # Port to serve the API on
+DEFAULT_SOCKET_PATH = None                  # Unix socket to serve the API on instead of host/port
+DEFAULT_POOL_SIZE = 2                       # Number of warm extractors (and browsers) to keep
+
+
+class KryxService:
+    """KryxService
+            Keeps warm, pre-configured extractors and serves export requests from them.
+
+            Args:
+                None
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | pool_size           |   int                 |   Number of warm extractors (and browsers) to keep |
+                | host                |   str                 |   Interface to serve the API on |
+                | port                |   int                 |   Port to serve the API on |
+                | socket_path         |   str                 |   Unix socket to serve the API on instead of host/port |
+                | extractor_kwargs    |   dict                |   Keyword arguments for every KryxEtractor in the pool |
+                | spell_kwargs        |   dict                |   Keyword arguments for the KryxSpellExtractor |
+    """
+
+    def __init__(self,
+                 pool_size=DEFAULT_POOL_SIZE,
+                 host=DEFAULT_HOST,
+                 port=DEFAULT_PORT,
+                 socket_path=DEFAULT_SOCKET_PATH,
+                 extractor_kwargs=None,
+                 spell_kwargs=None,
+                 ):
+        self.pool_size = pool_size
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        self.extractor_kwargs = dict(extractor_kwargs or dict())
+        self.spell_kwargs = dict(spell_kwargs or dict())
+        self.lock = threading.RLock()
+        self.pool = queue.Queue()
+        self.workers = []
+        self.spell_extractor = None
+        self.server = None
+        self.primary = self._init_primary()
+        self.logger = self.primary.logger
+        for n in range(self.pool_size):
+            self._add_worker()
+
+    def _init_primary(self):
+        """Create the browserless extractor which owns the shared state: the page
+            registry (loaded from the page manifest if there is one), the stored CSS
+            (loaded from the page cache) and the html store.
+
+            Args: None
+            Kwargs: None
+            Output: extractor (KryxEtractor) - the primary extractor
+            External State: No change
+        """
+        kwargs = dict(self.extractor_kwargs, defer_driver=True)
+        if self.pool_size == 0:
+            kwargs['start_selenium'] = False
+        primary = KryxExtractor.KryxEtractor(**kwargs)
+        primary.state_lock = self.lock
+        manifest = os.path.join(primary.path, primary.page_manifest)
+        if len(primary.pages) == 0 and os.path.exists(manifest):
+            primary.pages = KryxExtractor.KryxPages.PageRegistry.load(manifest)
+            primary.history = primary.pages.urls
+        primary.stored_css.update(primary.page_cache.load_json('stored_css', dict()))
+        if self.pool_size > 0:
+            primary._retrieve_css()
+        elif primary.static_css:
+            primary._load_stylesheet()
+        self.extractor_kwargs['version'] = primary.version
+        return primary
+
+    def _share_state(self, extractor):
+        """Point an extractor at the primary extractor's shared state, and at the service's
+            lock, which the extractor holds whenever it changes that state. Workers export
+            pages without following links, so they only read the url index and hit buttons.
+            Args: extractor (KryxEtractor) - the extractor to share state with
+            Kwargs: None
+            Output: None
+            External State: extractor uses the primary's registry, CSS, stores, indexes and lock
+        """
+        for field in ('pages', 'history', 'stored_css', 'stylesheet', 'page_cache', 'html_store', 'url_index', 'hit_buttons',
+                      'state_lock'):
+            setattr(extractor, field, getattr(self.primary, field))
+
+    def _warm(self, extractor):
+        """Start an extractor's browser and apply site settings, so it is ready to export.
+            Args: extractor (KryxEtractor) - the extractor to warm up
+            Kwargs: None
+            Output: None
+            External State: extractor's webdriver is on the start url with site settings applied
+        """
+        extractor._init_webdriver()
+
+    def _add_worker(self):
+        """Create a warm extractor and add it to the pool.
+            Args: None
+            Kwargs: None
+            Output: None
+            External State: a new webdriver is started
+        """
+        start = timeit.default_timer()
+        # the pool already keeps several browsers busy, so workers clean their pages inline
+        worker = KryxExtractor.KryxEtractor(**dict(self.extractor_kwargs, defer_driver=True, clean_workers=0))
+        self._share_state(worker)
+        self._warm(worker)
+        self.workers.append(worker)
+        self.pool.put(worker)
+        self.logger.basic("Started worker %d in %f seconds" % (len(self.workers), timeit.default_timer()-start))
+
+    def _export_one(self, url):
+        """Export one URL with a worker from the pool. If the export fails, the worker's
+            browser is reset (or restarted) before it goes back in the pool.
+
+            Args: url (str) - the url to export
+            Kwargs: None
+            Output: result (dict) - url, page number and status of the export
+            External State: HTML and PDF files of the page exist
+        """
+        url = self.primary.url_index.canonical(url)
+        with self.lock:
+            record = self.primary.pages.add(url)
+        worker = self.pool.get()
+        start = timeit.default_timer()
+        try:
+            worker.export_page_from_url(url, follow_links=False)
+            return dict(url=url, page=record.page_number, ok=True, seconds=timeit.default_timer()-start)
+        except Exception as ex:
+            self.logger.basic("Export of %s failed: %s" % (url, ex))
+            if worker.start_selenium:
+                worker.selenium_driver = worker.driver_manager.recover()
+            return dict(url=url, page=record.page_number, ok=False, error=str(ex))
+        finally:
+            self.pool.put(worker)
+
+    def _replay_one(self, url):
+        """Re-render one URL from the page source cache, without a browser.
+            Args: url (str) - the url to re-render
+            Kwargs: None
+            Output: result (dict) - url, page number and status of the export
+            External State: HTML and PDF files of the page exist
+        """
+        url = self.primary.url_index.canonical(url)
+        start = timeit.default_timer()
+        with self.lock:
+            html_source, states = self.primary.page_cache.load(url)
+            if html_source is None:
+                return dict(url=url, page=None, ok=False, error="URL is not in the page source cache")
+            record = self.primary.pages.add(url)
+            try:
+                self.primary.render_page(url, html_source, states=states)
+                self.primary.finish_pages(wait=True)
+            except Exception as ex:
+                self.logger.basic("Replay of %s failed: %s" % (url, ex))
+                return dict(url=url, page=record.page_number, ok=False, error=str(ex))
+        return dict(url=url, page=record.page_number, ok=True, seconds=timeit.default_timer()-start)
+
+    def export_urls(self, urls):
+        """Re-export a list of URLs in parallel across the pool. Without browsers, the
+            URLs are re-rendered from the page source cache one after the other.
+            Args: urls (list[str]) - the urls to export
+            Kwargs: None
+            Output: results (list[dict]) - one result per url, in order
+            External State: HTML and PDF files of the pages exist, page manifest saved
+        """
+        if len(self.workers) == 0:
+            results = [self._replay_one(url) for url in urls]
+            with self.lock:
+                self.primary.save_page_manifest()
+            return results
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.workers)) as executor:
+            results = list(executor.map(self._export_one, urls))
+        with self.lock:
+            self.primary.save_page_manifest()
+            self.primary.page_cache.save_json('stored_css', self.primary.stored_css)
+        return results
+
+    def rebuild(self):
+        """Rebuild the compiled PDF. Waits for every worker to be idle first, so no page
+            is rewritten while it is being merged.
+
+            Args: None
+            Kwargs: None
+            Output: result (dict) - output path and number of pages
+            External State: compiled PDF exists
+        """
+        idle = [self.pool.get() for worker in self.workers]
+        try:
+            with self.lock:
+                self.primary.export_final_pdf()
+        finally:
+            for worker in idle:
+                self.pool.put(worker)
+        return dict(output=os.path.join(self.primary.path, self.primary.output_filename), pages=len(self.primary.pages))
+
+    def refresh_spells(self):
+        """Export the spell table again. The spell extractor is started on first use and
+            kept warm afterwards.
+
+            Args: None
+            Kwargs: None
+            Output: result (dict) - path of the spell CSV
+            External State: spell CSV exists
+        """
+        import KryxSpellExtractor
+        with self.lock:
+            if self.spell_extractor is None:
+                kwargs = dict(self.spell_kwargs)
+                kwargs.setdefault('version', self.primary.version)
+                kwargs['defer_driver'] = True
+                self.spell_extractor = KryxSpellExtractor.KryxSpellExtractor(**kwargs)
+                self._warm(self.spell_extractor)
+            url = self.spell_extractor.start_url
+            self.spell_extractor.export_page_from_url(url)
+        return dict(output=self.spell_extractor.make_output_filename(url, 'csv'))
+
+    def status(self):
+        return dict(version=self.primary.version, workers=len(self.workers), idle=self.pool.qsize(),
+                    pages=len(self.primary.pages), path=self.primary.path)
+
+    def handle(self, method, path, body):
+        """Dispatch an API request.
+            Args: method (str) - HTTP method
+                  path (str) - request path
+                  body (dict) - decoded JSON body
+            Kwargs: None
+            Output: status (int) - HTTP status code
+                    response (dict) - JSON response
+            External State: depends on the request
+        """
+        routes = {
+            ('GET', '/status'): lambda: self.status(),
+            ('POST', '/export'): lambda: dict(results=self.export_urls(body.get('urls', []))),
+            ('POST', '/rebuild'): lambda: self.rebuild(),
+            ('POST', '/spells'): lambda: self.refresh_spells(),
+            ('POST', '/shutdown'): lambda: self.shutdown(),
+        }
+        action = routes.get((method, path.rstrip('/') or '/'))
+        if action is None:
+            return 404, dict(error="Unknown request %s %s" % (method, path))
+        try:
+            return 200, action()
+        except Exception as ex:
+            self.logger.basic("Request %s %s failed: %s" % (method, path, traceback.format_exc()))
+            return 500, dict(error=str(ex))
+
+    def serve_forever(self):
+        """Serve the API until a shutdown request is received.
+            Args: None
+            Kwargs: None
+            Output: None
+            External State: API served on the socket, browsers shut down afterwards
+        """
+        if self.socket_path is not None:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.server = UnixHTTPServer(self.socket_path, ServiceRequestHandler)
+            self.logger.basic("Serving on unix socket %s" % self.socket_path)
+        else:
+            self.server = http.server.ThreadingHTTPServer((self.host, self.port), ServiceRequestHandler)
+            self.logger.basic("Serving on http://%s:%d" % self.server.server_address[:2])
+        self.server.service = self
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.close()
+
+    def shutdown(self):
+        if self.server is not None:
+            threading.Thread(target=self.server.shutdown).start()
+        return dict(stopping=True)
+
+    def close(self):
+        """Shut down every browser of the service.
+            Args: None
+            Kwargs: None
+            Output: None
+            External State: all webdrivers shut down
+        """
+        for extractor in self.workers + [self.spell_extractor]:
+            if extractor is not None:
+                extractor._webdriver_cleanup()
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ServiceRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Translates HTTP requests into KryxService.handle calls."""
+
+    def _respond(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = dict()
+        if length > 0:
+            try:
+                body = json.loads(self.rfile.read(length).decode('utf-8'))
+            except ValueError:
+                self._send(400, dict(error="Request body is not valid JSON"))
+                return
+        status, response = self.server.service.handle(method, self.path, body)
+        self._send(status, response)
+
+    def _send(self, status, response):
+        data = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._respond('GET')
+
+    def do_POST(self):
+        self._respond('POST')
+
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return self.server.server_address
+
+    def log_message(self, format, *args):
+        self.server.service.logger.vdebug("%s - %s" % (self.address_string(), format % args))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve KryxExtractor requests from warm browsers")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--socket', dest='socket_path', default=DEFAULT_SOCKET_PATH)
+    parser.add_argument('--pool-size', type=int, default=DEFAULT_POOL_SIZE)
+    parser.add_argument('--version', default=None)
+    parser.add_argument('--export-dir', default=KryxExtractor.DEFAULT_EXPORT_DIR)
+    args = parser.parse_args()
+    service = KryxService(pool_size=args.pool_size, host=args.host, port=args.port, socket_path=args.socket_path,
+                          extractor_kwargs=dict(version=args.version, export_dir=args.export_dir))
+    service.serve_forever()
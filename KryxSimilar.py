@@ -0,0 +1,174 @@
+"""
+KryxSimilar - Near-duplicate detection of crawled pages
+
+Many pages of the site (per-theme listings, variant subpages) are almost identical once
+cleaned, yet each was rendered and appended to the compiled PDF. The similarity index
+fingerprints the visible text of every cleaned page with MinHash over word shingles, and
+finds earlier pages with an estimated Jaccard similarity above a threshold. Candidates are
+looked up through locality-sensitive hashing (the signature is cut into bands, and pages
+sharing any band are compared), so each check costs a few dict lookups instead of a
+comparison with every earlier page.
+"""
+import re
+import html
+import struct
+import hashlib
+
+DEFAULT_THRESHOLD = 0.9                     # Estimated Jaccard similarity above which pages are near-duplicates
+DEFAULT_NUM_PERM = 64                       # Number of MinHash permutations
+DEFAULT_BANDS = 16                          # Number of LSH bands the signature is cut into
+DEFAULT_SHINGLE_SIZE = 4                    # Number of words per shingle
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+HIDDEN_REGEX = re.compile(r'<(style|script)[^>]*>.*?</\1>', re.DOTALL | re.IGNORECASE)
+TAG_REGEX = re.compile(r'<[^>]+>')
+WORD_REGEX = re.compile(r'\w+')
+
+
+def page_words(html_source):
+    """Visible words of an html page, lower case, in order.
+        Args: html_source (str) - the page
+        Kwargs: None
+        Output: words (list[str]) - the words
+        External State: No change
+    """
+    text = html.unescape(TAG_REGEX.sub(' ', HIDDEN_REGEX.sub(' ', html_source)))
+    return WORD_REGEX.findall(text.lower())
+
+
+def shingle_hashes(words, shingle_size=DEFAULT_SHINGLE_SIZE):
+    """32 bit hashes of every run of shingle_size consecutive words.
+        Args: words (list[str]) - the words of a page
+        Kwargs: shingle_size (int) - number of words per shingle
+        Output: hashes (set[int]) - the distinct shingle hashes
+        External State: No change
+    """
+    if 0 < len(words) < shingle_size:
+        shingle_size = len(words)
+    hashes = set()
+    for n in range(len(words) - shingle_size + 1):
+        digest = hashlib.blake2b(' '.join(words[n:n + shingle_size]).encode('utf-8'), digest_size=4).digest()
+        hashes.add(struct.unpack('<I', digest)[0])
+    return hashes
+
+
+class SimilarityIndex:
+    """SimilarityIndex
+            MinHash signatures of pages, indexed by LSH bands.
+
+            Args:
+                None
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | threshold           |   float               |   Estimated Jaccard similarity above which pages are near-duplicates |
+                | num_perm            |   int                 |   Number of MinHash permutations |
+                | bands               |   int                 |   Number of LSH bands (must divide num_perm) |
+                | shingle_size        |   int                 |   Number of words per shingle |
+                | max_entries         |   int                 |   Number of signatures kept, the oldest are dropped first (all if None) |
+    """
+
+    def __init__(self,
+                 threshold=DEFAULT_THRESHOLD,
+                 num_perm=DEFAULT_NUM_PERM,
+                 bands=DEFAULT_BANDS,
+                 shingle_size=DEFAULT_SHINGLE_SIZE,
+                 max_entries=None,
+                 ):
+        if num_perm % bands != 0:
+            raise ValueError("num_perm (%d) must be a multiple of bands (%d)" % (num_perm, bands))
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.max_entries = max_entries
+        seed = hashlib.sha256(b'KryxSimilar').digest()
+        self.permutations = []
+        for n in range(num_perm):
+            digest = hashlib.sha256(seed + struct.pack('<I', n)).digest()
+            a, b = struct.unpack('<QQ', digest[:16])
+            self.permutations.append((a % (MERSENNE_PRIME - 1) + 1, b % MERSENNE_PRIME))
+        self.signatures = dict()
+        self.buckets = [dict() for n in range(bands)]
+
+    def signature(self, html_source):
+        """MinHash signature of the visible text of a page.
+            Args: html_source (str) - the page
+            Kwargs: None
+            Output: signature (tuple[int] or None) - the signature, None if the page has no text
+            External State: No change
+        """
+        hashes = shingle_hashes(page_words(html_source), self.shingle_size)
+        if len(hashes) == 0:
+            return None
+        return tuple(min(((a * value + b) % MERSENNE_PRIME) & MAX_HASH for value in hashes)
+                     for a, b in self.permutations)
+
+    def _bands(self, signature):
+        return [signature[n * self.rows:(n + 1) * self.rows] for n in range(self.bands)]
+
+    @staticmethod
+    def similarity(signature, other):
+        return sum(1 for x, y in zip(signature, other) if x == y) / len(signature)
+
+    def query(self, signature, exclude=None):
+        """Find the indexed page most similar to a signature, above the threshold.
+            Args: signature (tuple[int]) - the signature to look up
+            Kwargs: exclude (str) - url to ignore, e.g. the page itself
+            Output: match (str or None) - url of the most similar page, None if none is similar enough
+                    similarity (float) - its estimated similarity
+            External State: No change
+        """
+        candidates = set()
+        for bucket, band in zip(self.buckets, self._bands(signature)):
+            candidates.update(bucket.get(band, ()))
+        candidates.discard(exclude)
+        best, best_similarity = None, 0.0
+        for url in candidates:
+            similarity = self.similarity(signature, self.signatures[url])
+            if similarity >= self.threshold and similarity > best_similarity:
+                best, best_similarity = url, similarity
+        return best, best_similarity
+
+    def add(self, url, signature):
+        """Index the signature of a page.
+            Args: url (str) - url of the page
+                  signature (tuple[int]) - its signature
+            Kwargs: None
+            Output: None
+            External State: No change
+        """
+        self.remove(url)
+        self.signatures[url] = signature
+        for bucket, band in zip(self.buckets, self._bands(signature)):
+            bucket.setdefault(band, []).append(url)
+        while self.max_entries is not None and len(self.signatures) > self.max_entries:
+            self.remove(next(iter(self.signatures)))
+
+    def remove(self, url):
+        signature = self.signatures.pop(url, None)
+        if signature is None:
+            return
+        for bucket, band in zip(self.buckets, self._bands(signature)):
+            bucket[band].remove(url)
+            if len(bucket[band]) == 0:
+                del bucket[band]
+
+    def check(self, url, html_source):
+        """Check whether a page is a near-duplicate of an indexed page. Pages which are
+            not are indexed, so later pages are checked against them.
+            Args: url (str) - url of the page
+                  html_source (str) - the cleaned page
+            Kwargs: None
+            Output: match (str or None) - url of the page it duplicates, None if it is not a near-duplicate
+                    similarity (float) - its estimated similarity
+            External State: No change
+        """
+        signature = self.signature(html_source)
+        if signature is None:
+            return None, 0.0
+        match, similarity = self.query(signature, exclude=url)
+        if match is None:
+            self.add(url, signature)
+        return match, similarity
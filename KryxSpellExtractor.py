@@ -1,86 +1,43 @@
 """
-KryxExtractor - Crawl and Export Kryx's DnD 5e website
-# v0.0.2 (07/01/2019)
-* Adds image downloading/encoding
-* Speeds up CSS stylization by avoiding redundant tags
-* Decreased waiting intervals
+KryxSpellExtractor - Extract Kryx's spell table to CSV
 
-# v0.0.1 (06/30/2019)
-* Written for Python 3
-* Compiles to PDF from HTML pages
-* Uses Selenium with Firefox as principle driver
-* Omit Beastiary by default
-* Downloads CSS to attempt CSS formatting, but only some tags, and in a naive way
+The spell table is extracted with the 'spells' schema of KryxTableExtractor (every row
+expanded in one script call, pagination followed), into KRYX_SPELLS_v<version>/csv.
+clean_csv then splits the augmentation, damage, range, saving throw and duration out of
+the description of each spell, strips their markup, and writes the cleaned CSV
+next to the extracted one (KryxBackfill runs it for every archived version).
 
-# TODO
-* Current version does not fix broken internal links from source HTML
-* Current version does not allow for other selenium webdrivers
-* Current version does not support partial crawling (e.g. just the bestiary)
-* CSS multiclasses etc, are currently not supported, so certain CSS tags do not work
-* Create Table of Contents and Title Page
-* More beautification to fit in an 8.5x11 page more evenly
+    python KryxSpellExtractor.py        # clean the CSV of the latest exported version
 """
-import itertools
 import os
 import re
-import utils
-import glob
-import time
-import pandas
-import timeit
-import base64
-import pdfkit
-import logging
-import selenium
-import urllib.request
-import urllib3
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from PyPDF2 import PdfFileWriter, PdfFileReader
-import KryxLogger
-import KryxExtractor
+import KryxTableExtractor
+# pandas and BeautifulSoup are slow to import, so they are imported where they are used.
 
-DEFAULT_CSV_SUBDIR = "csv"
+DEFAULT_CSV_SUBDIR = KryxTableExtractor.DEFAULT_CSV_SUBDIR
 DEFAULT_START_URL = "https://marklenser.com/5e/themes/spells/all"
 DEFAULT_COLUMN_ORDER = ["name", "power_sources", "theme", "mana", "cast time", "concentration", "ritual"]
 DEFAULT_DEST_COLUMNS = ["name", "description", "mana", "ritual", "cast_time", "concentration",
                         "range", "duration", "target", "save", "effect", "augmentation", "damage"]
 DEFAULT_URL_REPLACE = "KRYX_SPELLS"
+DEFAULT_CLEAN_SUFFIX = "_clean"             # Suffix of the cleaned spell CSV, next to the extracted one
 
 
-class KryxSpellExtractor(KryxExtractor.KryxEtractor):
-    """KryxExtractor
-            Scrapes Kryx's website for his current version of Homebrew.
-            Pulls down all available pages unless specified to ignore them, and compiles
-            them into a single PDF.
+class KryxSpellExtractor(KryxTableExtractor.KryxTableExtractor):
+    """KryxSpellExtractor
+            Extracts Kryx's spell table to CSV, using the 'spells' table schema.
+            Takes every keyword argument of KryxEtractor as well.
 
             Args:
                 None
             Kwargs:
                 | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
                 | -------------------- |:-----------------------:| -------------------:|
-                | start_url           |   str                 |   URL to start crawling from |
-                | url_prefix          |   str                 |   URL prefix to replace in target URLs |
-                | url_replace         |   str                 |   String to replace URL prefix |
-                | changelog_url       |   str                 |   URL of the changelog |
-                | url_sep_char        |   str                 |   Separating character in URLs |
-                | js_wait_interval    |   int,float           |   Interval to wait for javascript actions to occur |
-                | page_wait_interval  |   int,float           |   Interval to wait between crawling pages |
-                | click_offset        |   int                 |   Offset for clicking off of javascript elements |
-                | hit_buttons         |   list[str]           |   List of button IDs which have already been hit |
-                | button_seek_params  |   list[args]          |   Parameters for finding clickable buttons |
-                | selenium_driver     |   Firefox Webdriver   |   Selenium Webdriver to use |
-                | ignore_urls         |   list[str]           |   URLS which should not be exported or crawled further |
-                | stack               |   list[str]           |   Stack data structure of URLs to crawls |
-                | history             |   list[str]           |   List of URLS already crawled |
-                | html_remove_tags    |   list[str]           |   Tags to remove from HTML |
-                | export_dir          |   str                 |   Base directory to export in (irrelevent if path is specified) |
-                | version             |   str                 |   Path to export the intermediate PDFs and compiled PDFs |
-                | path                |   str                 |   Version string to use |
-                | output_filename     |   str                 |   Final filename to use for output |
-                | verbose             |   int                 |   Verbose console output |
-                | css_file            |   str                 | static url of CSS file to download |
-                | stored_css          |   dict[str:str]       | stored CSS for tags and classes |
+                | start_url           |   str                 |   URL of the spell table |
+                | csv_subdir          |   str                 |   Subdirectory the CSV is written to |
+                | column_order        |   list[str]           |   Columns of the summary rows, in cell order (types are taken from the spell schema) |
+                | dest_columns        |   list[str]           |   Columns every row of the CSV has |
+                | url_replacer        |   str                 |   String to replace URL prefix |
     """
 
     def __init__(self,
@@ -91,112 +48,53 @@ class KryxSpellExtractor(KryxExtractor.KryxEtractor):
                  url_replacer=DEFAULT_URL_REPLACE,
                  **kwargs
                  ):
-        self.csv_subdir = csv_subdir
         self.column_order = column_order
         self.dest_columns = dest_columns
-        super(KryxSpellExtractor, self).__init__(start_url=start_url, url_replacer=url_replacer, **kwargs)
-
-    def _init_paths(self):
-        """Initialize the extraction paths. i.e. create them if they don't exist
-            Args: None
-            Kwargs: None
-            Fields: logger, path, html_subdir, pdf_subdir, url_replace, version
-            Output: None
-            External State: path, html_subdir, and pdf_subdir exist if they did not exist before
-        """
-        super(KryxSpellExtractor, self)._init_paths()
-        os.makedirs(os.path.join(self.path, self.csv_subdir), exist_ok=True)
+        spells = KryxTableExtractor.SCHEMAS['spells']
+        columns = {column.name: column for column in spells.columns}
+        schema = KryxTableExtractor.TableSchema(spells.name, start_url,
+                                                [columns.get(name) or KryxTableExtractor.Column(name) for name in column_order],
+                                                url_replacer=url_replacer,
+                                                detail_column=spells.detail_column,
+                                                extra_columns=[name for name in dest_columns if name != spells.detail_column],
+                                                expand_selector=spells.expand_selector,
+                                                expand_skip=spells.expand_skip,
+                                                next_selector=spells.next_selector)
+        super(KryxSpellExtractor, self).__init__(schema=schema, csv_subdir=csv_subdir, start_url=start_url,
+                                                 url_replacer=url_replacer, **kwargs)
 
     def grab_table(self, html_source):
-        self.expand_tables()
-        html_source = self.selenium_driver.page_source
-        soup = BeautifulSoup(html_source)
-        table = soup.find('table')
-        tbody = table.find('tbody')
-        trs = tbody.find_all('tr', recursive=False)
-        df = []
-        row = dict()
-        for i, tr in enumerate(trs):
-            tds = tr.find_all('td')
-            if i % 2 == 0:
-                row = dict()
-                for j, td in enumerate(tds):
-                    if j >= len(self.column_order):
-                        continue
-                    key = self.column_order[j]
-                    row[key] = td.text
-                    if key == 'concentration':
-                        row[key] = row[key].lower().strip() == 'concentration'
-                    if key == 'ritual':
-                        row[key] = row[key].lower().strip() == 'ritual'
-                    if key == 'power_sources':
-                        row[key] = row[key].replace(',', ';')
-            else:
-                row['description'] = str(tr)
-                for rkey in self.dest_columns:
-                    if rkey not in row.keys():
-                        row[rkey] = None
-                df.append(row)
-        return pandas.DataFrame(df)
+        states = self.grab_tables()
+        return KryxTableExtractor.parse_tables(KryxTableExtractor.table_states(states), self.schema)
 
-    def expand_tables(self):
-        buttons = self.selenium_driver.find_elements_by_xpath("//button[@aria-label='Show more']")[1:]
-        for button in buttons:
-            button.click()
-            time.sleep(self.js_wait_interval)
-
-    def export_page_from_url(self, url):
-        """Exports HTML and PDF pages from a URL.
-
-            Args: url (str) -   the url to export from
-            Kwargs: None
-            Fields: logger
-            Output: html_source, the final html source which is output
-                    new_links, links extracted prior to cleaning
-            External State: exported PDF file exists and HTML exists, selenium driver on URL
-        """
-        filename_csv = self.make_output_filename(url, 'csv')
-        start = timeit.default_timer()
-        try:
-            self.selenium_driver.get(url)
-        except Exception:
-            self._init_webdriver()
-            self.selenium_driver.get(url)
-        html_source = self.selenium_driver.page_source
-        self.logger.vvdebug("Took %f seconds to navigate to page" % (timeit.default_timer()-start))
-        start = timeit.default_timer()
-        table = self.grab_table(html_source)
-        self.logger.vvdebug("Took %f seconds to grab table page" % (timeit.default_timer()-start))
-        start = timeit.default_timer()
-        with open(filename_csv, 'w', encoding='utf-8') as file:
-            table.to_csv(file, sep=",", float_format='%.2f', index=False, line_terminator='\n', encoding='utf-8')
-        self.logger.vvdebug("Took %f seconds write CSV" % (timeit.default_timer()-start))
-        return html_source, []
-
-    def make_output_filename(self, url, filetype):
-        """Create an output filename for a given filetype.
-            Filetypes supported are PDF and HTML.
-            PDF files are output with a page number in front of them.
-            HTML files are just output with the slugified URL.
-
-            Args: url   (str)   - the url to convert to a filename
-                  filetype (str)    - 'pdf' or 'html' the filetype to create for
+    def clean_csv_filename(self):
+        """Path of the cleaned spell CSV of this version, next to the extracted one.
+            Args: None
             Kwargs: None
-            Fields: start_url, url_replace, url_sep_char, path, history, html_subdir, pdf_subdir
+            Fields: start_url, path, csv_subdir
+            Output: filename (str) - path of the cleaned CSV
             External State: No change
         """
-        prefix = url.replace(self.start_url, self.url_replacer)
-        filename_prefix = prefix.replace(self.url_sep_char, '_')
-        filenames = dict(
-            csv=os.path.join(self.path, self.csv_subdir, "%s.csv" % filename_prefix)
-        )
-        if filetype.lower() not in filenames.keys():
-            raise ValueError("Export filetype %s is not supported" % filetype)
-        return filenames.get(filetype.lower())
+        root, extension = os.path.splitext(self.make_output_filename(self.start_url, 'csv'))
+        return root + DEFAULT_CLEAN_SUFFIX + extension
 
     def clean_csv(self,
-                  csv_file="D:\\Dropbox\\BRAD\\python\\kryx_version\\KRYX_SPELLS_v13.0.0-beta-5\\csv\\KRYX_SPELLS.csv",
-                  csv_out="D:\\Dropbox\\Campaigns\\falloutflorida\\backend\\media\\notes\\spells_original.csv"):
+                  csv_file=None,
+                  csv_out=None):
+        """Clean the extracted spell CSV: split augmentations, damage, range, saving throw
+            and duration out of the descriptions, and strip their markup.
+            Args: None
+            Kwargs: csv_file (str) - the extracted spell CSV, this version's if None
+                    csv_out (str) - the cleaned CSV to write, next to the extracted one if None
+            Fields: logger
+            Output: csv_out (str) - path of the cleaned CSV
+            External State: cleaned CSV exists
+        """
+        import pandas
+        if csv_file is None:
+            csv_file = self.make_output_filename(self.start_url, 'csv')
+        if csv_out is None:
+            csv_out = self.clean_csv_filename()
         df = pandas.read_csv(csv_file)
         df = df.where((pandas.notnull(df)), None)
         newdf = []
@@ -208,6 +106,7 @@ class KryxSpellExtractor(KryxExtractor.KryxEtractor):
             cast_time = row.pop('cast time')
             row['cast_time'] = cast_time
 
+            augmentstr = ""
             if "Augment" in description:
                 endtag = "</div>"
                 if "</p></div>" in description:
@@ -215,7 +114,7 @@ class KryxSpellExtractor(KryxExtractor.KryxEtractor):
                 elif "</ul></div>" in description:
                     endtag = "</ul></div>"
                 else:
-                    input(("UHOH", description))
+                    self.logger.basic("Unexpected augmentation markup in spell %s" % name)
                 augmentstr = description[description.index("<h5"):(description.index(endtag)+4)]
                 row['augmentation'] = augmentstr
             cut_description = description.replace(augmentstr, "").replace('concentration, ', '').replace('(ritual)', '')
@@ -300,9 +199,7 @@ class KryxSpellExtractor(KryxExtractor.KryxEtractor):
             row['spell_theme'] = row.pop('theme')
             newdf.append(row)
         pandas.DataFrame(newdf).to_csv(csv_out, index=False)
-
-    def run(self):
-        self.crawl()
+        return csv_out
 
 
 if __name__ == '__main__':
@@ -0,0 +1,145 @@
+"""
+KryxStore - Compressed, deduplicated storage of intermediate HTML pages
+
+Every cleaned page carries the same injected style block and many of the same inlined
+images, so storing pages as-is wastes a lot of disk. The store pulls large repeated
+fragments (style blocks and base64 data URIs) out of each page into content-addressed
+blobs, written once, and gzips both the pages and the blobs:
+
+    <path>/<page>.html.gz           - page with fragments replaced by "kryx-blob:<sha1>" tokens
+    <path>/blobs/<sha1>.gz          - one file per distinct fragment
+
+Reading a page puts the fragments back, so readers always see the original HTML. Plain,
+uncompressed pages are read as-is. To decompress a page for debugging, run
+    python KryxStore.py path/to/page.html > page.html
+"""
+import os
+import re
+import sys
+import gzip
+import hashlib
+
+DEFAULT_COMPRESS_LEVEL = 6                  # gzip compression level of pages and blobs
+DEFAULT_MIN_BLOB_SIZE = 256                 # Fragments smaller than this are left in the page
+DEFAULT_BLOB_SUBDIR = 'blobs'               # Subdirectory of the store holding shared fragments
+COMPRESSED_SUFFIX = '.gz'
+BLOB_TOKEN = 'kryx-blob:%s'
+BLOB_TOKEN_REGEX = re.compile(r'kryx-blob:([0-9a-f]{40})')
+FRAGMENT_REGEX = re.compile(r'<style[^>]*>.*?</style>|data:[\w/+.-]+;base64,\s*[A-Za-z0-9+/=]+', re.DOTALL | re.IGNORECASE)
+
+
+class HtmlStore:
+    """HtmlStore
+            Directory of gzip-compressed HTML pages sharing deduplicated fragments.
+
+            Args:
+                path (str)          -   Directory the pages are stored in
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | compress            |   bool                |   Compress and deduplicate pages (plain HTML files otherwise) |
+                | compress_level      |   int                 |   gzip compression level |
+                | min_blob_size       |   int                 |   Fragments smaller than this are left in the page |
+    """
+
+    def __init__(self,
+                 path,
+                 compress=True,
+                 compress_level=DEFAULT_COMPRESS_LEVEL,
+                 min_blob_size=DEFAULT_MIN_BLOB_SIZE,
+                 ):
+        self.path = path
+        self.compress = compress
+        self.compress_level = compress_level
+        self.min_blob_size = min_blob_size
+        self.blob_path = os.path.join(self.path, DEFAULT_BLOB_SUBDIR)
+        self._known_blobs = set()
+        self._blob_cache = dict()
+        if self.compress:
+            os.makedirs(self.blob_path, exist_ok=True)
+
+    def _blob_filename(self, key):
+        return os.path.join(self.blob_path, key + COMPRESSED_SUFFIX)
+
+    def _put_blob(self, fragment):
+        """Store a fragment once, keyed by its content hash.
+            Args: fragment (str) - the fragment to store
+            Kwargs: None
+            Output: token (str) - the token which replaces the fragment in pages
+            External State: blob file exists for the fragment
+        """
+        data = fragment.encode('utf-8')
+        key = hashlib.sha1(data).hexdigest()
+        if key not in self._known_blobs:
+            filename = self._blob_filename(key)
+            if not os.path.exists(filename):
+                with gzip.open(filename, 'wb', compresslevel=self.compress_level) as file:
+                    file.write(data)
+            self._known_blobs.add(key)
+        return BLOB_TOKEN % key
+
+    def _get_blob(self, key):
+        if key not in self._blob_cache:
+            with gzip.open(self._blob_filename(key), 'rt', encoding='utf-8') as file:
+                self._blob_cache[key] = file.read()
+        return self._blob_cache[key]
+
+    def dedupe(self, html_source):
+        """Replace large repeated fragments of a page with blob tokens.
+            Args: html_source (str) - the page
+            Kwargs: None
+            Output: html_source (str) - the page with fragments replaced by tokens
+            External State: blob files exist for all replaced fragments
+        """
+        def replace(match):
+            fragment = match.group(0)
+            if len(fragment) < self.min_blob_size:
+                return fragment
+            return self._put_blob(fragment)
+        return FRAGMENT_REGEX.sub(replace, html_source)
+
+    def restore(self, html_source):
+        """Put the fragments of a deduplicated page back.
+            Args: html_source (str) - the page with blob tokens
+            Kwargs: None
+            Output: html_source (str) - the original page
+            External State: No change
+        """
+        return BLOB_TOKEN_REGEX.sub(lambda match: self._get_blob(match.group(1)), html_source)
+
+    def write(self, filename, html_source):
+        """Write a page to the store.
+            Args: filename (str) - path of the page as plain HTML, ".gz" is appended when compressing
+                  html_source (str) - the page
+            Kwargs: None
+            Output: filename (str) - path of the file which was written
+            External State: page (and any new blobs) exist on disk
+        """
+        if not self.compress:
+            with open(filename, 'w', encoding='utf-8') as file:
+                file.write(html_source)
+            return filename
+        filename = filename + COMPRESSED_SUFFIX
+        with gzip.open(filename, 'wt', encoding='utf-8', compresslevel=self.compress_level) as file:
+            file.write(self.dedupe(html_source))
+        return filename
+
+    def read(self, filename):
+        """Read a page from the store, compressed or plain.
+            Args: filename (str) - path of the page as plain HTML
+            Kwargs: None
+            Output: html_source (str) - the original page
+            External State: No change
+        """
+        if os.path.exists(filename + COMPRESSED_SUFFIX):
+            with gzip.open(filename + COMPRESSED_SUFFIX, 'rt', encoding='utf-8') as file:
+                return self.restore(file.read())
+        with open(filename, 'r', encoding='utf-8') as file:
+            return file.read()
+
+
+if __name__ == '__main__':
+    for page in sys.argv[1:]:
+        if page.endswith(COMPRESSED_SUFFIX):
+            page = page[:-len(COMPRESSED_SUFFIX)]
+        sys.stdout.write(HtmlStore(os.path.dirname(os.path.abspath(page))).read(page))
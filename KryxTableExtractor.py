@@ -0,0 +1,437 @@
+"""
+KryxTableExtractor - Schema-driven extraction of Kryx's entity tables to columnar datasets
+
+Spells, monsters and maneuvers are all listed in the same kind of table: one summary row
+per entity, usually followed by a detail row which only appears after clicking its
+"Show more" button, and sometimes split across several pages. Rather than hard-coding one
+table's layout, each entity is described by a TableSchema: where its table lives, its
+typed columns, whether rows alternate with detail rows, and how to expand and page through
+it. The extractor expands every row with a single script call per table page, follows the
+pagination, and parses all pages into one column-oriented dataset per entity, written
+as CSV.
+
+Several entities can be extracted at once, each with its own browser:
+
+    python KryxTableExtractor.py spells monsters maneuvers
+"""
+import os
+import re
+import sys
+import time
+import timeit
+import urllib.error
+import concurrent.futures
+import KryxWatch
+import KryxExtractor
+# pandas and BeautifulSoup are slow to import, so they are imported where they are used.
+
+DEFAULT_CSV_SUBDIR = "csv"
+DEFAULT_SCHEMA = 'spells'                   # Schema extracted when none is given
+DEFAULT_MAX_TABLE_PAGES = 200               # Maximum number of table pages followed through pagination
+DEFAULT_MAX_WORKERS = 3                     # Number of entities (and browsers) extracted at once
+EXPAND_SCRIPT = """
+var buttons = Array.prototype.slice.call(document.querySelectorAll(arguments[0])).slice(arguments[1]);
+buttons.forEach(function (button) { button.click(); });
+return buttons.length;
+"""
+NEXT_PAGE_SCRIPT = """
+var button = document.querySelector(arguments[0]);
+if (button === null || button.disabled || button.getAttribute('aria-disabled') === 'true') { return false; }
+button.click();
+return true;
+"""
+NUMBER_REGEX = re.compile(r'-?\d+(?:\.\d+)?(?:/\d+)?')
+
+
+def parse_str(text, column):
+    return text.strip()
+
+
+def parse_int(text, column):
+    match = NUMBER_REGEX.search(text.replace(',', ''))
+    if match is None or '/' in match.group(0) or '.' in match.group(0):
+        return None
+    return int(match.group(0))
+
+
+def parse_float(text, column):
+    match = NUMBER_REGEX.search(text.replace(',', ''))
+    if match is None:
+        return None
+    if '/' in match.group(0):
+        numerator, denominator = match.group(0).split('/')
+        return float(numerator) / float(denominator)
+    return float(match.group(0))
+
+
+def parse_bool(text, column):
+    return text.lower().strip() == column.true_value
+
+
+def parse_list(text, column):
+    return ';'.join(item.strip() for item in text.split(',') if len(item.strip()) > 0)
+
+
+COLUMN_PARSERS = dict(str=parse_str, int=parse_int, float=parse_float, bool=parse_bool, list=parse_list)
+COLUMN_DTYPES = dict(str='object', int='Int64', float='float64', bool='boolean', list='object')
+
+
+class Column:
+    """Column
+            One typed column of an entity table.
+
+            Args:
+                name (str)          -   name of the column in the dataset
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | kind                |   str                 |   'str', 'int', 'float', 'bool' or 'list' (comma separated, stored ";" separated) |
+                | true_value          |   str                 |   Cell text of a true 'bool' cell (defaults to the column name) |
+    """
+    __slots__ = ('name', 'kind', 'true_value')
+
+    def __init__(self, name, kind='str', true_value=None):
+        if kind not in COLUMN_PARSERS:
+            raise ValueError("Column type %s is not supported" % kind)
+        self.name = name
+        self.kind = kind
+        self.true_value = true_value
+        if self.true_value is None:
+            self.true_value = name.lower()
+
+    def parse(self, text):
+        return COLUMN_PARSERS[self.kind](text, self)
+
+
+class TableSchema:
+    """TableSchema
+            Declarative description of an entity table.
+
+            Args:
+                name (str)          -   name of the entity, e.g. 'spells'
+                start_url (str)     -   url of the page holding the table
+                columns (list[Column]) - columns of the summary rows, in cell order
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | url_replacer        |   str                 |   String to replace URL prefix, names the export directory |
+                | detail_column       |   str                 |   Column holding the HTML of the detail row following each summary row, None if there are no detail rows |
+                | extra_columns       |   list[str]           |   Columns added empty to every row, to be filled in later |
+                | expand_selector     |   str                 |   CSS selector of the buttons expanding detail rows, None if there are none |
+                | expand_skip         |   int                 |   Number of leading expand buttons which do not belong to the table |
+                | next_selector       |   str                 |   CSS selector of the next page button, None if the table is not paginated |
+    """
+
+    def __init__(self,
+                 name,
+                 start_url,
+                 columns,
+                 url_replacer=None,
+                 detail_column='description',
+                 extra_columns=None,
+                 expand_selector="button[aria-label='Show more']",
+                 expand_skip=0,
+                 next_selector=None,
+                 ):
+        self.name = name
+        self.start_url = start_url
+        self.columns = columns
+        self.url_replacer = url_replacer
+        if self.url_replacer is None:
+            self.url_replacer = "KRYX_%s" % name.upper()
+        self.detail_column = detail_column
+        self.extra_columns = extra_columns
+        if self.extra_columns is None:
+            self.extra_columns = []
+        self.expand_selector = expand_selector
+        self.expand_skip = expand_skip
+        self.next_selector = next_selector
+
+    @property
+    def column_names(self):
+        names = [column.name for column in self.columns]
+        if self.detail_column is not None:
+            names.append(self.detail_column)
+        return names + [name for name in self.extra_columns if name not in names]
+
+    def dtypes(self):
+        dtypes = {name: 'object' for name in self.column_names}
+        dtypes.update({column.name: COLUMN_DTYPES[column.kind] for column in self.columns})
+        return dtypes
+
+
+SCHEMAS = dict(
+    spells=TableSchema('spells', "https://marklenser.com/5e/themes/spells/all",
+                       [Column('name'), Column('power_sources', 'list'), Column('theme'), Column('mana'),
+                        Column('cast time'), Column('concentration', 'bool'), Column('ritual', 'bool')],
+                       url_replacer="KRYX_SPELLS",
+                       extra_columns=["mana", "ritual", "cast_time", "concentration", "range", "duration",
+                                      "target", "save", "effect", "augmentation", "damage"],
+                       expand_skip=1),
+    monsters=TableSchema('monsters', "https://marklenser.com/5e/monsters",
+                         [Column('name'), Column('size'), Column('type'), Column('alignment'),
+                          Column('challenge', 'float'), Column('xp', 'int')],
+                         url_replacer="KRYX_MONSTERS",
+                         expand_skip=1,
+                         next_selector="button[aria-label='Next page']"),
+    maneuvers=TableSchema('maneuvers', "https://marklenser.com/5e/themes/maneuvers/all",
+                          [Column('name'), Column('theme'), Column('stamina'), Column('action'),
+                           Column('concentration', 'bool')],
+                          url_replacer="KRYX_MANEUVERS",
+                          expand_skip=1),
+)
+
+
+def parse_table(html_source, schema, dataset=None):
+    """Parse the rows of an entity table into columns.
+        Args: html_source (str) - html of a page holding the table (rows expanded)
+              schema (TableSchema) - layout of the table
+        Kwargs: dataset (dict[str:list]) - columns to append the rows to, new columns if None
+        Output: dataset (dict[str:list]) - one list of values per column, all of the same length
+        External State: No change
+    """
+    from bs4 import BeautifulSoup
+    if dataset is None:
+        dataset = {name: [] for name in schema.column_names}
+    table = BeautifulSoup(html_source, 'html.parser').find('table')
+    if table is None:
+        return dataset
+    tbody = table.find('tbody') or table
+    row = None
+    for tr in tbody.find_all('tr', recursive=False):
+        if row is not None and schema.detail_column is not None:
+            row[schema.detail_column] = str(tr)
+            _append_row(dataset, row)
+            row = None
+            continue
+        tds = tr.find_all('td')
+        row = {column.name: column.parse(td.text) for column, td in zip(schema.columns, tds)}
+        if schema.detail_column is None:
+            _append_row(dataset, row)
+            row = None
+    if row is not None:
+        _append_row(dataset, row)
+    return dataset
+
+
+def _append_row(dataset, row):
+    for name, values in dataset.items():
+        values.append(row.get(name))
+
+
+def parse_tables(html_sources, schema):
+    """Parse every page of an entity table into one dataset.
+        Args: html_sources (list[str]) - html of each table page, in order
+              schema (TableSchema) - layout of the table
+        Kwargs: None
+        Output: dataset (pandas.DataFrame) - one typed column per schema column
+        External State: No change
+    """
+    import pandas
+    dataset = None
+    for html_source in html_sources:
+        dataset = parse_table(html_source, schema, dataset=dataset)
+    if dataset is None:
+        dataset = {name: [] for name in schema.column_names}
+    return pandas.DataFrame(dataset, columns=schema.column_names).astype(schema.dtypes())
+
+
+def table_states(states):
+    """Table page sources stored in the page states, in page order."""
+    keys = [key for key in states.keys() if key == 'tables' or key.startswith('tables:')]
+    return [states[key] for key in sorted(keys, key=lambda key: int(key.partition(':')[2] or 0))]
+
+
+class KryxTableExtractor(KryxExtractor.KryxEtractor):
+    """KryxTableExtractor
+            Extracts one entity table of Kryx's website to a CSV dataset.
+            Takes every keyword argument of KryxEtractor as well.
+
+            Args:
+                None
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | schema              |   str,TableSchema     |   Schema of the table, or the name of one in SCHEMAS |
+                | csv_subdir          |   str                 |   Subdirectory the CSV datasets are written to |
+                | max_table_pages     |   int                 |   Maximum number of table pages followed through pagination |
+                | start_url           |   str                 |   URL of the table (defaults to the schema's) |
+                | url_replacer        |   str                 |   String to replace URL prefix (defaults to the schema's) |
+    """
+
+    def __init__(self,
+                 schema=DEFAULT_SCHEMA,
+                 csv_subdir=DEFAULT_CSV_SUBDIR,
+                 max_table_pages=DEFAULT_MAX_TABLE_PAGES,
+                 start_url=None,
+                 url_replacer=None,
+                 **kwargs
+                 ):
+        if isinstance(schema, str):
+            schema = SCHEMAS[schema]
+        self.schema = schema
+        self.csv_subdir = csv_subdir
+        self.max_table_pages = max_table_pages
+        super(KryxTableExtractor, self).__init__(start_url=start_url or self.schema.start_url,
+                                                 url_replacer=url_replacer or self.schema.url_replacer,
+                                                 **kwargs)
+
+    def logger_name(self):
+        return "KryxExtractor.%s" % self.schema.name
+
+    def _init_paths(self):
+        """Initialize the extraction paths. i.e. create them if they don't exist
+            Args: None
+            Kwargs: None
+            Fields: logger, path, html_subdir, pdf_subdir, csv_subdir, url_replace, version
+            Output: None
+            External State: path, html_subdir, pdf_subdir and csv_subdir exist if they did not exist before
+        """
+        super(KryxTableExtractor, self)._init_paths()
+        os.makedirs(os.path.join(self.path, self.csv_subdir), exist_ok=True)
+
+    def expand_tables(self):
+        """Click every expand button of the table in a single script call.
+            Args: None
+            Kwargs: None
+            Fields: schema, selenium_driver, js_wait_interval
+            Output: count (int) - number of buttons clicked
+            External State: detail rows of the table shown
+        """
+        if self.schema.expand_selector is None:
+            return 0
+        count = self.selenium_driver.execute_script(EXPAND_SCRIPT, self.schema.expand_selector, self.schema.expand_skip)
+        if count > 0:
+            time.sleep(self.js_wait_interval)
+        return count
+
+    def grab_tables(self):
+        """Expand and capture every page of the table, following the pagination.
+            Args: None
+            Kwargs: None
+            Fields: schema, selenium_driver, js_wait_interval, max_table_pages, logger
+            Output: states (dict[str:str]) - expanded source of each table page, keyed 'tables', 'tables:1', ...
+            External State: selenium driver on the last table page
+        """
+        states = dict()
+        for n in range(self.max_table_pages):
+            count = self.expand_tables()
+            states['tables' if n == 0 else 'tables:%d' % n] = self.selenium_driver.page_source
+            self.logger.vvdebug("Expanded %d rows on table page %d" % (count, n + 1))
+            if self.schema.next_selector is None:
+                break
+            if not self.selenium_driver.execute_script(NEXT_PAGE_SCRIPT, self.schema.next_selector):
+                break
+            time.sleep(self.js_wait_interval)
+        return states
+
+    def export_page_from_url(self, url, follow_links=True):
+        """Exports the dataset of the table on a URL.
+
+            Args: url (str) -   the url to export from
+            Kwargs: follow_links (bool) - unused, table pages are never crawled further
+            Fields: logger
+            Output: html_source, the final html source which is output
+                    new_links, links extracted prior to cleaning
+            External State: exported CSV file exists, selenium driver on URL
+        """
+        self.pages.add(url)
+        start = timeit.default_timer()
+        self._navigate(url)
+        html_source = self.selenium_driver.page_source
+        self.logger.vvdebug("Took %f seconds to navigate to page" % (timeit.default_timer()-start))
+        start = timeit.default_timer()
+        states = self.grab_tables()
+        self.logger.vvdebug("Took %f seconds to expand %d table pages" % (timeit.default_timer()-start, len(states)))
+        if self.cache_pages:
+            self.page_cache.save(url, html_source, states=states)
+        self.render_page(url, html_source, states=states)
+        return html_source, []
+
+    def parse_table(self, html_source):
+        return parse_tables([html_source], self.schema)
+
+    def render_page(self, url, html_source, states=None):
+        """Parse the expanded table pages of a page and write them to CSV. Needs no browser.
+
+            Args: url (str) -   the url of the page
+                  html_source (str) - the raw page source
+            Kwargs: states (dict[str:str]) - extra page sources, the 'tables' states hold the expanded table pages
+            Fields: logger, schema, streaming
+            Output: html_source, the raw html source
+            External State: exported CSV file exists, record flushed to the page journal in streaming mode
+        """
+        sources = table_states(states or dict()) or [html_source]
+        filename_csv = self.make_output_filename(url, 'csv')
+        start = timeit.default_timer()
+        table = parse_tables(sources, self.schema)
+        self.logger.vvdebug("Took %f seconds to parse %d %s" % (timeit.default_timer()-start, len(table), self.schema.name))
+        start = timeit.default_timer()
+        with open(filename_csv, 'w', encoding='utf-8') as file:
+            table.to_csv(file, sep=",", float_format='%.2f', index=False, line_terminator='\n', encoding='utf-8')
+        self.logger.vvdebug("Took %f seconds write CSV" % (timeit.default_timer()-start))
+        if self.streaming:
+            self.stream_page(self.pages.add(url))
+        return html_source
+
+    def make_output_filename(self, url, filetype):
+        """Create an output filename for a given filetype.
+            Only CSV is supported, output with the slugified URL.
+
+            Args: url   (str)   - the url to convert to a filename
+                  filetype (str)    - 'csv' the filetype to create for
+            Kwargs: None
+            Fields: start_url, url_replace, url_sep_char, path, csv_subdir
+            External State: No change
+        """
+        prefix = url.replace(self.start_url, self.url_replacer)
+        filename_prefix = prefix.replace(self.url_sep_char, '_')
+        filename_prefix = re.sub(r'[^\w.-]+', '_', filename_prefix)
+        filenames = dict(
+            csv=os.path.join(self.path, self.csv_subdir, "%s.csv" % filename_prefix)
+        )
+        if filetype.lower() not in filenames.keys():
+            raise ValueError("Export filetype %s is not supported" % filetype)
+        return filenames.get(filetype.lower())
+
+    def run(self):
+        if self.replay:
+            self.replay_from_cache()
+        else:
+            self.crawl()
+
+
+def _extract_entity(name, kwargs):
+    extractor = KryxTableExtractor(schema=name, **kwargs)
+    extractor.run()
+    return extractor.make_output_filename(extractor.start_url, 'csv')
+
+
+def extract_entities(names=None, max_workers=DEFAULT_MAX_WORKERS, **kwargs):
+    """Extract several entity tables at once, each with its own browser and logger. The
+        site version is looked up once, before any extractor starts, and shared by every
+        extractor; a ValueError is raised if it cannot be found.
+        Args: None
+        Kwargs: names (list[str]) - names of the schemas to extract, all of SCHEMAS if None
+                max_workers (int) - number of entities extracted at once
+                keyword arguments for every KryxTableExtractor
+        Output: outputs (dict[str:str]) - path of the CSV dataset of each entity
+        External State: CSV datasets exist
+    """
+    if names is None:
+        names = list(SCHEMAS.keys())
+    if kwargs.get('version') is None and not kwargs.get('replay', False):
+        changelog_url = kwargs.get('changelog_url', KryxExtractor.DEFAULT_CHANGELOG_URL)
+        try:
+            kwargs['version'] = KryxWatch.fetch_version(changelog_url)
+        except (urllib.error.URLError, OSError, ValueError) as ex:
+            raise ValueError("Could not look up the site version from %s (%s), pass version" % (changelog_url, ex))
+        if kwargs['version'] is None:
+            raise ValueError("No version found in %s, pass version" % changelog_url)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {name: executor.submit(_extract_entity, name, kwargs) for name in names}
+        return {name: future.result() for name, future in futures.items()}
+
+
+if __name__ == '__main__':
+    print(extract_entities(sys.argv[1:] or None))
@@ -0,0 +1,254 @@
+"""
+KryxUrls - URL scoping and canonicalization helpers for the KryxExtractor crawler
+
+Scope rules are strings of one of three kinds, all matched from the start of the URL:
+    * "re:<regex>"      - a regular expression
+    * "glob:<pattern>"  - a shell-style glob (rules containing *, ? or [ are globs too)
+    * "<prefix>"        - a URL prefix, matched on a path boundary, so that
+                          "/5e/monsters" matches "/5e/monsters/goblin" but not "/5e/monstersX"
+Every include and exclude list is compiled into a single regular expression.
+
+Canonical URLs have a lowercase scheme and host, no default port, no empty, "." or ".."
+path segments, no trailing slash, no fragment, and a sorted query string with tracking
+parameters removed. Relative links are resolved against the URL of the page they are on.
+"""
+import re
+import fnmatch
+import urllib.parse
+
+SCOPE_REGEX_PREFIX = 're:'          # Prefix marking a scope rule as a regular expression
+SCOPE_GLOB_PREFIX = 'glob:'         # Prefix marking a scope rule as a glob
+SCOPE_GLOB_CHARS = '*?['            # Characters which mark an unprefixed rule as a glob
+DEFAULT_TRACKING_PARAMS = [         # Query parameters (globs) which are stripped from canonical URLs, only
+    'utm_*',                        # unambiguous trackers, since stripping a real parameter merges distinct pages
+    'fbclid',
+    'gclid',
+    'dclid',
+    'msclkid',
+    'mc_cid',
+    'mc_eid',
+]
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def compile_url_rule(rule):
+    """Translate a single scope rule into regular expression source.
+        Args: rule (str) - the scope rule to translate
+        Kwargs: None
+        Output: pattern (str) - regular expression source matching the rule
+        External State: No change
+    """
+    if rule.startswith(SCOPE_REGEX_PREFIX):
+        return rule[len(SCOPE_REGEX_PREFIX):]
+    if rule.startswith(SCOPE_GLOB_PREFIX):
+        return fnmatch.translate(rule[len(SCOPE_GLOB_PREFIX):])
+    if any(char in rule for char in SCOPE_GLOB_CHARS):
+        return fnmatch.translate(rule)
+    return r'%s(?:[/?#]|$)' % re.escape(rule.rstrip('/'))
+
+
+def compile_url_rules(rules):
+    """Compile a list of scope rules into a single matcher.
+        Args: rules (list[str]) - the scope rules to compile
+        Kwargs: None
+        Output: matcher (re.Pattern or None) - compiled alternation of all rules, None if there are no rules
+        External State: No change
+    """
+    if not rules:
+        return None
+    return re.compile('|'.join('(?:%s)' % compile_url_rule(rule) for rule in rules))
+
+
+class UrlScope:
+    """UrlScope
+            Include/exclude rules and crawl limits which restrict a crawl to part of the site.
+
+            Args:
+                None
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | include_urls        |   list[str]           |   Scope rules a URL must match to be crawled (all URLs if empty) |
+                | exclude_urls        |   list[str]           |   Scope rules which stop a URL from being crawled |
+                | max_depth           |   int                 |   Maximum number of links followed from the start URL |
+                | max_pages           |   int                 |   Maximum number of pages to export |
+    """
+
+    def __init__(self,
+                 include_urls=None,
+                 exclude_urls=None,
+                 max_depth=None,
+                 max_pages=None,
+                 ):
+        self.include_urls = list(include_urls or [])
+        self.exclude_urls = list(exclude_urls or [])
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self._include = compile_url_rules(self.include_urls)
+        self._exclude = compile_url_rules(self.exclude_urls)
+
+    def in_scope(self, *urls):
+        """Check if a URL is in scope. Several spellings of the same URL (e.g. the
+                relative reference and the full URL) may be given; the URL is in scope
+                if none of them is excluded and, when include rules exist, any of them is included.
+
+            Args: urls (str) - spellings of the URL to check, None values are skipped
+            Kwargs: None
+            Output: valid (bool) - is the URL in scope
+            External State: No change
+        """
+        urls = [url for url in urls if url]
+        if self._exclude is not None and any(self._exclude.match(url) for url in urls):
+            return False
+        if self._include is None:
+            return True
+        return any(self._include.match(url) for url in urls)
+
+    def depth_allowed(self, depth):
+        """Check if a page at the given link depth may be crawled.
+            Args: depth (int) - number of links followed from the start URL
+            Kwargs: None
+            Output: valid (bool) - is the depth within max_depth
+            External State: No change
+        """
+        return self.max_depth is None or depth <= self.max_depth
+
+    def pages_allowed(self, count):
+        """Check if another page may be added when count pages are already planned or exported.
+            Args: count (int) - number of pages already planned or exported
+            Kwargs: None
+            Output: valid (bool) - is there room for another page within max_pages
+            External State: No change
+        """
+        return self.max_pages is None or count < self.max_pages
+
+
+def canonicalize_url(url, base_url=None, tracking_params=DEFAULT_TRACKING_PARAMS):
+    """Normalize a URL so that different spellings of the same page compare equal.
+        Args: url (str) - the url to canonicalize, absolute or relative
+        Kwargs: base_url (str) - url to resolve relative urls against
+                tracking_params (list[str]) - query parameter globs to strip
+        Output: canonical (str) - the canonical url
+        External State: No change
+    """
+    if base_url is not None:
+        url = urllib.parse.urljoin(base_url, url.strip())
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS:
+        return urllib.parse.urlunsplit((scheme, parts.netloc, parts.path, parts.query, ''))
+    netloc = (parts.hostname or '').rstrip('.')
+    if parts.port is not None and parts.port != DEFAULT_PORTS[scheme]:
+        netloc = '%s:%d' % (netloc, parts.port)
+    segments = []
+    for segment in parts.path.split('/'):
+        if segment in ('', '.'):
+            continue
+        if segment == '..':
+            if segments:
+                segments.pop()
+            continue
+        segments.append(segment)
+    path = '/' + '/'.join(segments)
+    query = [(key, value) for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+             if not any(fnmatch.fnmatchcase(key.lower(), param) for param in tracking_params)]
+    query = urllib.parse.urlencode(sorted(query))
+    return urllib.parse.urlunsplit((scheme, netloc, path, query, ''))
+
+
+def relative_url(url):
+    """Strip the scheme and host from a url, leaving the path and query string.
+        Args: url (str) - the url to strip
+        Kwargs: None
+        Output: relative (str) - the path and query string of the url
+        External State: No change
+    """
+    parts = urllib.parse.urlsplit(url)
+    if parts.query:
+        return '%s?%s' % (parts.path, parts.query)
+    return parts.path
+
+
+def same_site(url, site_url):
+    """Check if a url is an http(s) url on the same host as the site.
+        Args: url (str) - the canonical url to check
+              site_url (str) - any canonical url on the site
+        Kwargs: None
+        Output: valid (bool) - is the url on the site
+        External State: No change
+    """
+    parts = urllib.parse.urlsplit(url)
+    return parts.scheme in DEFAULT_PORTS and parts.netloc == urllib.parse.urlsplit(site_url).netloc
+
+
+class CanonicalUrlIndex:
+    """CanonicalUrlIndex
+            Set of canonical URLs with constant time membership checks. Each canonical URL
+            maps to the first spelling it was added under.
+
+            Args:
+                None
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | urls                |   list[str]           |   URLs to add to the index |
+                | base_url            |   str                 |   URL to resolve relative URLs against |
+                | tracking_params     |   list[str]           |   Query parameter globs to strip |
+    """
+
+    def __init__(self,
+                 urls=None,
+                 base_url=None,
+                 tracking_params=DEFAULT_TRACKING_PARAMS,
+                 ):
+        self.base_url = base_url
+        self.tracking_params = tracking_params
+        self.urls = dict()
+        self.update(urls or [])
+
+    def canonical(self, url, base_url=None):
+        """Canonicalize a url with the index's settings.
+            Args: url (str) - the url to canonicalize
+            Kwargs: base_url (str) - url to resolve relative urls against, defaults to the index's base_url
+            Output: canonical (str) - the canonical url
+            External State: No change
+        """
+        if base_url is None:
+            base_url = self.base_url
+        return canonicalize_url(url, base_url=base_url, tracking_params=self.tracking_params)
+
+    def add(self, url):
+        """Add a url to the index.
+            Args: url (str) - the url to add
+            Kwargs: None
+            Output: canonical (str) - the canonical url which was added
+            External State: url is in the index
+        """
+        canonical = self.canonical(url)
+        self.urls.setdefault(canonical, url)
+        return canonical
+
+    def update(self, urls):
+        """Add several urls to the index.
+            Args: urls (list[str]) - the urls to add
+            Kwargs: None
+            Output: None
+            External State: all urls are in the index
+        """
+        for url in urls:
+            self.add(url)
+
+    def discard(self, url):
+        """Remove a url from the index, if it is in it.
+            Args: url (str) - the url to remove
+            Kwargs: None
+            Output: None
+            External State: url is not in the index
+        """
+        self.urls.pop(self.canonical(url), None)
+
+    def __contains__(self, url):
+        return url is not None and self.canonical(url) in self.urls
+
+    def __len__(self):
+        return len(self.urls)
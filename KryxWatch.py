@@ -0,0 +1,245 @@
+"""
+KryxWatch - Cheap polling of the site's changelog for new versions
+
+Finding the latest version used to mean opening the changelog in Firefox and looking for
+a styled-components class name which changes whenever the site is rebuilt. The watcher
+polls the changelog over plain HTTP instead, sending the ETag and Last-Modified of the
+previous response so an unchanged page costs a single 304. Only when the page changes is
+the version extracted again: first from the changelog headings, and, since the changelog
+is rendered client-side, from the JavaScript bundle if the page itself has no version.
+
+When the version changes the watcher runs an incremental rebuild: the new version is
+crawled with the previous version's page manifest at hand, and pages whose cleaned HTML
+did not change reuse the PDF of the previous version instead of being rendered again.
+
+    python KryxWatch.py --interval 3600
+"""
+import os
+import re
+import json
+import time
+import logging
+import argparse
+import email.utils
+import urllib.error
+import urllib.request
+import KryxRoutes
+import KryxCache
+
+DEFAULT_INTERVAL = 3600                     # Seconds between two polls of the changelog
+DEFAULT_TIMEOUT = 10                        # Seconds to wait for each HTTP request
+DEFAULT_STATE_FILE = 'KRYX_watch.json'      # File keeping the validators and version of the last poll
+VERSION_REGEX = re.compile(r'\bv?(\d+\.\d+(?:\.\d+)*)\b')
+HEADING_REGEX = re.compile(r'<h[1-3][^>]*>(.*?)</h[1-3]>', re.DOTALL | re.IGNORECASE)
+SCRIPT_VERSION_REGEX = re.compile(r'version["\']?\s*[:=,]\s*["\']v?(\d+\.\d+(?:\.\d+)*)["\']', re.IGNORECASE)
+TAG_REGEX = re.compile(r'<[^>]+>')
+LOGGER = logging.getLogger("KryxWatch")
+
+
+def version_key(version):
+    return tuple(int(part) for part in version.split('.'))
+
+
+def extract_version(html_source):
+    """Extract the latest version from the changelog page. The changelog lists versions
+        newest first as headings, so the first heading holding a version number wins.
+        Args: html_source (str) - html of the changelog page
+        Kwargs: None
+        Output: version (str or None) - the latest version, None if no heading has one
+        External State: No change
+    """
+    for heading in HEADING_REGEX.findall(html_source):
+        match = VERSION_REGEX.search(TAG_REGEX.sub(' ', heading))
+        if match is not None:
+            return match.group(1)
+    return None
+
+
+def extract_script_version(js_source):
+    """Extract the highest version assigned to a "version" key in a JavaScript bundle.
+        Args: js_source (str) - the javascript source
+        Kwargs: None
+        Output: version (str or None) - the highest version found, None if there is none
+        External State: No change
+    """
+    versions = SCRIPT_VERSION_REGEX.findall(js_source)
+    if len(versions) == 0:
+        return None
+    return max(versions, key=version_key)
+
+
+def fetch_version(changelog_url, html_source=None, timeout=DEFAULT_TIMEOUT):
+    """Find the latest version of the site over plain HTTP, from the changelog headings
+        or, if the changelog is only rendered client-side, from its JavaScript bundle.
+        Args: changelog_url (str) - url of the changelog page
+        Kwargs: html_source (str) - html of the changelog page, if it was already fetched
+                timeout (int,float) - seconds to wait for each HTTP request
+        Output: version (str or None) - the latest version, None if none was found
+        External State: No change
+    """
+    if html_source is None:
+        html_source = KryxRoutes.fetch_text(changelog_url, timeout=timeout)
+    version = extract_version(html_source)
+    if version is not None:
+        return version
+    versions = []
+    for script_url in KryxRoutes.find_script_urls(html_source, changelog_url):
+        js_source = KryxRoutes.fetch_text(script_url, timeout=timeout)
+        script_urls = [script_url] + KryxRoutes.find_chunk_urls(js_source, script_url)
+        for n, chunk_url in enumerate(script_urls):
+            if n > 0:
+                js_source = KryxRoutes.fetch_text(chunk_url, timeout=timeout)
+            version = extract_script_version(js_source)
+            if version is not None:
+                versions.append(version)
+    if len(versions) == 0:
+        return None
+    return max(versions, key=version_key)
+
+
+class VersionWatcher:
+    """VersionWatcher
+            Polls the changelog with conditional requests and reports version changes.
+            The validators and version of the last poll, and the last version which was
+            rebuilt successfully, are kept in a JSON state file, so restarting the watcher
+            does not trigger a rebuild, but a rebuild which failed is tried again.
+
+            Args:
+                changelog_url (str) -   Url of the changelog page
+            Kwargs:
+                | **NAME**            |   **TYPE**        |   **DESCRIPTION** |
+                | -------------------- |:-----------------------:| -------------------:|
+                | state_file          |   str                 |   File keeping the validators and version of the last poll |
+                | timeout             |   int,float           |   Seconds to wait for each HTTP request |
+    """
+
+    def __init__(self,
+                 changelog_url,
+                 state_file=DEFAULT_STATE_FILE,
+                 timeout=DEFAULT_TIMEOUT,
+                 ):
+        self.changelog_url = changelog_url
+        self.state_file = state_file
+        self.timeout = timeout
+        self.state = dict(etag=None, last_modified=None, version=None, built_version=None, checked=None)
+        if os.path.exists(self.state_file):
+            with open(self.state_file, 'r', encoding='utf-8') as file:
+                state = json.load(file)
+            state.setdefault('built_version', state.get('version'))     # state files written before built_version
+            self.state.update(state)
+
+    def _save_state(self):
+        KryxCache.write_atomic(self.state_file, json.dumps(self.state, indent=2).encode('utf-8'))
+
+    def _fetch_if_changed(self):
+        """Fetch the changelog unless it is unchanged since the last poll.
+            Args: None
+            Kwargs: None
+            Output: html_source (str or None) - the changelog page, None if it is unchanged
+                    validators (dict[str:str]) - ETag and Last-Modified of the response, to store once
+                                                 a version was extracted from it
+            External State: No change
+        """
+        headers = {'User-Agent': KryxRoutes.DEFAULT_USER_AGENT}
+        if self.state['etag'] is not None:
+            headers['If-None-Match'] = self.state['etag']
+        if self.state['last_modified'] is not None:
+            headers['If-Modified-Since'] = self.state['last_modified']
+        request = urllib.request.Request(self.changelog_url, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                charset = response.headers.get_content_charset() or 'utf-8'
+                html_source = response.read().decode(charset, errors='replace')
+                return html_source, dict(etag=response.headers.get('ETag'),
+                                         last_modified=response.headers.get('Last-Modified'))
+        except urllib.error.HTTPError as ex:
+            if ex.code == 304:
+                return None, dict()
+            raise
+
+    def check(self):
+        """Poll the changelog once. The validators of the response are only kept if a
+            version could be extracted from it, so a page without one is fetched again.
+            Args: None
+            Kwargs: None
+            Output: version (str or None) - the latest known version
+                    changed (bool) - whether the version differs from the last version rebuilt
+            External State: state file updated
+        """
+        html_source, validators = self._fetch_if_changed()
+        self.state['checked'] = email.utils.formatdate(usegmt=True)
+        if html_source is not None:
+            version = fetch_version(self.changelog_url, html_source=html_source, timeout=self.timeout)
+            if version is not None:
+                self.state['version'] = version
+                self.state.update(validators)
+        self._save_state()
+        version = self.state['version']
+        return version, version is not None and version != self.state['built_version']
+
+    def mark_built(self, version):
+        """Record that a version was rebuilt successfully.
+            Args: version (str) - the version
+            Kwargs: None
+            Output: None
+            External State: state file updated
+        """
+        self.state['built_version'] = version
+        self._save_state()
+
+    def watch(self, on_change, interval=DEFAULT_INTERVAL, max_checks=None):
+        """Poll the changelog forever (or max_checks times), calling on_change with the
+            last version rebuilt and the new version whenever they differ. A version only
+            counts as rebuilt once on_change returns, so a failed rebuild is logged and
+            tried again at the next poll.
+            Args: on_change (function) - called as on_change(previous_version, version)
+            Kwargs: interval (int,float) - seconds between two polls
+                    max_checks (int) - stop after this many polls, poll forever if None
+            Output: None
+            External State: on_change run for every version change
+        """
+        checks = 0
+        while max_checks is None or checks < max_checks:
+            try:
+                version, changed = self.check()
+            except (urllib.error.URLError, OSError) as ex:
+                LOGGER.warning("Could not poll %s: %s" % (self.changelog_url, ex))
+                version, changed = self.state['version'], False
+            if changed:
+                try:
+                    on_change(self.state['built_version'], version)
+                    self.mark_built(version)
+                except Exception:
+                    LOGGER.exception("Rebuild of version %s failed, retrying at the next poll" % version)
+            checks += 1
+            if max_checks is None or checks < max_checks:
+                time.sleep(interval)
+
+
+def rebuild(previous_version, version, **kwargs):
+    """Export a new version of the site, reusing the PDFs of pages which did not change
+        since the previous version.
+        Args: previous_version (str or None) - the last exported version
+              version (str) - the version to export
+        Kwargs: keyword arguments for KryxEtractor
+        Output: None
+        External State: compiled PDF of the new version exists
+    """
+    import KryxExtractor
+    extractor = KryxExtractor.KryxEtractor(version=version, reuse_version=previous_version, **kwargs)
+    extractor.run()
+
+
+if __name__ == '__main__':
+    import KryxExtractor
+    parser = argparse.ArgumentParser(description="Rebuild the Kryx PDF whenever a new version is released")
+    parser.add_argument('--changelog-url', default=KryxExtractor.DEFAULT_CHANGELOG_URL)
+    parser.add_argument('--state-file', default=DEFAULT_STATE_FILE)
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL)
+    parser.add_argument('--once', action='store_true', help="poll once and exit")
+    parser.add_argument('--export-dir', default=KryxExtractor.DEFAULT_EXPORT_DIR)
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    watcher = VersionWatcher(args.changelog_url, state_file=args.state_file)
+    watcher.watch(lambda previous, version: rebuild(previous, version, export_dir=args.export_dir),
+                  interval=args.interval, max_checks=1 if args.once else None)
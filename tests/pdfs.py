@@ -0,0 +1,42 @@
+"""Small hand-written PDFs for the PDF tests: one page each, with the text given, a
+Helvetica font with an embedded font file, an image, and optionally URI links."""
+
+FONT_FILE = bytes(range(256)) * 16
+IMAGE = bytes((x * 7 + y * 13) % 256 for y in range(32) for x in range(96))
+
+
+def _stream(data, entries=''):
+    return b'<< /Length %d %s>>\nstream\n' % (len(data), entries.encode('ascii')) + data + b'\nendstream'
+
+
+def make_pdf(path, text, links=(), font_file=FONT_FILE, image=IMAGE):
+    """Write a one page PDF showing text and an image, with a link annotation to each of links."""
+    content = b'BT /F1 24 Tf 72 720 Td (%s) Tj ET q 32 0 0 32 72 600 cm /Im1 Do Q' % text.encode('ascii')
+    annots = ' '.join('%d 0 R' % (9 + i) for i in range(len(links)))
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        ('<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R '
+         '/Resources << /Font << /F1 5 0 R >> /XObject << /Im1 7 0 R >> >> /Annots [%s] >>' % annots).encode('ascii'),
+        _stream(content),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /FontDescriptor 6 0 R >>',
+        b'<< /Type /FontDescriptor /FontName /Helvetica /Flags 32 /FontBBox [0 0 1000 1000] '
+        b'/ItalicAngle 0 /Ascent 718 /Descent -207 /CapHeight 718 /StemV 88 /FontFile 8 0 R >>',
+        _stream(image, '/Type /XObject /Subtype /Image /Width 32 /Height 32 /ColorSpace /DeviceRGB /BitsPerComponent 8 '),
+        _stream(font_file, '/Length1 %d ' % len(font_file)),
+    ]
+    for i, uri in enumerate(links):
+        objects.append(('<< /Type /Annot /Subtype /Link /Rect [72 %d 300 %d] /Border [0 0 0] '
+                        '/A << /S /URI /URI (%s) >> >>' % (500 - 30 * i, 520 - 30 * i, uri)).encode('ascii'))
+    data = b'%PDF-1.4\n'
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += b'%d 0 obj\n' % number + obj + b'\nendobj\n'
+    xref = len(data)
+    data += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    data += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    data += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    with open(path, 'wb') as file:
+        file.write(data)
+    return path
@@ -0,0 +1,35 @@
+import os
+import KryxBackfill
+
+
+def touch(path, mtime):
+    with open(path, 'w') as file:
+        file.write('x')
+    os.utime(path, (mtime, mtime))
+
+
+def test_discover_versions(tmp_path):
+    for name in ['KRYX_v1.10', 'KRYX_v1.9', 'KRYX_SPELLS_v1.9', 'KRYX_cache', 'other_v1.0']:
+        os.makedirs(str(tmp_path / name))
+    touch(str(tmp_path / 'KRYX_v2.0'), 1000)
+    versions = KryxBackfill.discover_versions(str(tmp_path))
+    assert list(versions) == ['1.9', '1.10']
+    assert versions['1.9'] == {'site': str(tmp_path / 'KRYX_v1.9'), 'spells': str(tmp_path / 'KRYX_SPELLS_v1.9')}
+    assert versions['1.10'] == {'site': str(tmp_path / 'KRYX_v1.10')}
+
+
+def test_is_current(tmp_path):
+    version_dir = tmp_path / 'KRYX_v1.9'
+    os.makedirs(str(version_dir))
+    touch(str(version_dir / 'page_0.pdf'), 1000)
+    touch(str(tmp_path / 'pages.json'), 1500)
+    os.utime(str(version_dir), (1000, 1000))
+    output = str(tmp_path / 'compiled.pdf')
+    inputs = [str(version_dir), str(tmp_path / 'pages.json'), str(tmp_path / 'missing.json')]
+    assert not KryxBackfill.is_current(output, inputs)
+    touch(output, 2000)
+    assert KryxBackfill.is_current(output, inputs)
+    touch(str(version_dir / 'page_1.pdf'), 3000)
+    os.utime(str(version_dir), (1000, 1000))
+    assert not KryxBackfill.is_current(output, inputs)
+    assert KryxBackfill.is_current(output, [str(tmp_path / 'pages.json')])
@@ -0,0 +1,81 @@
+import base64
+import zipfile
+import xml.etree.ElementTree as ElementTree
+import KryxBook
+
+SITE = 'https://marklenser.com'
+XHTML = '{http://www.w3.org/1999/xhtml}'
+PIXEL = base64.b64encode(b'\x89PNG fake pixel').decode('ascii')
+
+PAGES = [
+    ('page-0', 'Spells', SITE + '/5e/spells',
+     '<html><head><style>p { margin: 0 }</style></head><body>'
+     '<h1 class="title main">Spells&nbsp;&amp; Magic &copy;</h1>'
+     '<p>Cast <a href="' + SITE + '/5e/spells/fireball#higher-levels">Fireball</a><br>or '
+     '<a href="' + SITE + '/5e/spells/wish">Wish</a>, see <a href="https://example.com/?a=1&b=2">elsewhere</a>'
+     ' or <a href="#top">top</a>'
+     '<p>Level <input type=checkbox disabled> 3 < 4 <img src="data:image/png;base64,' + PIXEL + '" alt=Pixel>'
+     '<!-- comment -- here --><hr>'
+     '<svg viewBox="0 0 10 10"><circle r="5"></circle></svg>'
+     '<div @click="open" :class="x">Menu</div>'
+     '</body></html>'),
+    ('page-1', 'Fireball', SITE + '/5e/spells/fireball',
+     '<html><body><h1 id="top">Fireball</h1><p>Back to <a href="' + SITE + '/5e/spells">spells</a>'
+     '<img src="data:image/png;base64,' + PIXEL + '"></body></html>'),
+]
+
+
+def write_book(writer):
+    for key, title, url, html_source in PAGES:
+        writer.add_page(key, title, html_source, parent='page-0' if key != 'page-0' else None, url=url)
+    writer.add_alias('page-2', 'Fireball (copy)', 'page-1', url=SITE + '/5e/spells/fire-ball')
+    writer.close()
+
+
+def test_epub_documents_are_well_formed_xhtml(tmp_path):
+    filename = str(tmp_path / 'book.epub')
+    write_book(KryxBook.EpubWriter(filename, 'Kryx <5e>', site_url=SITE, identifier='urn:uuid:test'))
+    with zipfile.ZipFile(filename) as archive:
+        names = archive.namelist()
+        assert names[0] == 'mimetype'
+        documents = [name for name in names if name.endswith('.xhtml')]
+        assert sorted(documents) == ['OEBPS/nav.xhtml', 'OEBPS/page-0.xhtml', 'OEBPS/page-1.xhtml']
+        trees = {name: ElementTree.fromstring(archive.read(name)) for name in documents}
+        ElementTree.fromstring(archive.read('OEBPS/content.opf'))
+        images = [name for name in names if name.startswith('OEBPS/images/')]
+        assert len(images) == 1
+    assert not (tmp_path / 'book.epub.parts').exists()
+    page = trees['OEBPS/page-0.xhtml']
+    links = [anchor.get('href') for anchor in page.iter(XHTML + 'a')]
+    assert links == ['page-1.xhtml', SITE + '/5e/spells/wish', 'https://example.com/?a=1&b=2', '#top']
+    heading = page.find('.//%sh1' % XHTML)
+    assert heading.text == 'Spells\xa0& Magic \xa9' and heading.get('class') == 'title main'
+    checkbox = page.find('.//%sinput' % XHTML)
+    assert checkbox.get('type') == 'checkbox' and 'disabled' in checkbox.attrib
+    assert page.find('.//%simg' % XHTML).get('src') == images[0][len('OEBPS/'):]
+    assert page.find('.//{http://www.w3.org/2000/svg}circle') is not None
+    assert [div.text for div in page.iter(XHTML + 'div')] == ['Menu']
+    assert [anchor.get('href') for anchor in trees['OEBPS/page-1.xhtml'].iter(XHTML + 'a')] == ['page-0.xhtml']
+    nav = [anchor.get('href') for anchor in trees['OEBPS/nav.xhtml'].iter(XHTML + 'a')]
+    assert nav == ['page-0.xhtml', 'page-1.xhtml', 'page-1.xhtml']
+    assert trees['OEBPS/page-0.xhtml'].find('.//%stitle' % XHTML).text == 'Spells'
+
+
+def test_html_book_links_point_at_sections(tmp_path):
+    filename = str(tmp_path / 'book.html')
+    writer = KryxBook.HtmlBookWriter(filename, 'Kryx', site_url=SITE)
+    write_book(writer)
+    with open(filename, encoding='utf-8') as file:
+        book = file.read()
+    assert '<a href="#page-1">Fireball</a>' in book and '<a href="#page-0">spells</a>' in book
+    assert '<a href="%s/5e/spells/wish">' % SITE in book
+    assert 'kryx-link' not in book
+    assert not (tmp_path / 'book.html.part').exists()
+
+
+def test_links_are_left_alone_without_site_url(tmp_path):
+    filename = str(tmp_path / 'book.epub')
+    write_book(KryxBook.EpubWriter(filename, 'Kryx'))
+    with zipfile.ZipFile(filename) as archive:
+        page = ElementTree.fromstring(archive.read('OEBPS/page-1.xhtml'))
+    assert [anchor.get('href') for anchor in page.iter(XHTML + 'a')] == [SITE + '/5e/spells']
@@ -0,0 +1,18 @@
+import os
+import KryxCache
+import KryxExtractor
+
+
+def test_no_cache_directory_without_caching(tmp_path):
+    KryxExtractor.KryxEtractor(version='1', export_dir=str(tmp_path), start_selenium=False, cache_pages=False)
+    assert not os.path.exists(os.path.join(str(tmp_path), 'KRYX_cache'))
+
+
+def test_cache_directory_created_on_save(tmp_path):
+    cache = KryxCache.PageSourceCache(str(tmp_path / 'cache'), '1')
+    assert cache.load('https://marklenser.com/5e') == (None, dict())
+    assert cache.load_json('stored_css', dict()) == dict()
+    cache.save('https://marklenser.com/5e', '<html></html>')
+    cache.save_json('stored_css', dict(h1='h1 { } '))
+    assert cache.load('https://marklenser.com/5e')[0] == '<html></html>'
+    assert cache.load_json('stored_css') == dict(h1='h1 { } ')
@@ -0,0 +1,46 @@
+import os
+import concurrent.futures
+import KryxCss
+import KryxClean
+import KryxExtractor
+
+SITE = 'https://marklenser.com'
+
+
+def make_page(n):
+    return ('<html><head><script>var x = 1;</script></head><body><header>Menu</header>'
+            '<h1>Page %d</h1><h2 class="card sc-page%d">Section &amp; more</h2>'
+            '<p>See <a href="/5e/page%d">next</a>, <a href="%s/5e/page%d?utm_source=nav#top">back</a>, '
+            '<a href="#notes">notes</a> or <a href="https://example.com/">elsewhere</a>.</p>'
+            '<img src="/static/media/pixel.png"><footer>Footer</footer></body></html>'
+            % (n, n, n + 1, SITE, max(n - 1, 0)))
+
+
+def test_process_pool_transform_matches_inline(tmp_path):
+    os.makedirs(str(tmp_path / 'static' / 'media'))
+    (tmp_path / 'static' / 'media' / 'pixel.png').write_bytes(b'\x89PNG fake pixel')
+    options = KryxClean.CleanOptions(remove_tags=['header', 'footer'], heading_tags=KryxExtractor.DEFAULT_HEADING_TAGS,
+                                     url_prefix=SITE, static_dir=str(tmp_path), tag_order=KryxExtractor.HTML_TAG_ORDER)
+    stylesheet = KryxCss.StyleSheet(['h1 { font-size: 20px } .card { color: red }'], properties=KryxExtractor.CSS_SELECTORS)
+    stored_css = {'sc-page%d' % n: '.sc-page%d { margin-top: %dpx; } ' % (n, n) for n in range(8)}
+    pages = [(make_page(n), '%s/5e/page%d' % (SITE, n)) for n in range(8)]
+    inline = [KryxClean.transform(html_source, url, options, stylesheet=stylesheet, stored_css=stored_css)
+              for html_source, url in pages]
+    cleaned, headings, links = inline[3]
+    assert 'Menu' not in cleaned and 'Footer' not in cleaned and 'var x' not in cleaned
+    assert headings == [[1, 'Page 3'], [2, 'Section & more']]
+    assert links == [SITE + '/5e/page4', SITE + '/5e/page2']
+    assert '.sc-page3 { margin-top: 3px; }' in cleaned and 'data:image/png;base64' in cleaned
+    with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(KryxClean.transform, html_source, url, options, stylesheet=stylesheet,
+                                   stored_css=stored_css) for html_source, url in pages]
+        assert [future.result() for future in futures] == inline
+    pool = KryxClean.CleanPool(options, stylesheet=stylesheet, max_workers=2)
+    try:
+        for n, (html_source, url) in enumerate(pages):
+            pool.submit(n, html_source, url, stored_css=stored_css)
+        results = list(pool.results(wait=True))
+    finally:
+        pool.close()
+    assert [result[0] for result in results] == list(range(8))
+    assert [tuple(result[1:4]) for result in results] == inline
@@ -0,0 +1,18 @@
+import KryxCss
+import KryxClean
+import KryxExtractor
+
+PAGE = ('<html><head></head><body><div class="card sc-bdVaJa">x</div>'
+        '<p class="other">y</p></body></html>')
+
+
+def test_runtime_classes_keep_captured_css():
+    stylesheet = KryxCss.StyleSheet([".card { color: red } .other:hover { color: blue }"],
+                                    properties=KryxExtractor.CSS_SELECTORS)
+    assert stylesheet.unstyled_classes(KryxClean.page_classes(PAGE)) == ['sc-bdVaJa']
+    stored_css = {'sc-bdVaJa': '.sc-bdVaJa { margin-top: 4px; } ', 'card': '.card { color: green; } '}
+    options = KryxClean.CleanOptions(static_dir='.', tag_order=KryxExtractor.HTML_TAG_ORDER)
+    cleaned, headings, links = KryxClean.transform(PAGE, None, options, stylesheet=stylesheet, stored_css=stored_css)
+    assert '.card { color: red; }' in cleaned
+    assert '.sc-bdVaJa { margin-top: 4px; }' in cleaned
+    assert 'color: green' not in cleaned
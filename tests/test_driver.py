@@ -0,0 +1,127 @@
+import pytest
+from selenium import webdriver
+import KryxDriver
+
+START_URL = 'https://marklenser.com/5e'
+
+
+class FakeFirefox:
+    """A browser whose health check, reset and navigation can be made to fail."""
+    started = []
+
+    def __init__(self):
+        self.urls = []
+        self.answers = True
+        self.resets = True
+        self.fail_get = 0
+        self.quit_called = False
+        FakeFirefox.started.append(self)
+
+    def set_window_position(self, x, y):
+        pass
+
+    def set_window_size(self, width, height):
+        pass
+
+    def get(self, url):
+        if self.fail_get > 0 and url != 'about:blank':
+            self.fail_get -= 1
+            raise RuntimeError('navigation failed')
+        self.urls.append(url)
+
+    def execute_script(self, script):
+        if script == KryxDriver.RESET_SCRIPT and not self.resets:
+            raise RuntimeError('session is gone')
+        if not self.answers:
+            raise RuntimeError('session is gone')
+        return 1
+
+    def quit(self):
+        self.quit_called = True
+
+
+@pytest.fixture
+def firefox(monkeypatch):
+    FakeFirefox.started = []
+    monkeypatch.setattr(webdriver, 'Firefox', FakeFirefox)
+    return FakeFirefox
+
+
+class Settings:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.applied = []
+
+    def __call__(self, driver):
+        if self.failures > 0:
+            self.failures -= 1
+            raise RuntimeError('toggle not found')
+        self.applied.append(driver)
+
+
+def test_settings_are_retried_until_they_apply(firefox):
+    settings = Settings(failures=1)
+    manager = KryxDriver.DriverManager(START_URL, on_start=settings)
+    driver = manager.ensure()
+    assert not manager.settings_applied and settings.applied == []
+    manager.get(START_URL + '/spells')
+    assert manager.settings_applied and settings.applied == [driver]
+    manager.get(START_URL + '/monsters')
+    assert settings.applied == [driver]
+    assert firefox.started == [driver] and driver.urls == [START_URL, START_URL + '/spells', START_URL + '/monsters']
+
+
+def test_healthy_session_is_kept(firefox):
+    settings = Settings()
+    manager = KryxDriver.DriverManager(START_URL, on_start=settings)
+    driver = manager.ensure()
+    assert manager.ensure() is driver and manager.resets == 0 and manager.restarts == 0
+    assert settings.applied == [driver]
+
+
+def test_failed_navigation_resets_a_live_session(firefox):
+    settings = Settings()
+    manager = KryxDriver.DriverManager(START_URL, on_start=settings)
+    driver = manager.ensure()
+    driver.fail_get = 1
+    assert manager.get(START_URL + '/spells') is driver
+    assert manager.resets == 1 and manager.restarts == 0
+    assert driver.urls[-2:] == ['about:blank', START_URL + '/spells']
+    assert settings.applied == [driver]
+
+
+def test_dead_session_is_restarted_with_settings(firefox):
+    settings = Settings()
+    manager = KryxDriver.DriverManager(START_URL, on_start=settings)
+    first = manager.ensure()
+    first.answers = False
+    second = manager.ensure()
+    assert second is not first and first.quit_called
+    assert manager.restarts == 1 and manager.resets == 0
+    assert settings.applied == [first, second]
+
+
+def test_failed_reset_escalates_to_restart(firefox):
+    settings = Settings()
+    manager = KryxDriver.DriverManager(START_URL, on_start=settings)
+    first = manager.ensure()
+    first.fail_get = 1
+    first.resets = False
+    second = manager.get(START_URL + '/spells')
+    assert second is not first and manager.restarts == 1 and manager.resets == 0
+    assert second.urls == [START_URL, START_URL + '/spells']
+    assert settings.applied == [first, second]
+
+
+def test_recycling_is_off_by_default_and_reapplies_settings(firefox):
+    assert KryxDriver.DEFAULT_RECYCLE_PAGES is None
+    settings = Settings()
+    manager = KryxDriver.DriverManager(START_URL, on_start=settings)
+    for n in range(5):
+        manager.get('%s/page%d' % (START_URL, n))
+    assert len(firefox.started) == 1
+    manager = KryxDriver.DriverManager(START_URL, on_start=settings, recycle_pages=2)
+    for n in range(5):
+        manager.get('%s/page%d' % (START_URL, n))
+    assert len(firefox.started) == 4 and manager.restarts == 2
+    assert settings.applied[-3:] == firefox.started[-3:]
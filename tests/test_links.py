@@ -0,0 +1,42 @@
+import io
+import pytest
+from PyPDF2 import PdfFileReader
+import KryxExtractor
+from pdfs import make_pdf
+
+SITE = 'https://marklenser.com'
+
+
+def link_actions(page):
+    return [annotation.getObject()['/A'] for annotation in page['/Annots']]
+
+
+@pytest.mark.parametrize('optimize_pdf', [True, False])
+def test_links_between_pages_become_named_destinations(tmp_path, optimize_pdf):
+    extractor = KryxExtractor.KryxEtractor(version='1', export_dir=str(tmp_path), start_selenium=False,
+                                           cache_pages=False, ignore_urls=[], optimize_pdf=optimize_pdf)
+    spells, fireball = SITE + '/5e/spells', SITE + '/5e/spells/fireball'
+    first = extractor.pages.add(spells)
+    second = extractor.pages.add(fireball)
+    first.pdf_path = make_pdf(str(tmp_path / 'spells.pdf'), 'Spells',
+                              links=[fireball, fireball + '?utm_source=menu', 'https://example.com/fireball', SITE + '/5e/wish'])
+    second.pdf_path = make_pdf(str(tmp_path / 'fireball.pdf'), 'Fireball', links=[spells])
+    extractor.pages.set_links(spells, [fireball, SITE + '/5e/wish'])
+    extractor.pages.set_links(fireball, [spells])
+    names, links = extractor.link_destinations()
+    assert links == [{fireball: names[1]}, {spells: names[0]}]
+    output = io.BytesIO()
+    extractor.pdf_cat([first.pdf_path, second.pdf_path], output, names=names, links=links)
+    reader = PdfFileReader(io.BytesIO(output.getvalue()))
+    assert reader.getNumPages() == 2
+    destinations = reader.getNamedDestinations()
+    assert set(destinations) == set(names)
+    assert reader.getDestinationPageNumber(destinations[names[1]]) == 1
+    actions = link_actions(reader.getPage(0))
+    assert [action['/S'] for action in actions] == ['/GoTo', '/GoTo', '/URI', '/URI']
+    assert actions[0]['/D'] == names[1] and actions[1]['/D'] == names[1]
+    assert actions[2]['/URI'] == 'https://example.com/fireball'
+    assert actions[3]['/URI'] == SITE + '/5e/wish'
+    back, = link_actions(reader.getPage(1))
+    assert back['/S'] == '/GoTo' and back['/D'] == names[0]
+    assert reader.getDestinationPageNumber(destinations[back['/D']]) == 0
@@ -0,0 +1,20 @@
+import KryxExtractor
+
+
+def make_extractor(tmp_path, urls):
+    extractor = KryxExtractor.KryxEtractor(version='1', export_dir=str(tmp_path), start_selenium=False,
+                                           cache_pages=False, verbose=KryxExtractor.KryxLogger.LOG_BASIC)
+    for url in urls:
+        extractor.pages.add(url)
+    return extractor
+
+
+def test_parent_crawled_after_child(tmp_path):
+    extractor = make_extractor(tmp_path, ['https://marklenser.com/5e',
+                                          'https://marklenser.com/5e/spells/fireball',
+                                          'https://marklenser.com/5e/spells'])
+    outline = extractor.build_outline()
+    assert [parent for title, parent in outline] == [None, 2, 0]
+    assert extractor._outline_depths(outline) == [0, 2, 1]
+    html_source = extractor._front_matter_html(outline, [1, 1, 1], 1)
+    assert 'padding-left: 4em' in html_source
@@ -0,0 +1,91 @@
+import KryxPages
+
+SITE = 'https://marklenser.com/5e'
+
+
+def make_registry():
+    registry = KryxPages.PageRegistry(urls=[SITE, SITE + '/spells'])
+    spells = registry.add(SITE + '/spells/fireball')
+    spells.html_path = 'html/fireball.html'
+    spells.pdf_path = 'pdf/page_2_fireball.pdf'
+    spells.content_hash = 'abc'
+    spells.page_count = 2
+    spells.headings = [[1, 'Fireball'], [2, 'At Higher Levels']]
+    spells.timings = {'navigate': 1.5, 'clean': 0.25}
+    spells.duplicate_of = SITE + '/spells'
+    registry.set_links(SITE, [SITE + '/spells', SITE, SITE + '/spells', SITE + '/not-exported'])
+    registry.set_links(SITE + '/spells', [SITE + '/spells/fireball'])
+    return registry
+
+
+def test_registry_order_and_lookup():
+    registry = make_registry()
+    assert registry.urls == [SITE, SITE + '/spells', SITE + '/spells/fireball']
+    assert registry.add(SITE + '/spells').page_number == 1
+    assert len(registry) == 3
+    assert SITE + '/spells' in registry and SITE + '/monsters' not in registry
+    assert registry.get(SITE + '/monsters') is None
+    assert [record.page_number for record in registry] == [0, 1, 2]
+
+
+def test_manifest_round_trip(tmp_path):
+    registry = make_registry()
+    manifest = str(tmp_path / 'pages.json')
+    registry.save(manifest)
+    loaded = KryxPages.PageRegistry.load(manifest)
+    assert loaded.urls == registry.urls
+    assert [record.to_dict() for record in loaded] == [record.to_dict() for record in registry]
+    assert loaded[SITE].links == [1]
+    assert loaded[SITE + '/spells'].links == [2]
+    assert loaded[SITE + '/spells/fireball'].headings == [[1, 'Fireball'], [2, 'At Higher Levels']]
+    assert loaded.add(SITE + '/monsters').page_number == 3
+
+
+def test_reachable():
+    registry = make_registry()
+    assert registry.reachable([0]) == [0, 1, 2]
+    assert registry.reachable([0], max_depth=1) == [0, 1]
+    assert registry.reachable([2]) == [2]
+
+
+def test_flushed_pages_leave_only_their_number_in_memory(tmp_path):
+    import json
+    import tracemalloc
+    registry = KryxPages.PageRegistry()
+    journal_path = str(tmp_path / 'pages.jsonl')
+    page_count = 5000
+    tracemalloc.start()
+    try:
+        with open(journal_path, 'w', encoding='utf-8') as journal:
+            for n in range(page_count):
+                url = '%s/page%d' % (SITE, n)
+                record = registry.add(url)
+                record.headings = [[1, 'Page %d' % n]]
+                record.html_path = 'html/page%d.html' % n
+                registry.set_links(url, ['%s/page%d/link%d' % (SITE, n, k) for k in range(48)]
+                                   + [SITE + '/page0', '%s/page%d' % (SITE, n + 1)])
+                registry.flush(record, journal)
+                if n == 100:
+                    start = tracemalloc.get_traced_memory()[0]
+            end = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    assert registry._records == dict() and registry._link_urls == dict()
+    assert len(registry) == page_count and registry.number(SITE + '/page42') == 42
+    assert registry.get(SITE + '/page42') is None and SITE + '/page42' in registry
+    assert (end - start) / (page_count - 100) < 1024
+    last = registry.add(SITE + '/page%d' % (page_count - 1))
+    last.headings = [[1, 'Last']]
+    registry.set_links(last.url, [SITE + '/page1'])
+    manifest = str(tmp_path / 'pages.json')
+    registry.save(manifest, journal=journal_path)
+    with open(manifest) as file:
+        entries = json.load(file)
+    assert [entry['page_number'] for entry in entries] == list(range(page_count))
+    assert entries[0]['links'] == [1] and entries[7]['links'] == [0, 8]
+    assert entries[-1]['headings'] == [[1, 'Last']] and entries[-1]['links'] == [1]
+    assert 'link_urls' not in entries[0]
+    loaded = KryxPages.PageRegistry.load(manifest)
+    assert len(loaded) == page_count
+    assert loaded[SITE + '/page7'].html_path == 'html/page7.html'
+    assert loaded.reachable([7], max_depth=1) == [0, 7, 8]
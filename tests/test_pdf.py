@@ -0,0 +1,113 @@
+import io
+import os
+from PyPDF2 import PdfFileReader, PdfFileWriter
+import KryxPdf
+from pdfs import make_pdf
+
+
+def naive_merge(filenames):
+    writer = PdfFileWriter()
+    streams = [open(filename, 'rb') for filename in filenames]
+    try:
+        for stream in streams:
+            reader = PdfFileReader(stream, strict=False)
+            for n in range(reader.getNumPages()):
+                writer.addPage(reader.getPage(n))
+        output = io.BytesIO()
+        writer.write(output)
+    finally:
+        for stream in streams:
+            stream.close()
+    return output.getvalue()
+
+
+def test_streaming_merge_shares_fonts_and_images(tmp_path):
+    inputs = [make_pdf(str(tmp_path / ('%s.pdf' % text)), text) for text in ['Fireball', 'Goblin']]
+    output = str(tmp_path / 'compiled.pdf')
+    with open(output, 'wb') as stream:
+        writer = KryxPdf.StreamingPdfWriter(stream)
+        refs = [writer.add_file(filename) for filename in inputs]
+        writer.add_bookmark('Fireball', refs[0][0])
+        writer.add_bookmark('Goblin', refs[1][0])
+        writer.close()
+    assert writer.deduplicated >= 2
+    with open(output, 'rb') as stream:
+        reader = PdfFileReader(stream)
+        assert reader.getNumPages() == 2
+        assert 'Fireball' in reader.getPage(0).extractText()
+        assert 'Goblin' in reader.getPage(1).extractText()
+        fonts = [reader.getPage(n)['/Resources']['/Font'].raw_get('/F1') for n in range(2)]
+        images = [reader.getPage(n)['/Resources']['/XObject'].raw_get('/Im1') for n in range(2)]
+        assert fonts[0].idnum == fonts[1].idnum
+        assert images[0].idnum == images[1].idnum
+        assert [item.title for item in reader.getOutlines()] == ['Fireball', 'Goblin']
+    assert os.path.getsize(output) < len(naive_merge(inputs))
+    assert os.path.getsize(output) < sum(os.path.getsize(filename) for filename in inputs)
+
+
+def test_streaming_merge_keeps_distinct_resources(tmp_path):
+    inputs = [make_pdf(str(tmp_path / 'a.pdf'), 'Fireball'),
+              make_pdf(str(tmp_path / 'b.pdf'), 'Goblin', image=bytes(3 * 32 * 32))]
+    output = io.BytesIO()
+    writer = KryxPdf.StreamingPdfWriter(output, compress=False)
+    for filename in inputs:
+        writer.add_file(filename)
+    writer.close()
+    reader = PdfFileReader(io.BytesIO(output.getvalue()))
+    images = [reader.getPage(n)['/Resources']['/XObject']['/Im1'] for n in range(2)]
+    assert images[0].getData() != images[1].getData()
+    assert images[1].getData() == bytes(3 * 32 * 32)
+    fonts = [reader.getPage(n)['/Resources']['/Font'].raw_get('/F1') for n in range(2)]
+    assert fonts[0].idnum == fonts[1].idnum
+
+
+def volume_page_counts(volumes):
+    counts = []
+    for filename in volumes:
+        with open(filename, 'rb') as stream:
+            counts.append(PdfFileReader(stream).getNumPages())
+    return counts
+
+
+def test_volumes_split_by_page_budget(tmp_path):
+    inputs = [make_pdf(str(tmp_path / ('page%d.pdf' % n)), 'Page %d' % n) for n in range(5)]
+    volumes = KryxPdf.VolumeWriter(str(tmp_path / 'compiled.pdf'), max_pages=2)
+    added = [volumes.add_file(filename, title='Page %d' % n) for n, filename in enumerate(inputs)]
+    volumes.close()
+    names = [str(tmp_path / ('compiled_vol%d.pdf' % n)) for n in (1, 2, 3)]
+    assert volumes.volumes == names
+    assert added == [names[0], names[0], names[1], names[1], names[2]]
+    assert volume_page_counts(volumes.volumes) == [2, 2, 1]
+    with open(names[1], 'rb') as stream:
+        reader = PdfFileReader(stream)
+        assert [item.title for item in reader.getOutlines()] == ['Page 2', 'Page 3']
+        assert 'Page 3' in reader.getPage(1).extractText()
+
+
+def test_volumes_split_by_byte_budget(tmp_path):
+    inputs = [make_pdf(str(tmp_path / ('page%d.pdf' % n)), 'Page %d' % n) for n in range(5)]
+    size = os.path.getsize(inputs[0])
+    volumes = KryxPdf.VolumeWriter(str(tmp_path / 'compiled.pdf'), max_bytes=3 * size + size // 2)
+    for filename in inputs:
+        volumes.add_file(filename)
+    volumes.close()
+    assert volume_page_counts(volumes.volumes) == [3, 2]
+
+
+def test_oversized_input_gets_a_volume_of_its_own(tmp_path):
+    inputs = [make_pdf(str(tmp_path / ('page%d.pdf' % n)), 'Page %d' % n) for n in range(3)]
+    volumes = KryxPdf.VolumeWriter(str(tmp_path / 'compiled.pdf'), max_bytes=10)
+    for filename in inputs:
+        volumes.add_file(filename)
+    volumes.close()
+    assert volume_page_counts(volumes.volumes) == [1, 1, 1]
+
+
+def test_single_volume_without_budgets(tmp_path):
+    inputs = [make_pdf(str(tmp_path / ('page%d.pdf' % n)), 'Page %d' % n) for n in range(3)]
+    volumes = KryxPdf.VolumeWriter(str(tmp_path / 'compiled.pdf'))
+    for filename in inputs:
+        volumes.add_file(filename)
+    volumes.close()
+    assert volumes.volumes == [str(tmp_path / 'compiled.pdf')]
+    assert volume_page_counts(volumes.volumes) == [3]
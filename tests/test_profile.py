@@ -0,0 +1,53 @@
+import json
+import tracemalloc
+import pytest
+import KryxProfile
+
+
+def run_stages(profiler):
+    with profiler.stage('https://marklenser.com/5e', 'clean'):
+        data = [bytes(1024) for n in range(2048)]
+        del data
+    with profiler.stage('https://marklenser.com/5e', 'write_html'):
+        pass
+
+
+@pytest.mark.parametrize('has_reset_peak', [True, False])
+def test_stage_memory_and_stop(monkeypatch, tmp_path, has_reset_peak):
+    if not has_reset_peak:
+        monkeypatch.delattr(tracemalloc, 'reset_peak', raising=False)
+    assert not tracemalloc.is_tracing()
+    profiler = KryxProfile.RunProfiler(enabled=True)
+    run_stages(profiler)
+    assert tracemalloc.is_tracing()
+    memory = profiler.pages['https://marklenser.com/5e']['memory']
+    assert memory['clean'] > 2 * 1024 * 1024
+    assert memory['write_html'] < 1024 * 1024
+    profiler.stop()
+    assert not tracemalloc.is_tracing()
+    profiler.stop()
+    report = str(tmp_path / 'profile_report.txt')
+    profiler.write_report(report)
+    with open(report) as file:
+        text = file.read()
+    assert 'clean' in text and 'Hottest functions, stage write_html' in text
+    with open(report + '.json') as file:
+        assert set(json.load(file)['https://marklenser.com/5e']['stages']) == {'clean', 'write_html'}
+
+
+def test_tracing_started_elsewhere_is_left_running():
+    tracemalloc.start()
+    try:
+        profiler = KryxProfile.RunProfiler(enabled=True)
+        run_stages(profiler)
+        profiler.stop()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+
+def test_disabled_profiler_does_nothing():
+    profiler = KryxProfile.RunProfiler()
+    run_stages(profiler)
+    assert profiler.pages == dict()
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,86 @@
+import json
+import threading
+import http.server
+import pytest
+import KryxRoutes
+import KryxExtractor
+
+FILES = {
+    '/5e': '<html><head><script src="/static/js/main.1a2b.js"></script>'
+           '<script src=\'/static/js/main.1a2b.js\'></script></head><body></body></html>',
+    '/static/js/main.1a2b.js': 'var routes = [{path: "/5e/spells"}, {path: \'/5e/monsters/\'}, {path: "/5e/spells/:id"}];'
+                               'var link = `/5e/themes`; var other = "/static/media/logo.png";'
+                               '__webpack_require__.u = function (e) { return "static/js/" + ({}[e] || e) + "." + '
+                               '{0: "abc123", 7: "def456"}[e] + ".chunk.js" };',
+    '/static/js/0.abc123.chunk.js': 'e.exports = {to: "/5e/monsters/goblin"}; var help = "/5e/spells";',
+    '/static/js/7.def456.chunk.js': 'var a = "/5e/converters/pathfinder-to-5e", b = "/5e/bad route";',
+}
+
+
+class BundleHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in FILES:
+            self.send_response(404)
+            self.end_headers()
+            return
+        data = FILES[self.path].encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def site():
+    server = http.server.HTTPServer(('127.0.0.1', 0), BundleHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%d' % server.server_port
+    server.shutdown()
+    server.server_close()
+
+
+def test_extract_routes():
+    routes = KryxRoutes.extract_routes(FILES['/static/js/main.1a2b.js'], '/5e/')
+    assert routes == ['/5e/spells', '/5e/monsters', '/5e/themes']
+
+
+def test_find_scripts_and_chunks():
+    html_source = FILES['/5e'].replace('</head>', '<script src="https://cdn.example.com/vendor.js"></script></head>')
+    assert KryxRoutes.find_script_urls(html_source, 'https://marklenser.com/5e') == [
+        'https://marklenser.com/static/js/main.1a2b.js', 'https://cdn.example.com/vendor.js']
+    assert KryxRoutes.find_chunk_urls(FILES['/static/js/main.1a2b.js'], 'https://marklenser.com/5e') == [
+        'https://marklenser.com/static/js/0.abc123.chunk.js', 'https://marklenser.com/static/js/7.def456.chunk.js']
+
+
+def test_discover_routes(site, tmp_path):
+    routes = KryxRoutes.discover_routes(site + '/5e')
+    assert routes == [site + path for path in ['/5e/spells', '/5e/monsters', '/5e/themes', '/5e/monsters/goblin',
+                                               '/5e/converters/pathfinder-to-5e']]
+    manifest = str(tmp_path / 'routes.json')
+    KryxRoutes.save_route_manifest(routes, manifest)
+    with open(manifest) as file:
+        assert json.load(file) == routes
+
+
+@pytest.mark.parametrize('route_menus', [True, False])
+def test_menus_clicked_with_routes(tmp_path, route_menus):
+    extractor = KryxExtractor.KryxEtractor(version='1', export_dir=str(tmp_path), start_selenium=False,
+                                           cache_pages=False, ignore_urls=[], route_menus=route_menus)
+    extractor.routes = [extractor.start_url + '/spells']
+    clicked = []
+
+    def get_menuitem_links(html_source):
+        clicked.append(html_source)
+        return ['/5e/menu-only']
+    extractor.get_menuitem_links = get_menuitem_links
+    links = extractor.get_links('<html><a href="/5e/spells">spells</a></html>', url=extractor.start_url)
+    if route_menus:
+        assert len(clicked) == 1
+        assert links == ['https://marklenser.com/5e/menu-only', 'https://marklenser.com/5e/spells']
+    else:
+        assert clicked == []
+        assert links == ['https://marklenser.com/5e/spells']
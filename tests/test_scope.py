@@ -0,0 +1,61 @@
+import KryxUrls
+import KryxExtractor
+
+SITE = 'https://marklenser.com'
+
+
+def make_extractor(tmp_path, **kwargs):
+    return KryxExtractor.KryxEtractor(version='1', export_dir=str(tmp_path), start_selenium=False,
+                                      cache_pages=False, ignore_urls=[], **kwargs)
+
+
+def page(*hrefs):
+    return '<html><body>%s</body></html>' % ''.join('<a href="%s">link</a>' % href for href in hrefs)
+
+
+def test_scope_rules():
+    scope = KryxUrls.UrlScope(include_urls=['/5e/monsters', 'glob:/5e/spells/*', 're:/5e/items/\\d+$'],
+                              exclude_urls=['/5e/monsters/dragons'])
+    assert scope.in_scope('/5e/monsters')
+    assert scope.in_scope('/5e/monsters/goblin')
+    assert not scope.in_scope('/5e/monstersX')
+    assert not scope.in_scope('/5e/monsters/dragons/red')
+    assert scope.in_scope('/5e/spells/fireball')
+    assert scope.in_scope('/5e/items/12')
+    assert not scope.in_scope('/5e/items/sword')
+    assert scope.in_scope(None, '/5e/monsters/goblin')
+    assert KryxUrls.UrlScope().in_scope('/anything')
+
+
+def test_limits():
+    scope = KryxUrls.UrlScope(max_depth=2, max_pages=3)
+    assert scope.depth_allowed(2) and not scope.depth_allowed(3)
+    assert scope.pages_allowed(2) and not scope.pages_allowed(3)
+    unlimited = KryxUrls.UrlScope()
+    assert unlimited.depth_allowed(10 ** 6) and unlimited.pages_allowed(10 ** 6)
+
+
+def test_links_stop_at_max_depth(tmp_path):
+    extractor = make_extractor(tmp_path, max_depth=1)
+    extractor.url_depths[extractor.start_url] = 0
+    links = extractor.get_links(page('/5e/a', '/5e/b'), url=extractor.start_url)
+    assert links == [SITE + '/5e/a', SITE + '/5e/b']
+    assert extractor.url_depths[SITE + '/5e/a'] == 1
+    assert extractor.get_links(page('/5e/c'), url=SITE + '/5e/a') == []
+    assert SITE + '/5e/c' not in extractor.url_depths
+
+
+def test_links_stop_at_max_pages(tmp_path):
+    extractor = make_extractor(tmp_path, max_pages=3)
+    extractor.pages.add(extractor.start_url)
+    links = extractor.get_links(page('/5e/a', '/5e/b', '/5e/c', '/5e/d'), url=extractor.start_url)
+    assert links == [SITE + '/5e/a', SITE + '/5e/b']
+    extractor.stack = links
+    assert extractor.get_links(page('/5e/e'), url=SITE + '/5e/a') == []
+
+
+def test_links_follow_scope_rules(tmp_path):
+    extractor = make_extractor(tmp_path, include_urls=['/5e/monsters'], exclude_urls=['/5e/monsters/dragons'])
+    links = extractor.get_links(page('/5e/monsters/goblin', '/5e/monsters/dragons/red', '/5e/spells/fireball',
+                                     'https://example.com/5e/monsters/orc'), url=extractor.start_url)
+    assert links == [SITE + '/5e/monsters/goblin']
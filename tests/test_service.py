@@ -0,0 +1,210 @@
+import os
+import time
+import json
+import socket
+import threading
+import functools
+import http.server
+import pytest
+from PyPDF2 import PdfFileWriter, PdfFileReader
+import KryxPages
+import KryxCache
+import KryxService
+
+
+@pytest.fixture
+def fixture_site(tmp_path):
+    """A local copy of the site: its stylesheet, served over HTTP."""
+    site = tmp_path / 'site'
+    os.makedirs(str(site / 'static' / 'css'))
+    (site / 'static' / 'css' / 'site.css').write_text('h1 { font-size: 20px }')
+    (site / 'changelog').write_text('<h2>v1.0</h2>')
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(site))
+    handler.log_message = lambda *args: None
+    server = http.server.HTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:%d' % server.server_port
+    server.shutdown()
+    server.server_close()
+
+
+def write_exported_pages(path, site_url):
+    os.makedirs(os.path.join(path, 'pdf'))
+    pages = KryxPages.PageRegistry()
+    for n, name in enumerate(['5e', '5e/spells']):
+        record = pages.add('%s/%s' % (site_url, name))
+        record.pdf_path = os.path.join(path, 'pdf', 'page_%d.pdf' % n)
+        record.page_count = 1
+        writer = PdfFileWriter()
+        writer.addBlankPage(612, 792)
+        with open(record.pdf_path, 'wb') as file:
+            writer.write(file)
+    pages.save(os.path.join(path, 'pages.json'))
+
+
+def request(socket_path, method, path, body=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else b''
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    client.sendall(('%s %s HTTP/1.0\r\nContent-Length: %d\r\n\r\n' % (method, path, len(data))).encode('ascii') + data)
+    data = b''
+    while True:
+        chunk = client.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    client.close()
+    head, body = data.split(b'\r\n\r\n', 1)
+    return int(head.split()[1]), json.loads(body.decode('utf-8'))
+
+
+def test_status_and_rebuild_over_socket(tmp_path, fixture_site):
+    export_dir = str(tmp_path / 'export')
+    write_exported_pages(os.path.join(export_dir, 'KRYX_v1.0'), fixture_site)
+    KryxCache.PageSourceCache(os.path.join(export_dir, 'KRYX_cache'), '1.0').save(
+        fixture_site + '/5e/spells', '<html><head></head><body><h1>Spells</h1></body></html>')
+    socket_path = str(tmp_path / 'service.sock')
+    service = KryxService.KryxService(pool_size=0, socket_path=socket_path, extractor_kwargs=dict(
+        version='1.0', export_dir=export_dir, start_url=fixture_site + '/5e', url_prefix=fixture_site,
+        changelog_url=fixture_site + '/changelog', css_file=['/static/css/site.css'], build_toc=False))
+    thread = threading.Thread(target=service.serve_forever, daemon=True)
+    thread.start()
+    for attempt in range(100):
+        if service.server is not None and os.path.exists(socket_path):
+            break
+        thread.join(0.05)
+    try:
+        status, response = request(socket_path, 'GET', '/status')
+        assert status == 200
+        assert response['version'] == '1.0' and response['pages'] == 2 and response['workers'] == 0
+        status, response = request(socket_path, 'POST', '/rebuild')
+        assert status == 200 and response['pages'] == 2
+        with open(response['output'], 'rb') as file:
+            assert PdfFileReader(file).getNumPages() == 2
+        status, response = request(socket_path, 'POST', '/export',
+                                   dict(urls=[fixture_site + '/5e/spells', fixture_site + '/5e/missing']))
+        assert status == 200
+        spells, missing = response['results']
+        assert spells['ok'] and spells['page'] == 1
+        assert not missing['ok'] and 'not in the page source cache' in missing['error']
+        assert service.primary.pages[fixture_site + '/5e/spells'].headings == [[1, 'Spells']]
+        assert request(socket_path, 'GET', '/nothing')[0] == 404
+    finally:
+        request(socket_path, 'POST', '/shutdown')
+        thread.join(5)
+    assert not thread.is_alive()
+
+
+class FakeElement:
+    def value_of_css_property(self, name):
+        return 'red'
+
+
+class FakeDriver:
+    """Answers like a browser on the fixture site: every page uses a class of its own and a shared one."""
+
+    def __init__(self):
+        self.url = None
+
+    def get(self, url):
+        time.sleep(0.005)
+        self.url = url
+
+    @property
+    def page_source(self):
+        name = self.url.rsplit('/', 1)[-1]
+        return ('<html><head></head><body><h1>%s</h1><div class="shared sc-%s">%s</div>'
+                '<style>%s</style></body></html>' % (name, name, name, 'p { color: red; } ' * 40))
+
+    def execute_script(self, script, *args):
+        if 'getComputedStyle' in script:
+            time.sleep(0.001)
+            return ['color']
+        return 1
+
+    def find_element_by_class_name(self, name):
+        return FakeElement()
+
+    def find_element_by_tag_name(self, name):
+        return FakeElement()
+
+    def quit(self):
+        pass
+
+
+class Exclusive:
+    """Records when two threads are inside the wrapped calls at once."""
+
+    def __init__(self):
+        self.inside = 0
+        self.overlaps = 0
+        self.calls = 0
+        self.guard = threading.Lock()
+
+    def wrap(self, function):
+        def wrapped(*args, **kwargs):
+            with self.guard:
+                self.inside += 1
+                self.calls += 1
+                if self.inside > 1:
+                    self.overlaps += 1
+            try:
+                time.sleep(0.001)
+                return function(*args, **kwargs)
+            finally:
+                with self.guard:
+                    self.inside -= 1
+        return wrapped
+
+
+class CheckedDict(dict):
+    exclusive = None
+
+    def __setitem__(self, key, value):
+        self.exclusive.wrap(super().__setitem__)(key, value)
+
+
+class FakePoolService(KryxService.KryxService):
+    exclusive = None
+
+    def _init_primary(self):
+        primary = super()._init_primary()
+        primary.stored_css = CheckedDict(primary.stored_css)
+        primary.stored_css.exclusive = self.exclusive
+        primary.html_store.write = self.exclusive.wrap(primary.html_store.write)
+        primary.pages.set_links = self.exclusive.wrap(primary.pages.set_links)
+        primary.page_cache.save = self.exclusive.wrap(primary.page_cache.save)
+        return primary
+
+    def _warm(self, extractor):
+        extractor.driver_manager.driver = FakeDriver()
+        extractor.driver_manager.settings_applied = True
+        super()._warm(extractor)
+
+
+def test_warm_pool_exports_in_parallel(tmp_path, fixture_site):
+    FakePoolService.exclusive = Exclusive()
+    service = FakePoolService(pool_size=3, extractor_kwargs=dict(
+        version='1.0', export_dir=str(tmp_path / 'export'), start_url=fixture_site + '/5e', url_prefix=fixture_site,
+        changelog_url=fixture_site + '/changelog', css_file=['/static/css/site.css'], compress_html=True))
+    try:
+        assert all(worker.state_lock is service.lock for worker in service.workers)
+        urls = ['%s/5e/page%d' % (fixture_site, n) for n in range(24)]
+        results = service.export_urls(urls)
+        assert [result['url'] for result in results] == urls
+        assert all(result['ok'] for result in results), results
+        assert sorted(result['page'] for result in results) == list(range(24))
+        pages = service.primary.pages
+        assert len(pages) == 24
+        for n, url in enumerate(urls):
+            record = pages[url]
+            assert record.headings == [[1, 'page%d' % n]]
+            html_source = service.primary.html_store.read(record.html_path)
+            assert '.sc-page%d { color: red;' % n in html_source
+            assert '.shared { color: red;' in html_source
+            assert service.primary.page_cache.load(url)[0] is not None
+        assert set(service.primary.stored_css) == set(['shared'] + ['sc-page%d' % n for n in range(24)])
+        assert FakePoolService.exclusive.calls > 24 * 3
+        assert FakePoolService.exclusive.overlaps == 0
+    finally:
+        service.close()
@@ -0,0 +1,67 @@
+import random
+import pytest
+import KryxSimilar
+
+WORDS = ['word%d' % n for n in range(2000)]
+
+
+def make_page(generator, count=400):
+    return '<html><body><p>%s</p></body></html>' % ' '.join(generator.choice(WORDS) for n in range(count))
+
+
+def jaccard(first, second):
+    first = KryxSimilar.shingle_hashes(KryxSimilar.page_words(first))
+    second = KryxSimilar.shingle_hashes(KryxSimilar.page_words(second))
+    return len(first & second) / len(first | second)
+
+
+def test_near_duplicates_are_flagged():
+    generator = random.Random(42)
+    index = KryxSimilar.SimilarityIndex()
+    original = make_page(generator)
+    variant = original.replace('</p>', ' <b>Variant</b> rules</p>')
+    assert jaccard(original, variant) > 0.95
+    assert index.check('https://marklenser.com/5e/page', original) == (None, 0.0)
+    match, similarity = index.check('https://marklenser.com/5e/page/variant', variant)
+    assert match == 'https://marklenser.com/5e/page' and similarity >= index.threshold
+    assert abs(similarity - jaccard(original, variant)) < 0.1
+    assert 'https://marklenser.com/5e/page/variant' not in index.signatures
+
+
+def test_distinct_pages_are_not_flagged():
+    generator = random.Random(42)
+    index = KryxSimilar.SimilarityIndex()
+    pages = [make_page(generator) for n in range(20)]
+    for n, page in enumerate(pages):
+        assert index.check('https://marklenser.com/5e/page%d' % n, page)[0] is None
+    assert len(index.signatures) == 20
+    half = pages[0][:len(pages[0]) // 2] + pages[1][len(pages[1]) // 2:]
+    assert jaccard(pages[0], half) < 0.6
+    assert index.check('https://marklenser.com/5e/half', half)[0] is None
+
+
+def test_signatures_are_deterministic():
+    page = make_page(random.Random(7))
+    first = KryxSimilar.SimilarityIndex().signature(page)
+    assert first == KryxSimilar.SimilarityIndex().signature(page)
+    assert len(first) == KryxSimilar.DEFAULT_NUM_PERM
+    hidden = page.replace('<body>', '<body><style>p { color: red; }</style><script>var x = 1;</script>')
+    assert KryxSimilar.SimilarityIndex().signature(hidden) == first
+    assert KryxSimilar.SimilarityIndex().signature('<html><body><img src="x.png"></body></html>') is None
+
+
+def test_oldest_signatures_are_evicted():
+    generator = random.Random(3)
+    index = KryxSimilar.SimilarityIndex(max_entries=3)
+    pages = [make_page(generator) for n in range(5)]
+    for n, page in enumerate(pages):
+        index.check('page%d' % n, page)
+    assert list(index.signatures) == ['page2', 'page3', 'page4']
+    assert all(url in index.signatures for bucket in index.buckets for urls in bucket.values() for url in urls)
+    assert index.check('copy0', pages[0])[0] is None
+    assert index.check('copy4', pages[4])[0] == 'page4'
+
+
+def test_bands_must_divide_permutations():
+    with pytest.raises(ValueError):
+        KryxSimilar.SimilarityIndex(num_perm=64, bands=10)
@@ -0,0 +1,39 @@
+import os
+import gzip
+import base64
+import KryxStore
+
+STYLE = '<style type="text/css">%s</style>' % ''.join('.sc-%d { color: red; margin: %dpx; } ' % (i, i) for i in range(20))
+IMAGE = 'data:image/png;base64, %s' % base64.b64encode(bytes(range(256)) * 2).decode()
+
+
+def page(title):
+    return ('<html><head><title>%s</title>%s</head><body><h1>%s</h1><img src="%s"/>'
+            '<style>p { }</style></body></html>' % (title, STYLE, title, IMAGE))
+
+
+def test_write_read_round_trip(tmp_path):
+    store = KryxStore.HtmlStore(str(tmp_path), compress=True)
+    pages = {name: page(name) for name in ['Fireball', 'Goblin']}
+    for name, html_source in pages.items():
+        assert store.write(str(tmp_path / ('%s.html' % name)), html_source) == str(tmp_path / ('%s.html.gz' % name))
+    assert len(os.listdir(store.blob_path)) == 2
+    with gzip.open(str(tmp_path / 'Fireball.html.gz'), 'rt', encoding='utf-8') as file:
+        stored = file.read()
+    assert STYLE not in stored and IMAGE not in stored
+    assert stored.count('kryx-blob:') == 2
+    assert '<style>p { }</style>' in stored
+    assert store.restore(stored) == pages['Fireball']
+    for name, html_source in pages.items():
+        assert store.read(str(tmp_path / ('%s.html' % name))) == html_source
+        assert KryxStore.HtmlStore(str(tmp_path)).read(str(tmp_path / ('%s.html' % name))) == html_source
+
+
+def test_plain_pages(tmp_path):
+    store = KryxStore.HtmlStore(str(tmp_path), compress=False)
+    filename = str(tmp_path / 'Fireball.html')
+    assert store.write(filename, page('Fireball')) == filename
+    with open(filename, encoding='utf-8') as file:
+        assert file.read() == page('Fireball')
+    assert store.read(filename) == page('Fireball')
+    assert not os.path.exists(store.blob_path)
@@ -0,0 +1,51 @@
+import os
+import json
+import random
+import KryxPages
+import KryxExtractor
+from PyPDF2 import PdfFileReader
+from pdfs import make_pdf
+
+SITE = 'https://marklenser.com'
+
+
+def test_streaming_keeps_indexes_bounded(tmp_path):
+    extractor = KryxExtractor.KryxEtractor(version='1', export_dir=str(tmp_path), start_selenium=False,
+                                           cache_pages=False, ignore_urls=[], streaming=True, volume_pages=4,
+                                           near_duplicates='skip', index_cache_size=50, build_toc=False)
+    words = ['word%d' % n for n in range(5000)]
+    generator = random.Random(7)
+    page_count = 300
+    for n in range(page_count):
+        url = '%s/5e/page%d' % (SITE, n)
+        record = extractor.pages.add(url)
+        extractor.url_index.add(url)
+        extractor.url_depths[url] = 1
+        extractor.hit_buttons.append('button%d' % n)
+        match, similarity = extractor.similarity.check(url, ' '.join(generator.choice(words) for k in range(200)))
+        assert match is None
+        extractor.pages.set_links(url, ['%s/5e/page%d' % (SITE, k) for k in range(max(0, n - 3), n)])
+        if n % 30 == 0:
+            record.pdf_path = make_pdf(str(tmp_path / ('page%d.pdf' % n)), 'Page %d' % n)
+            record.page_count = 1
+        extractor.stream_page(record)
+        assert len(extractor.url_index.urls) <= 1
+        assert len(extractor.url_depths) == 0
+        assert len(extractor.hit_buttons) <= 50
+        assert len(extractor.similarity.signatures) <= 50
+        assert len(extractor.pages.records) == 0
+    assert sum(len(bucket) for bucket in extractor.similarity.buckets) <= 50 * len(extractor.similarity.buckets)
+    assert extractor.hit_buttons[-1] == 'button%d' % (page_count - 1)
+    assert not extractor.is_valid_ref('/5e/page3')
+    assert extractor.is_valid_ref('/5e/page%d' % page_count)
+    assert os.path.basename(extractor.make_output_filename(SITE + '/5e/page3', 'pdf')).startswith('page_3_')
+    extractor._close_stream()
+    extractor.save_page_manifest()
+    root, ext = os.path.splitext(os.path.join(extractor.path, extractor.output_filename))
+    for n, expected in enumerate([4, 4, 2]):
+        with open('%s_vol%d%s' % (root, n + 1, ext), 'rb') as file:
+            assert PdfFileReader(file).getNumPages() == expected
+    with open(os.path.join(extractor.path, extractor.page_manifest)) as file:
+        entries = json.load(file)
+    assert len(entries) == page_count and entries[10]['links'] == [7, 8, 9]
+    assert KryxPages.PageRegistry.load(os.path.join(extractor.path, extractor.page_manifest))[SITE + '/5e/page10'].links == [7, 8, 9]
@@ -0,0 +1,26 @@
+import pytest
+import KryxTableExtractor
+
+
+def test_extractors_log_to_their_own_files(tmp_path):
+    extractors = [KryxTableExtractor.KryxTableExtractor(schema=name, version='1', export_dir=str(tmp_path),
+                                                        start_selenium=False, cache_pages=False)
+                  for name in ('spells', 'monsters')]
+    for extractor in extractors:
+        extractor.logger.basic("hello from %s" % extractor.schema.name)
+    for extractor in extractors:
+        for handler in extractor.logger.handlers:
+            handler.flush()
+        with open(extractor.logfile) as file:
+            text = file.read()
+        assert "hello from %s" % extractor.schema.name in text
+        assert extractor.driver_manager.logger is extractor.logger
+    assert extractors[0].logger is not extractors[1].logger
+    assert extractors[0].logfile != extractors[1].logfile
+
+
+def test_missing_version_fails_before_fan_out(monkeypatch):
+    monkeypatch.setattr(KryxTableExtractor.KryxWatch, 'fetch_version', lambda url: None)
+    monkeypatch.setattr(KryxTableExtractor, '_extract_entity', lambda name, kwargs: pytest.fail("fanned out"))
+    with pytest.raises(ValueError):
+        KryxTableExtractor.extract_entities(['spells'])
@@ -0,0 +1,45 @@
+import KryxUrls
+
+SITE = 'https://marklenser.com'
+
+
+def test_canonical_spellings_compare_equal():
+    canonical = SITE + '/5e/spells'
+    for spelling in ['HTTPS://MarkLenser.com/5e/spells', 'https://marklenser.com:443/5e/spells/',
+                     'https://marklenser.com/5e/./spells', 'https://marklenser.com/5e/monsters/../spells',
+                     'https://marklenser.com//5e/spells#fireball', 'https://marklenser.com/5e/spells?utm_source=x']:
+        assert KryxUrls.canonicalize_url(spelling) == canonical
+
+
+def test_canonical_query():
+    assert KryxUrls.canonicalize_url(SITE + '/5e?b=2&a=1') == SITE + '/5e?a=1&b=2'
+    assert KryxUrls.canonicalize_url(SITE + '/5e?a=1&fbclid=x&gclid=y&utm_medium=z') == SITE + '/5e?a=1'
+    assert KryxUrls.canonicalize_url(SITE + '/5e?ref=spells') == SITE + '/5e?ref=spells'
+    assert KryxUrls.canonicalize_url(SITE + '/5e?ref=a') != KryxUrls.canonicalize_url(SITE + '/5e?ref=b')
+
+
+def test_canonical_relative_and_other_schemes():
+    assert KryxUrls.canonicalize_url('fireball', base_url=SITE + '/5e/spells/') == SITE + '/5e/spells/fireball'
+    assert KryxUrls.canonicalize_url('/5e/spells', base_url=SITE + '/5e/monsters') == SITE + '/5e/spells'
+    assert KryxUrls.canonicalize_url('#top', base_url=SITE + '/5e/spells') == SITE + '/5e/spells'
+    assert KryxUrls.canonicalize_url('http://marklenser.com:8080/5e') == 'http://marklenser.com:8080/5e'
+    assert KryxUrls.canonicalize_url('mailto:kryx@example.com') == 'mailto:kryx@example.com'
+
+
+def test_same_site_and_relative_url():
+    assert KryxUrls.same_site(SITE + '/5e/spells', SITE)
+    assert not KryxUrls.same_site('https://www.patreon.com/marklenser', SITE)
+    assert not KryxUrls.same_site('mailto:kryx@example.com', SITE)
+    assert KryxUrls.relative_url(SITE + '/5e/spells?a=1') == '/5e/spells?a=1'
+    assert KryxUrls.relative_url(SITE + '/5e/spells') == '/5e/spells'
+
+
+def test_url_index():
+    index = KryxUrls.CanonicalUrlIndex(urls=['/5e/spells/'], base_url=SITE)
+    assert '/5e/spells' in index
+    assert SITE + '/5e/spells#fireball' in index
+    assert '/5e/spells?ref=x' not in index
+    assert None not in index
+    assert index.add('/5e/spells?utm_campaign=x') == SITE + '/5e/spells'
+    assert len(index) == 1
+    assert index.urls[SITE + '/5e/spells'] == '/5e/spells/'
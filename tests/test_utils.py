@@ -0,0 +1,29 @@
+from bs4 import BeautifulSoup
+from utils import xpath_soup, xpath_soup_many
+
+HTML = ('<html><head><title>Spells</title></head><body>'
+        '<div><p>Fireball</p><span>3rd</span><p>Evocation</p><p>Range: 150 feet</p></div>'
+        '<div><ul><li>Acid Splash</li><li>Blade Ward</li><li><b>Chill</b> Touch</li></ul></div>'
+        '<div><table><tr><td>1</td><td>2</td></tr><tr><td>3</td></tr></table>tail text</div>'
+        '</body></html>')
+
+
+def test_xpath_soup_many_matches_xpath_soup():
+    soup = BeautifulSoup(HTML, 'html.parser')
+    elements = soup.find_all(True)
+    elements += soup.find_all(text=True)
+    elements.reverse()
+    xpaths = xpath_soup_many(elements)
+    assert xpaths == [xpath_soup(element) for element in elements]
+    assert '/html/body/div[3]/table/tr[2]/td' in xpaths
+    assert '/html/body/div/p[3]' in xpaths
+
+
+def test_xpath_soup_many_subsets():
+    soup = BeautifulSoup(HTML, 'html.parser')
+    items = soup.find_all('li')
+    texts = [soup.find(text='Range: 150 feet'), soup.find(text='tail text'), soup.find(text=' Touch')]
+    elements = [items[2], texts[0], items[0], texts[2], texts[1], items[2]]
+    assert xpath_soup_many(elements) == [xpath_soup(element) for element in elements]
+    assert xpath_soup_many(texts) == ['/html/body/div/p[3]', '/html/body/div[3]', '/html/body/div[2]/ul/li[3]']
+    assert xpath_soup_many([]) == []
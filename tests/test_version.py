@@ -0,0 +1,16 @@
+import os
+import pytest
+import KryxExtractor
+
+
+def test_browserless_job_uses_local_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(KryxExtractor.KryxWatch, 'fetch_version', lambda *args, **kwargs: pytest.fail("network access"))
+    os.makedirs(os.path.join(str(tmp_path), 'KRYX_v1.4.2'))
+    extractor = KryxExtractor.KryxEtractor(export_dir=str(tmp_path), start_selenium=False, cache_pages=False)
+    assert extractor.version == '1.4.2'
+
+
+def test_browserless_job_without_local_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(KryxExtractor.KryxWatch, 'fetch_version', lambda *args, **kwargs: pytest.fail("network access"))
+    with pytest.raises(ValueError):
+        KryxExtractor.KryxEtractor(export_dir=str(tmp_path), start_selenium=False, cache_pages=False)
@@ -0,0 +1,67 @@
+import threading
+import http.server
+import pytest
+import KryxWatch
+
+
+class ChangelogHandler(http.server.BaseHTTPRequestHandler):
+    body = '<h2>v1.2.0</h2>'
+    etag = '"a"'
+    requests = []
+
+    def do_GET(self):
+        type(self).requests.append(self.headers.get('If-None-Match'))
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        data = self.body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def changelog_url():
+    ChangelogHandler.body = '<h2>v1.2.0</h2>'
+    ChangelogHandler.requests = []
+    server = http.server.HTTPServer(('127.0.0.1', 0), ChangelogHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%d/changelog' % server.server_port
+    server.shutdown()
+    server.server_close()
+
+
+def test_failed_rebuild_is_retried(tmp_path, changelog_url):
+    state_file = str(tmp_path / 'watch.json')
+    calls = []
+
+    def failing(previous, version):
+        calls.append((previous, version))
+        raise RuntimeError("browser crashed")
+
+    KryxWatch.VersionWatcher(changelog_url, state_file=state_file).watch(failing, interval=0, max_checks=2)
+    assert calls == [(None, '1.2.0'), (None, '1.2.0')]
+    watcher = KryxWatch.VersionWatcher(changelog_url, state_file=state_file)
+    assert watcher.state['built_version'] is None
+    watcher.watch(lambda previous, version: calls.append((previous, version)), interval=0, max_checks=2)
+    assert calls[2:] == [(None, '1.2.0')]
+    assert KryxWatch.VersionWatcher(changelog_url, state_file=state_file).state['built_version'] == '1.2.0'
+
+
+def test_etag_not_kept_without_version(tmp_path, changelog_url):
+    ChangelogHandler.body = '<h2>Changelog</h2>'
+    watcher = KryxWatch.VersionWatcher(changelog_url, state_file=str(tmp_path / 'watch.json'))
+    assert watcher.check() == (None, False)
+    assert watcher.state['etag'] is None
+    ChangelogHandler.body = '<h2>v1.3</h2>'
+    assert watcher.check() == ('1.3', True)
+    assert watcher.state['etag'] == '"a"'
+    assert ChangelogHandler.requests == [None, None]
@@ -20,3 +20,65 @@ def xpath_soup(element):
         child = parent
     components.reverse()
     return '/%s' % '/'.join(components)
+
+
+def xpath_soup_many(elements):
+    """
+    Generate xpaths of many soup elements of the same tree in a single pre-order pass.
+    Only the branches leading to the requested elements are walked, and the position of
+    every child among its same-named siblings is counted once per visited parent, so the
+    cost is the size of those branches rather than depth x siblings for every element.
+    :param elements: list of bs4 text or nodes, all from the same tree
+    :return: list of xpaths as strings, in the order of elements (same format as xpath_soup)
+    """
+    targets = [element if element.name else element.parent for element in elements]
+    if len(targets) == 0:
+        return []
+    on_path = set()
+    for target in targets:
+        node = target
+        while node is not None and id(node) not in on_path:
+            on_path.add(id(node))
+            node = node.parent
+    root = targets[0]
+    while root.parent is not None:
+        root = root.parent
+    wanted = set(id(target) for target in targets)
+    xpaths = dict()
+    stack = [(root, '')]
+    while len(stack) > 0:
+        parent, path = stack.pop()
+        counts = dict()
+        children = []
+        for child in parent.children:
+            if child.name is None:
+                continue
+            counts[child.name] = counts.get(child.name, 0) + 1
+            if id(child) not in on_path:
+                continue
+            index = counts[child.name]
+            child_path = '%s/%s' % (path, child.name if index == 1 else '%s[%d]' % (child.name, index))
+            if id(child) in wanted:
+                xpaths[id(child)] = child_path
+            children.append((child, child_path))
+        stack.extend(reversed(children))
+    return [xpaths.get(id(target), '/') for target in targets]
+
+
+FIND_BY_XPATHS_SCRIPT = """
+return arguments[0].map(function (xpath) {
+    return document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+});
+"""
+
+
+def find_elements_by_soup(selenium_driver, elements):
+    """
+    Resolve many soup elements to WebDriver elements with a single script call
+    :param selenium_driver: selenium webdriver on the page the soup was parsed from
+    :param elements: list of bs4 text or nodes, all from the same tree
+    :return: list of WebElements (None where no element matches), in the order of elements
+    """
+    if len(elements) == 0:
+        return []
+    return selenium_driver.execute_script(FIND_BY_XPATHS_SCRIPT, xpath_soup_many(elements))